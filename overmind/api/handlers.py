@@ -1,17 +1,119 @@
-from piston.handler import BaseHandler
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from piston.handler import BaseHandler, typemapper
+from piston.emitters import JSONEmitter, DateTimeAwareJSONEncoder
 from piston.utils import rc
 from libcloud.types import InvalidCredsException
 
 from provisioning.provider_meta import PROVIDERS
-from provisioning.models import Provider, Node, get_state
+from provisioning.models import Provider, Node, Job, get_state, get_versions
 from provisioning.views import save_new_node, save_new_provider, update_provider
-import copy, logging
+from provisioning.batch import create_nodes
+from provisioning import metrics
+import simplejson as json
+import copy, hashlib, logging
 
 # Unit tests are not working for HttpBasicAuthentication
 # This is a hack until authentication is reimplemented as OAuth
 # (waiting for a new piston version)
 _TESTING = False
 
+def select_fields(request, fields):
+    '''Returns the subset of a handler's fields named in ?fields=a,b,c'''
+    requested = request.GET.get('fields')
+    if not requested:
+        return fields
+    requested = set(requested.split(','))
+    return tuple([f for f in fields
+        if (isinstance(f, tuple) and f[0] or f) in requested])
+
+def paginate(request, query, default_limit=None):
+    '''Keyset pagination with ?limit=N&after=<id>, pages hold default_limit
+    rows when no limit is given (all rows if it is None).
+    Returns the page and the "after" value of the next page, which is
+    None when there are no more pages
+    '''
+    query = query.order_by('id')
+    after = request.GET.get('after')
+    if after:
+        query = query.filter(id__gt=int(after))
+    limit = request.GET.get('limit') or default_limit
+    if not limit:
+        return query, None
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError, "limit must be positive"
+    # Look one row ahead to know whether there is a next page
+    ids = list(query.values_list('id', flat=True)[:limit + 1])
+    next_after = None
+    if len(ids) > limit:
+        next_after = ids[limit - 1]
+    return query[:limit], next_after
+
+def stream_list(request, handler, query, fields, default_limit=None):
+    '''Serialize a paginated queryset as JSON, one row at a time
+    Returns None when the request asks for a format other than plain JSON,
+    so that piston's emitters are used instead
+    '''
+    if request.GET.get('format', 'json') != 'json' or request.GET.get('callback'):
+        return None
+    try:
+        query, next_after = paginate(request, query, default_limit)
+    except ValueError:
+        return rc.BAD_REQUEST
+    fields = select_fields(request, fields)
+    
+    def rows():
+        separator = '['
+        for obj in query.iterator():
+            data = JSONEmitter(obj, typemapper, handler, fields, False).construct()
+            yield separator + "\n" + json.dumps(data,
+                cls=DateTimeAwareJSONEncoder, ensure_ascii=False, indent=4)
+            separator = ','
+        if separator == '[':
+            yield '['
+        yield "\n]"
+    
+    resp = HttpResponse(rows(), mimetype='application/json; charset=utf-8')
+    if next_after is not None:
+        resp['X-Next-After'] = str(next_after)
+    return resp
+
+
+def conditional(*tables):
+    '''Decorator for handler read methods adding a strong ETag built from
+    the change versions of tables and the request path and query string.
+    Requests with a matching If-None-Match get 304 Not Modified without
+    running the read method
+    '''
+    def decorator(read):
+        def wrapper(self, request, *args, **kwargs):
+            versions = get_versions(tables).items()
+            versions.sort()
+            etag = '"%s"' % hashlib.md5(
+                "%s %s" % (versions, request.get_full_path())).hexdigest()
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+            if etag in [tag.strip() for tag in if_none_match.split(',')]:
+                resp = HttpResponseNotModified()
+                resp['ETag'] = etag
+                return resp
+            
+            result = read(self, request, *args, **kwargs)
+            if not isinstance(result, HttpResponse):
+                if request.GET.get('format', 'json') != 'json' or \
+                    request.GET.get('callback'):
+                    return result
+                result = HttpResponse(
+                    JSONEmitter(result, typemapper, self, self.fields,
+                        False).render(request),
+                    mimetype='application/json; charset=utf-8')
+            if result.status_code == 200:
+                result['ETag'] = etag
+            return result
+        wrapper.__doc__ = read.__doc__
+        return wrapper
+    return decorator
+
 class ProviderHandler(BaseHandler):
     fields = ('id', 'name', 'provider_type', 'access_key')
     model = Provider
@@ -40,6 +142,7 @@ class ProviderHandler(BaseHandler):
                 resp.write("\n" + error)
             return resp
     
+    @conditional('provider')
     def read(self, request, *args, **kwargs):
         id = kwargs.get('id')
         
@@ -47,7 +150,7 @@ class ProviderHandler(BaseHandler):
             provider_type = request.GET.get('provider_type')
             name = request.GET.get('name')
             if provider_type is not None:
-                return self.model.objects.filter(
+                query = self.model.objects.filter(
                     provider_type=provider_type,
                 )
             elif name is not None:
@@ -56,7 +159,8 @@ class ProviderHandler(BaseHandler):
                 except self.model.DoesNotExist:
                     return rc.NOT_FOUND
             else:
-                return self.model.objects.all()
+                query = self.model.objects.all()
+            return stream_list(request, self, query, self.fields) or query
         else:
             try:
                 return self.model.objects.get(id=id)
@@ -143,6 +247,7 @@ class NodeHandler(BaseHandler):
                 resp.write("\n" + error)
             return resp
     
+    @conditional('node', 'provider')
     def read(self, request, *args, **kwargs):
         id = kwargs.get('id')
         
@@ -159,9 +264,14 @@ class NodeHandler(BaseHandler):
             provider_id = request.GET.get('provider_id')
             if provider_id is not None:
                 query = query.filter(provider=provider_id)
+            for field in ['instance_type', 'availability_zone']:
+                value = request.GET.get(field)
+                if value is not None:
+                    query = query.filter(**{field: value})
             if request.GET.get('show_decommissioned') != 'true':
                 query = query.exclude(environment='Decommissioned')
-            return query
+            query = query.select_related('provider')
+            return stream_list(request, self, query, self.fields) or query
         else:
             # Return the selected node
             try:
@@ -212,3 +322,74 @@ class NodeHandler(BaseHandler):
             return rc.DELETED
         except self.model.DoesNotExist:
             return rc.NOT_FOUND
+
+
+class NodeBatchHandler(BaseHandler):
+    '''Creates many nodes from one template, see provisioning.batch'''
+    allowed_methods = ('POST',)
+    
+    def create(self, request):
+        if not _TESTING and not request.user.has_perm('provisioning.add_node'):
+            return rc.FORBIDDEN
+        
+        # Modify REST's "provider_id" to "provider" (expected form field)
+        data = copy.deepcopy(request.POST)
+        data['provider'] = data.get('provider_id','')
+        if 'provider_id' in data: del data['provider_id']
+        
+        error, errors, outcomes = create_nodes(data, request.user)
+        if error is None:
+            return {
+                'created': len([o for o in outcomes if o['status'] == 'created']),
+                'failed': len([o for o in outcomes if o['status'] == 'failed']),
+                'unsaved': len([o for o in outcomes
+                    if o['status'] == 'created_unsaved']),
+                'nodes': outcomes,
+            }
+        resp = rc.BAD_REQUEST
+        if error == 'form':
+            for name, field_errors in sorted(errors.items()):
+                for k, v in field_errors.items():
+                    resp.write("\n%s %s: %s" % (name, k, v[0]))
+        else:
+            resp.write("\n" + error)
+        return resp
+
+
+class JobHandler(BaseHandler):
+    '''Read only access to background jobs, so that clients can poll them'''
+    allowed_methods = ('GET',)
+    fields = ('id', 'task', ('provider', ('id', 'name')), 'status',
+        'attempts', 'error', 'created', 'finished')
+    model = Job
+    
+    def read(self, request, *args, **kwargs):
+        id = kwargs.get('id')
+        
+        if id is None:
+            query = self.model.objects.all()
+            provider_id = request.GET.get('provider_id')
+            if provider_id is not None:
+                query = query.filter(provider=provider_id)
+            status = request.GET.get('status')
+            if status is not None:
+                query = query.filter(status=status)
+            # Jobs are never deleted, always return pages
+            limit = getattr(settings, 'JOB_PAGE_SIZE', 100)
+            return stream_list(request, self, query, self.fields, limit) or \
+                query.order_by('id')[:limit]
+        else:
+            try:
+                return self.model.objects.get(id=id)
+            except self.model.DoesNotExist:
+                return rc.NOT_FOUND
+
+
+class MetricsHandler(BaseHandler):
+    '''Provider call and sync metrics of the web server in the Prometheus
+    text format. runworker and pollnodes serve theirs with --metrics-port'''
+    allowed_methods = ('GET',)
+    
+    def read(self, request):
+        return HttpResponse(metrics.registry.render(),
+            mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,7 +1,8 @@
 from django.conf.urls.defaults import *
 from piston.resource import Resource
 from piston.authentication import HttpBasicAuthentication
-from api.handlers import ProviderHandler, NodeHandler
+from api.handlers import ProviderHandler, NodeHandler, NodeBatchHandler
+from api.handlers import JobHandler, MetricsHandler
 import api
 
 # The test url creates resources that do not require authentication
@@ -15,10 +16,17 @@ class CsrfExemptResource(Resource):
 
 provider_resource = CsrfExemptResource(ProviderHandler)
 node_resource = CsrfExemptResource(NodeHandler)
+node_batch_resource = CsrfExemptResource(NodeBatchHandler)
+job_resource = CsrfExemptResource(JobHandler)
+metrics_resource = CsrfExemptResource(MetricsHandler)
 
 urlpatterns = patterns('',
     url(r'^providers/$', provider_resource),
     url(r'^providers/(?P<id>\d+)$', provider_resource),
     url(r'^nodes/$', node_resource),
     url(r'^nodes/(?P<id>\d+)$', node_resource),
+    url(r'^nodes/batch$', node_batch_resource),
+    url(r'^jobs/$', job_resource),
+    url(r'^jobs/(?P<id>\d+)$', job_resource),
+    url(r'^metrics$', metrics_resource),
 )
@@ -1,10 +1,19 @@
 from django.test import TestCase
 from django.test.client import Client
+from django.conf import settings
 from django.contrib.auth.models import User, Group, Permission
-from provisioning.models import Provider, Node
+from provisioning.models import Provider, Node, Image, Location, Size
+from provisioning import jobs, batch
+from provisioning.controllers import controller_pool
+from provisioning.provider_meta import enable_simulated_providers
+from django.core.cache import cache
+from django.db import IntegrityError
 import simplejson as json
 import copy, logging
 
+# NodeBatchTest uses the simulated cloud
+enable_simulated_providers()
+
 
 class BaseProviderTestCase(TestCase):
     urls = 'overmind.test_urls'
@@ -160,9 +169,42 @@ class CreateProviderTest(BaseProviderTestCase):
         resp = self.client.post(
             self.path, json.dumps(data), content_type='application/json')
         
+        # Nodes are imported by the worker
+        self.assertEquals(len(Node.objects.all()), 0)
+        jobs.run_pending()
+        
         # There should be exactly 2 nodes in the DB now
         self.assertEquals(len(Node.objects.all()), 2)
     
+    def test_create_provider_should_queue_import(self):
+        '''Should queue an import job that can be polled'''
+        new_data = self.create_provider()
+        resp = self.client.get(
+            "/api/jobs/?provider_id=%s" % new_data['id'])
+        self.assertEquals(resp.status_code, 200)
+        job = json.loads(resp.content)[0]
+        self.assertEquals(job['task'], 'import_provider')
+        self.assertEquals(job['status'], 'Queued')
+        
+        jobs.run_pending()
+        resp = self.client.get("/api/jobs/%s" % job['id'])
+        self.assertEquals(json.loads(resp.content)['status'], 'Done')
+    
+    def test_list_jobs_paginated(self):
+        '''Should list jobs a page at a time'''
+        queued = [jobs.enqueue('import_provider') for i in range(3)]
+        page_size = getattr(settings, 'JOB_PAGE_SIZE', 100)
+        settings.JOB_PAGE_SIZE = 2
+        try:
+            resp = self.client.get("/api/jobs/")
+        finally:
+            settings.JOB_PAGE_SIZE = page_size
+        self.assertEquals([job['id'] for job in json.loads(resp.content)],
+            [job.id for job in queued[:2]])
+        resp = self.client.get("/api/jobs/?after=%s" % resp['X-Next-After'])
+        self.assertEquals([job['id'] for job in json.loads(resp.content)],
+            [queued[2].id])
+    
     def test_create_provider_missing_access_key(self):
         """Should not create a new provider when access_key is missing"""
         data = {'name': 'A new provider', 'provider_type': 'DUMMY'}
@@ -267,3 +309,190 @@ class DeleteProviderTest(BaseProviderTestCase):
             self.fail('The provider was not deleted from the DB')
         except Provider.DoesNotExist:
             pass
+
+
+class ReadNodeTest(BaseProviderTestCase):
+    def setUp(self):
+        super(ReadNodeTest, self).setUp()
+        self.path = "/api/nodes/"
+        controller_pool.clear()
+        self.p1 = Provider(name="prov1", provider_type="DUMMY", access_key="keyzz")
+        self.p1.save()
+        self.p1.import_nodes()
+        self.nodes = Node.objects.filter(provider=self.p1).order_by('id')
+    
+    def test_get_all_nodes(self):
+        '''Should show all nodes with their provider and extra data'''
+        response = self.client.get(self.path)
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals([n['id'] for n in data], [n.id for n in self.nodes])
+        self.assertEquals(data[0]['provider'], {
+            'id': self.p1.id, 'name': self.p1.name,
+            'provider_type': self.p1.provider_type})
+        self.assertEquals(data[0]['extra_data'], self.nodes[0].extra_data())
+    
+    def test_get_nodes_fields(self):
+        '''Should only show the requested fields'''
+        response = self.client.get(self.path + "?fields=id,name")
+        self.assertEquals(json.loads(response.content), [
+            {'id': n.id, 'name': n.name} for n in self.nodes])
+    
+    def test_get_nodes_paginated(self):
+        '''Should return pages of nodes with a cursor to the next page'''
+        response = self.client.get(self.path + "?limit=1&fields=id")
+        self.assertEquals(json.loads(response.content), [{'id': self.nodes[0].id}])
+        self.assertEquals(response['X-Next-After'], str(self.nodes[0].id))
+        
+        response = self.client.get(
+            self.path + "?limit=1&fields=id&after=%s" % response['X-Next-After'])
+        self.assertEquals(json.loads(response.content), [{'id': self.nodes[1].id}])
+        self.assertFalse(response.has_header('X-Next-After'))
+    
+    def test_get_nodes_bad_limit(self):
+        '''Should return BAD_REQUEST for an invalid limit'''
+        response = self.client.get(self.path + "?limit=zero")
+        self.assertEquals(response.status_code, 400)
+    
+    def test_get_nodes_not_modified(self):
+        '''Should return NOT_MODIFIED until a node changes'''
+        response = self.client.get(self.path)
+        etag = response['ETag']
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        
+        # Other query parameters get another ETag
+        response = self.client.get(self.path + "?fields=id", HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        
+        self.nodes[0].decommission()
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+    
+    def test_get_node_by_id_etag(self):
+        '''Should add an ETag to single nodes'''
+        response = self.client.get(self.path + str(self.nodes[0].id))
+        self.assertEquals(json.loads(response.content)['id'], self.nodes[0].id)
+        response = self.client.get(self.path + str(self.nodes[0].id),
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+
+class MetricsTest(BaseProviderTestCase):
+    def test_metrics(self):
+        '''Should expose provider call metrics in the Prometheus format'''
+        controller_pool.clear()
+        p1 = Provider(name="prov1", provider_type="DUMMY", access_key="keyzz")
+        p1.save()
+        p1.import_nodes()
+        response = self.client.get('/api/metrics')
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertTrue('overmind_provider_calls_total{provider="prov1",'
+            'provider_type="DUMMY",operation="get_nodes"}' in response.content)
+        self.assertTrue('overmind_sync_rows_total{provider="prov1",'
+            'stage="import_nodes",outcome="created"}' in response.content)
+
+
+class NodeBatchTest(BaseProviderTestCase):
+    def setUp(self):
+        super(NodeBatchTest, self).setUp()
+        self.path = "/api/nodes/batch"
+        self.client.login(username='testuser', password='test1')
+        controller_pool.clear()
+        cache.clear()
+        self.p1 = Provider(name="sim", provider_type="simulated",
+            access_key="batch", extra_param_name="options",
+            extra_param_value="nodes=0&distribution=constant")
+        self.p1.save()
+        self.p1.conn.conn.ex_reset()
+        self.p1.import_images()
+        self.p1.import_sizes()
+        self.p1.import_locations()
+        image = Image.objects.filter(provider=self.p1)[0]
+        image.favorite = True
+        image.save()
+        self.template = {'provider_id': self.p1.id, 'image': image.id,
+            'size': Size.objects.filter(provider=self.p1)[0].id,
+            'location': Location.objects.get(provider=self.p1).id}
+    
+    def set_options(self, options):
+        Provider.objects.filter(id=self.p1.id).update(extra_param_value=options)
+        controller_pool.clear()
+    
+    def test_create_nodes_in_parallel(self):
+        '''Should create count nodes concurrently and save them'''
+        self.set_options("nodes=0&distribution=constant&create_node_latency=0.2")
+        data = dict(self.template, name='web-%02d', count=5)
+        response = self.client.post(self.path, data)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(self.p1.conn.conn.cloud.peak_in_flight > 1)
+        result = json.loads(response.content)
+        self.assertEquals((result['created'], result['failed']), (5, 0))
+        self.assertEquals([n['name'] for n in result['nodes']],
+            ['web-01', 'web-02', 'web-03', 'web-04', 'web-05'])
+        nodes = Node.objects.filter(provider=self.p1).order_by('name')
+        self.assertEquals([n.id for n in nodes],
+            [n['node']['id'] for n in result['nodes']])
+        self.assertEquals(nodes[0].state, 'Pending')
+        self.assertEquals(nodes[0].creator, 'testuser')
+    
+    def test_create_named_nodes(self):
+        '''Should create nodes with the given names'''
+        data = dict(self.template, names='db1, db2')
+        response = self.client.post(self.path, data)
+        self.assertEquals(json.loads(response.content)['created'], 2)
+        self.assertEquals(Node.objects.filter(
+            provider=self.p1, name__in=['db1', 'db2']).count(), 2)
+    
+    def test_validate_before_creating(self):
+        '''Should create no node when any of them is invalid'''
+        self.client.post(self.path, dict(self.template, names='web1'))
+        response = self.client.post(self.path,
+            dict(self.template, names='web1,web2'))
+        self.assertEquals(response.status_code, 400)
+        self.assertTrue('web1 name: A node with that name already exists'
+            in response.content)
+        response = self.client.post(self.path,
+            dict(self.template, size='', name='web', count=2))
+        self.assertEquals(response.status_code, 400)
+        self.assertTrue('web-2 size:' in response.content)
+        response = self.client.post(self.path, dict(self.template, name='web'))
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Node.objects.filter(provider=self.p1).count(), 1)
+    
+    def test_report_failures(self):
+        '''Should return the outcome of every node'''
+        self.set_options("nodes=0&failure_rate=1")
+        response = self.client.post(self.path,
+            dict(self.template, name='web', count=2))
+        result = json.loads(response.content)
+        self.assertEquals((result['created'], result['failed']), (0, 2))
+        self.assertEquals(result['nodes'][0]['node'], None)
+        self.assertTrue('Simulated failure' in result['nodes'][0]['error'])
+        self.assertEquals(Node.objects.filter(provider=self.p1).count(), 0)
+    
+    def test_batch_insert_failure(self):
+        '''Should save the nodes one by one when the batched insert fails and
+        report the created nodes that could not be saved'''
+        save_nodes = batch.save_nodes
+        def name_taken(provider, nodes):
+            # Another request took a name after the validation
+            Node(name='web-2', uuid='other', provider=provider).save()
+            raise IntegrityError('column name is not unique')
+        batch.save_nodes = name_taken
+        try:
+            response = self.client.post(self.path,
+                dict(self.template, name='web', count=3))
+        finally:
+            batch.save_nodes = save_nodes
+        result = json.loads(response.content)
+        self.assertEquals(
+            (result['created'], result['failed'], result['unsaved']), (2, 0, 1))
+        outcome = result['nodes'][1]
+        self.assertEquals(outcome['status'], 'created_unsaved')
+        self.assertTrue(outcome['uuid'])
+        self.assertEquals(outcome['node'], None)
+        self.assertEquals(Node.objects.filter(provider=self.p1,
+            name__in=['web-1', 'web-3']).count(), 2)
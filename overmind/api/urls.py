@@ -2,7 +2,8 @@ from django.conf.urls.defaults import *
 from piston.resource import Resource
 from piston.authentication import HttpBasicAuthentication
 
-from api.handlers import ProviderHandler, NodeHandler
+from api.handlers import ProviderHandler, NodeHandler, NodeBatchHandler
+from api.handlers import JobHandler, MetricsHandler
 
 
 auth = HttpBasicAuthentication(realm="overmind")
@@ -16,10 +17,17 @@ class CsrfExemptResource(Resource):
 
 provider_resource = CsrfExemptResource(ProviderHandler, **ad)
 node_resource = CsrfExemptResource(NodeHandler, **ad)
+node_batch_resource = CsrfExemptResource(NodeBatchHandler, **ad)
+job_resource = CsrfExemptResource(JobHandler, **ad)
+metrics_resource = CsrfExemptResource(MetricsHandler, **ad)
 
 urlpatterns = patterns('',
     url(r'^providers/$', provider_resource),
     url(r'^providers/(?P<id>\d+)$', provider_resource),
     url(r'^nodes/$', node_resource),
     url(r'^nodes/(?P<id>\d+)$', node_resource),
+    url(r'^nodes/batch$', node_batch_resource),
+    url(r'^jobs/$', job_resource),
+    url(r'^jobs/(?P<id>\d+)$', job_resource),
+    url(r'^metrics$', metrics_resource),
 )
@@ -0,0 +1 @@
+# Benchmarks and fake services used to measure Overmind's performance
@@ -0,0 +1,91 @@
+# Local fake of the Hetzner robot API
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import simplejson as json
+import threading, time
+
+
+class RobotHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send(self, status, content, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def do_GET(self):
+        robot = self.server
+        robot.count(self.path)
+        time.sleep(robot.latency)
+        if robot.take_throttled():
+            self._send(403, json.dumps({'error': {'status': 403,
+                'code': 'RATE_LIMIT_EXCEEDED', 'message': 'Rate limit exceeded'}}))
+            return
+        path = self.path.strip('/').split('/')
+        if path == ['server']:
+            self._send(200, json.dumps([{'server': {
+                'server_ip': ip, 'product': 'EQ 4', 'dc': '12',
+                'traffic': '5 TB', 'status': 'ready', 'paid_until': '2010-12-31',
+            }} for ip in robot.ips]))
+        elif len(path) == 2 and path[0] == 'server' and path[1] in robot.ips:
+            if robot.failures.get(path[1], 0) > 0:
+                robot.failures[path[1]] -= 1
+                self._send(500, 'Internal error')
+                return
+            # Details never change, their ETag is the server ip
+            etag = '"%s"' % path[1]
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, '', etag)
+                return
+            self._send(200, json.dumps({'server': {
+                'server_ip': path[1], 'ip': [path[1]], 'subnet': None}}), etag)
+        else:
+            self._send(404, 'Server not found')
+
+
+class FakeRobot(ThreadingMixIn, HTTPServer):
+    '''Serves a list of servers (10.0.x.y) at http://127.0.0.1:<port>/
+    Every request takes latency seconds. failures maps a server ip to the
+    number of times its details request fails before succeeding. The first
+    throttled requests are refused with 403 RATE_LIMIT_EXCEEDED
+    '''
+    daemon_threads = True
+    
+    def __init__(self, servers=10, latency=0.0, failures=None, throttled=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RobotHandler)
+        self.ips = ['10.0.%s.%s' % (i / 250, i % 250 + 1) for i in range(servers)]
+        self.latency = latency
+        self.failures = failures or {}
+        self.throttled = throttled
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.host = 'http://127.0.0.1:%s/' % self.server_address[1]
+    
+    def count(self, path):
+        self.lock.acquire()
+        self.requests[path] = self.requests.get(path, 0) + 1
+        self.lock.release()
+    
+    def take_throttled(self):
+        self.lock.acquire()
+        try:
+            if self.throttled > 0:
+                self.throttled -= 1
+                return True
+            return False
+        finally:
+            self.lock.release()
+    
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        return self
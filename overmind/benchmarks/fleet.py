@@ -0,0 +1,212 @@
+'''Synthetic-scale benchmark of the provisioning data paths
+
+Seeds a fleet of "synthetic" plugin providers and measures imports,
+resyncs, decommissioning, the overview page and the node API listing.
+Every stage records its wall time, number of SQL queries, the resident
+memory of the process after it ran and how much that grew during the stage.
+Run it with "manage.py benchmark", which uses a throwaway test database
+'''
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.contrib.auth.models import User
+from django.test.client import Client
+from django.utils.http import urlencode
+from provisioning.models import Provider, Node
+from provisioning.provider_meta import enable_simulated_providers
+import base64, datetime, platform, subprocess, time
+import django
+
+# Fleet totals, split evenly among the providers
+DEFAULTS = {
+    'providers': 10, 'images': 50000, 'sizes': 100, 'locations': 10,
+    'nodes': 10000,
+    # Fraction of nodes destroyed, created and terminated before the churn resync
+    'churn': 0.05,
+    # Number of nodes decommissioned one by one
+    'decommission': 100,
+}
+USER = 'benchmark'
+PASSWORD = 'benchmark'
+
+
+def resident_memory():
+    '''Current resident memory of this process in KB, None where
+    /proc/self/status is not available. Not ru_maxrss: that is the peak of
+    the whole process, which hides what later stages use'''
+    try:
+        f = open('/proc/self/status')
+    except IOError:
+        return None
+    try:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+    return None
+
+def revision():
+    '''Returns the git commit of the working tree, or None'''
+    try:
+        out = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+        return out.strip() or None
+    except OSError:
+        return None
+
+def share(total, parts, index):
+    '''Part of total given to the index-th of parts'''
+    return total / parts + (index < total % parts and 1 or 0)
+
+def measure(name, func, *args):
+    '''Run func(*args) and return the measurements of the stage'''
+    debug = settings.DEBUG
+    # Queries are only logged in DEBUG mode
+    settings.DEBUG = True
+    reset_queries()
+    rss_before = resident_memory()
+    start = time.time()
+    try:
+        detail = func(*args)
+        wall = time.time() - start
+        queries = len(connection.queries)
+    finally:
+        reset_queries()
+        settings.DEBUG = debug
+    rss = resident_memory()
+    rss_delta = None
+    if rss is not None and rss_before is not None:
+        rss_delta = rss - rss_before
+    return {
+        'name': name, 'wall': round(wall, 4), 'queries': queries,
+        'rss_kb': rss, 'rss_delta_kb': rss_delta, 'detail': detail,
+    }
+
+def add_stats(total, stats):
+    for key, value in (stats or {}).items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+def seed(params):
+    providers = []
+    for i in range(params['providers']):
+        options = {'nodes': share(params['nodes'], params['providers'], i)}
+        for field in ('images', 'sizes', 'locations'):
+            options[field] = max(1, share(params[field], params['providers'], i))
+        p = Provider(
+            name='bench%s' % i, provider_type='synthetic',
+            access_key='bench%s' % i, extra_param_name='options',
+            extra_param_value=urlencode(sorted(options.items())),
+        )
+        p.save()
+        # Start from the initial nodes if the cloud was used before
+        p.conn.conn.ex_reset()
+        providers.append(p)
+    User.objects.create_superuser(USER, 'benchmark@localhost', PASSWORD)
+    return providers
+
+def import_images(providers):
+    total = {}
+    for p in providers:
+        add_stats(total, p.import_images())
+    return total
+
+def import_sizes_locations(providers):
+    total = {}
+    for p in providers:
+        add_stats(total, p.import_sizes())
+        add_stats(total, p.import_locations())
+    return total
+
+def import_nodes(providers):
+    total = {}
+    for p in providers:
+        add_stats(total, p.import_nodes())
+    return total
+
+def update_providers(providers):
+    '''Refresh cycle saving every provider first, as syncs used to'''
+    total = {}
+    for p in providers:
+        add_stats(total, p.update())
+    return total
+
+def refresh_providers(providers):
+    total = {}
+    for p in providers:
+        add_stats(total, p.refresh())
+    return total
+
+def decommission(nodes):
+    for node in nodes:
+        node.decommission()
+    return {'decommissioned': len(nodes)}
+
+def get(client, path):
+    response = client.get(path, HTTP_AUTHORIZATION='Basic %s' %
+        base64.b64encode('%s:%s' % (USER, PASSWORD)))
+    # Join streamed responses
+    content = response.content
+    if response.status_code != 200:
+        raise Exception, 'GET %s returned %s' % (path, response.status_code)
+    return {'bytes': len(content)}
+
+def run(**params):
+    '''Run all stages and return the results as a dict
+    params override DEFAULTS. The database must be empty
+    '''
+    params = dict(DEFAULTS, **params)
+    enable_simulated_providers()
+    results = {
+        'revision': revision(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': settings.DATABASE_ENGINE,
+        'params': params,
+        'stages': [],
+    }
+    stages = results['stages']
+    stage = measure('seed', seed, params)
+    providers = stage.pop('detail')
+    stage['detail'] = {'providers': len(providers)}
+    stages.append(stage)
+    stages.append(measure('import_images', import_images, providers))
+    stages.append(measure(
+        'import_sizes_locations', import_sizes_locations, providers))
+    stages.append(measure('import_nodes_first', import_nodes, providers))
+    stages.append(measure('import_nodes_resync', import_nodes, providers))
+    # Both resync unchanged nodes, the difference is the cost of saving
+    stages.append(measure('update_cycle', update_providers, providers))
+    stages.append(measure('refresh_cycle', refresh_providers, providers))
+    for p in providers:
+        p.conn.conn.ex_churn(params['churn'])
+    stages.append(measure('import_nodes_churn', import_nodes, providers))
+
+    nodes = list(Node.objects.exclude(environment='Decommissioned').order_by(
+        'id')[:params['decommission']])
+    stages.append(measure('decommission', decommission, nodes))
+
+    client = Client(REMOTE_ADDR='10.0.0.1')# Not an INTERNAL_IP, no debug toolbar
+    client.login(username=USER, password=PASSWORD)
+    stages.append(measure('overview', get, client, '/overview/'))
+    stages.append(measure('api_nodes', get, client, '/api/nodes/'))
+    return results
+
+def compare(results, baseline):
+    '''Returns a line per stage comparing results with the ones of a
+    previous run'''
+    before = dict([(s['name'], s) for s in baseline['stages']])
+    lines = []
+    if results['params'] != baseline['params']:
+        lines.append('Warning: the runs used different parameters')
+    for stage in results['stages']:
+        old = before.get(stage['name'])
+        if old is None:
+            lines.append('%-24s new stage' % stage['name'])
+            continue
+        change = old['wall'] and 100.0 * (stage['wall'] - old['wall']) / old['wall']
+        lines.append('%-24s %8.3fs -> %8.3fs (%+6.1f%%)  queries %s -> %s' % (
+            stage['name'], old['wall'], stage['wall'], change,
+            old['queries'], stage['queries']))
+    return lines
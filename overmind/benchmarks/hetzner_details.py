@@ -0,0 +1,42 @@
+#!/usr/bin/python
+'''Compare sequential and concurrent server detail fetching of the Hetzner
+plugin against a local fake robot server
+
+Usage: python benchmarks/hetzner_details.py [servers] [latency] [concurrency]
+'''
+import os, shutil, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'provisioning', 'plugins'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from benchmarks.fake_robot import FakeRobot
+import hetzner
+from provisioning.httpcache import ResponseCache
+
+
+def run(servers, latency, concurrency):
+    robot = FakeRobot(servers, latency).start()
+    # Every run starts with a full request budget and an empty cache
+    hetzner.limiter.clear()
+    driver = hetzner.Driver('user', 'password', host=robot.host,
+        concurrency=concurrency)
+    cache_dir = tempfile.mkdtemp(prefix='hetzner-cache-')
+    driver.connection.cache = ResponseCache(cache_dir, ttls=hetzner.CACHE_TTLS)
+    start = time.time()
+    nodes = driver.list_nodes()
+    elapsed = time.time() - start
+    driver.connection.close()
+    shutil.rmtree(cache_dir)
+    robot.shutdown()
+    robot.server_close()
+    assert len(nodes) == servers
+    return elapsed
+
+if __name__ == "__main__":
+    servers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else hetzner.DETAIL_CONCURRENCY
+    sequential = run(servers, latency, 1)
+    concurrent = run(servers, latency, concurrency)
+    print "%s servers, %ss latency per request" % (servers, latency)
+    print "sequential:      %.2fs" % sequential
+    print "concurrency %-3s  %.2fs (%.1fx faster)" % (
+        concurrency, concurrent, sequential / concurrent)
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+'''Measure how long a fresh process takes to load Overmind's models,
+which builds the provider registry, with eagerly imported plugins
+(before) and with the plugin manifest (after)
+
+Usage: python benchmarks/startup.py [runs]
+'''
+import os, subprocess, sys, time
+
+OVERMIND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SETUP = """
+import time, sys
+start = time.time()
+import settings
+from django.core.management import setup_environ
+setup_environ(settings)
+if %(eager)s:
+    from provisioning import plugins
+    plugins.load_plugins(eager=True)
+import provisioning.models
+sys.stdout.write('%%f %%s' %% (time.time() - start,
+    len([m for m in sys.modules if m.startswith('httplib2')])))
+"""
+
+def run(eager, runs):
+    times = []
+    for i in range(runs):
+        out = subprocess.Popen(
+            [sys.executable, '-c', SETUP % {'eager': eager}],
+            cwd=OVERMIND_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        ).communicate()[0]
+        elapsed, httplib2_loaded = out.split()
+        times.append(float(elapsed))
+    times.sort()
+    return times[len(times) / 2], httplib2_loaded != '0'
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for label, eager in [('eager plugins (before)', True), ('manifest (after)', False)]:
+        median, httplib2_loaded = run(eager, runs)
+        print "%-24s median %.1fms, httplib2 imported: %s" % (
+            label, median * 1000, httplib2_loaded)
@@ -0,0 +1,183 @@
+# Creation of many nodes from one template
+from django.conf import settings
+from django.db import transaction
+from provisioning.models import Provider, Node, get_state, table_changed
+from provisioning.models import bump_versions_once
+from provisioning.forms import NodeForm
+from provisioning.controllers import controller_pool
+from provisioning.bulk import bulk_insert
+from provisioning.workers import run_bounded
+import logging
+
+
+def build_node(form, data_from_provider, user):
+    '''Returns an unsaved Node for a valid NodeForm and the node data
+    returned by ProviderController.create_node'''
+    node = form.save(commit = False)
+    node.uuid      = data_from_provider['uuid']
+    node.public_ip = data_from_provider['public_ip']
+    node.state     = get_state(data_from_provider['state'])
+    node.save_extra_data(data_from_provider.get('extra', ''))
+    node.creator   = user.username
+    return node
+
+def batch_names(data):
+    '''Returns the node names of a batch request: either the comma separated
+    "names" or "count" names made from the "name" pattern. The pattern gets
+    the node number (starting at 1) like web-%02d, or "-<number>" appended
+    when it has no placeholder
+    '''
+    names = data.get('names')
+    if names:
+        return [name.strip() for name in names.split(',') if name.strip()]
+    pattern = data.get('name', '')
+    if not pattern:
+        raise ValueError, 'Either names or name and count are needed'
+    try:
+        count = int(data.get('count', ''))
+    except ValueError:
+        raise ValueError, 'count must be a number'
+    if '%' not in pattern:
+        pattern += '-%d'
+    try:
+        return [pattern % i for i in range(1, count + 1)]
+    except (TypeError, ValueError):
+        raise ValueError, 'Invalid name pattern "%s"' % pattern
+
+def validate_batch(provider, data, names):
+    '''Returns a valid NodeForm for every name, or None and a dict with the
+    errors of every invalid name'''
+    max_nodes = getattr(settings, 'NODE_BATCH_MAX', 100)
+    if not names:
+        return None, {'names': ['No node names given']}
+    if len(names) > max_nodes:
+        return None, {'names': [
+            'At most %s nodes can be created at once' % max_nodes]}
+
+    errors = {}
+    seen = set()
+    for name in names:
+        if name in seen:
+            errors[name] = {'name': ['Name given more than once']}
+        seen.add(name)
+    # One query for all the names already in use
+    for name in Node.objects.filter(
+            provider=provider, name__in=names).values_list('name', flat=True):
+        errors[name] = {'name': ['A node with that name already exists']}
+
+    forms = []
+    for name in names:
+        form_data = data.copy()
+        form_data['name'] = name
+        form = NodeForm(provider.id, form_data)
+        if not form.is_valid():
+            errors.setdefault(name, {}).update(form.errors)
+        forms.append(form)
+    if errors:
+        return None, errors
+    return forms, None
+
+@transaction.commit_on_success()
+def save_nodes(provider, nodes):
+    '''Insert all new nodes with batched INSERTs
+    Returns a dict name => saved Node'''
+    bulk_insert(Node, nodes)
+    table_changed('node')
+    return dict([(n.name, n) for n in Node.objects.filter(
+        provider=provider, name__in=[n.name for n in nodes])])
+
+@bump_versions_once
+def save_each(nodes):
+    '''Save nodes one by one, used when the batched insert failed so that a
+    single bad node (a name taken meanwhile) doesn't lose the others.
+    Returns a dict name => saved Node and a dict name => save error
+    '''
+    saved, errors = {}, {}
+    for node in nodes:
+        try:
+            node.save()
+            saved[node.name] = node
+        except Exception, e:
+            transaction.rollback_unless_managed()
+            errors[node.name] = e
+    return saved, errors
+
+def create_nodes(data, user, workers=None, timeout=None):
+    '''Create a batch of nodes sharing provider, image, size, location and
+    plugin fields. The names are given by batch_names().
+    All nodes are validated before any is created. Then they are created
+    at the provider in parallel, by at most settings.NODE_BATCH_WORKERS
+    threads, each using the pooled controller of its thread (drivers are
+    not thread safe). Creations taking longer than settings.NODE_BATCH_TIMEOUT
+    seconds are reported as failed, although the provider may still
+    create them, in which case the next sync imports them. Only this
+    thread writes to the DB, late results of abandoned creations are
+    dropped.
+    The created nodes are saved in a single transaction, or one by one if
+    that fails.
+    Returns error, errors, outcomes: error is None, 'form' when the errors
+    dict holds the validation errors of each name, or a message.
+    outcomes has a dict with name, status, error, duration, uuid (at the
+    provider) and node (the saved Node or None) for every name. status is
+    'created', 'failed' (not created at the provider) or 'created_unsaved'
+    when the node exists at the provider but could not be saved. The next
+    sync of the provider imports those
+    '''
+    if workers is None:
+        workers = getattr(settings, 'NODE_BATCH_WORKERS', 10)
+    if timeout is None:
+        timeout = getattr(settings, 'NODE_BATCH_TIMEOUT', None)
+    try:
+        provider = Provider.objects.get(id=data.get('provider') or None)
+    except (Provider.DoesNotExist, ValueError):
+        return 'Incorrect provider id', None, None
+    try:
+        names = batch_names(data)
+    except ValueError, e:
+        return unicode(e), None, None
+    forms, errors = validate_batch(provider, data, names)
+    if errors:
+        return 'form', errors, None
+
+    forms = dict(zip(names, forms))
+    def create(name):
+        error, data_from_provider = controller_pool.get(
+            provider).create_node(forms[name])
+        if error is not None:
+            raise error
+        return data_from_provider
+
+    outcomes = []
+    new_nodes = []
+    for r in run_bounded(create, names, workers, timeout):
+        outcome = {'name': r.item, 'status': 'failed', 'error': None,
+            'duration': round(r.duration, 3), 'uuid': None, 'node': None}
+        if r.error is not None:
+            # LibcloudError keeps its message in value
+            outcome['error'] = unicode(getattr(r.error, 'value', r.error))
+        else:
+            outcome['uuid'] = r.value['uuid']
+            new_nodes.append(build_node(forms[r.item], r.value, user))
+        outcomes.append(outcome)
+
+    unsaved = {}
+    try:
+        saved = save_nodes(provider, new_nodes)
+    except Exception, e:
+        logging.error('Could not save the nodes of a batch at once, saving '
+            'them one by one: %s' % e)
+        saved, unsaved = save_each(new_nodes)
+    for outcome in outcomes:
+        node = saved.get(outcome['name'])
+        if node is not None:
+            outcome['status'] = 'created'
+            outcome['node'] = node
+        elif outcome['name'] in unsaved:
+            outcome['status'] = 'created_unsaved'
+            outcome['error'] = unicode(unsaved[outcome['name']])
+            logging.error('Node %s created at provider "%s" (uuid %s) but '
+                'not saved: %s' % (outcome['name'], provider.name,
+                outcome['uuid'], outcome['error']))
+    logging.info('Created %s of %s nodes at provider "%s"' % (
+        len(saved), len(names), provider.name))
+    return None, None, outcomes
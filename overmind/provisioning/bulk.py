@@ -0,0 +1,90 @@
+# Set-based helpers to write many rows with a few queries
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.utils.encoding import smart_unicode
+
+# Rows sent to the DB per executemany() call
+BATCH_SIZE = 500
+
+
+def _batches(seq, size=BATCH_SIZE):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+def _column_values(obj, fields, add):
+    return [f.get_db_prep_save(f.pre_save(obj, add), connection=connection)
+        for f in fields]
+
+def bulk_insert(model, objs):
+    '''Insert all model instances in objs using batched INSERTs.
+    Objects are not updated with their new primary keys
+    '''
+    if not objs: return 0
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ", ".join([qn(f.column) for f in fields]),
+        ", ".join(["%s"] * len(fields)),
+    )
+    cursor = connection.cursor()
+    for batch in _batches(objs):
+        cursor.executemany(
+            sql, [_column_values(obj, fields, True) for obj in batch])
+    transaction.set_dirty()
+    return len(objs)
+
+def bulk_update(model, objs, field_names):
+    '''Write field_names of every object in objs using batched UPDATEs'''
+    if not objs: return 0
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in field_names]
+    pk = model._meta.pk
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+        qn(model._meta.db_table),
+        ", ".join(["%s = %%s" % qn(f.column) for f in fields]),
+        qn(pk.column),
+    )
+    cursor = connection.cursor()
+    for batch in _batches(objs):
+        cursor.executemany(sql, [
+            _column_values(obj, fields, False) + [obj.pk] for obj in batch])
+    transaction.set_dirty()
+    return len(objs)
+
+def upsert_catalog(provider, model, key_field, rows, fields):
+    '''Sync a provider's catalog table (images, locations, sizes) with rows
+
+    rows is a list of dicts holding key_field plus all fields. Existing
+    rows are loaded with a single query and compared in memory, so only
+    new and changed rows are written to the DB.
+    Returns a dict with created, updated and unchanged counts
+    '''
+    existing = {}
+    for values in model.objects.filter(
+            provider=provider).values('id', key_field, *fields):
+        existing[values[key_field]] = values
+
+    # Some providers list the same item twice. The last one wins
+    keys, latest = [], {}
+    for row in rows:
+        key = smart_unicode(row[key_field])
+        if key not in latest: keys.append(key)
+        latest[key] = row
+
+    new, changed = [], []
+    unchanged = 0
+    for key in keys:
+        row = latest[key]
+        current = existing.get(key)
+        if current is None:
+            new.append(model(provider=provider, **row))
+        elif [f for f in fields if smart_unicode(row[f]) != current[f]]:
+            changed.append(model(id=current['id'], provider=provider, **row))
+        else:
+            unchanged += 1
+
+    bulk_insert(model, new)
+    bulk_update(model, changed, fields)
+    return {
+        'created': len(new), 'updated': len(changed), 'unchanged': unchanged}
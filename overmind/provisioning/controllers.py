@@ -3,20 +3,27 @@ from libcloud.base import NodeAuthPassword, NodeAuthSSHKey
 from libcloud.base import NodeImage, NodeSize, NodeLocation
 from libcloud.providers import get_driver
 from libcloud.deployment import SSHKeyDeployment
-from overmind.provisioning import plugins
+from provisioning import plugins, ratelimit
+from provisioning.metrics import instrumented
 from django.conf import settings
-import copy, logging
+import copy, logging, threading, time
 
 
 class ProviderController():
     name = None
     extra_param_name = None
     extra_param_value = None
+    # Seconds during which the last node listing is used to find nodes
+    node_index_ttl = getattr(settings, 'NODE_INDEX_TTL', 30)
     
     def __init__(self, provider):
+        self.node_index = {}# uuid => libcloud Node
+        self.node_index_time = 0
         self.extra_param_name  = provider.extra_param_name
         self.extra_param_value = provider.extra_param_value
         self.provider_type = provider.provider_type
+        self.provider_name = provider.name
+        kwargs = {}
         # Get libcloud provider type
         try:
             driver_type = types.Provider.__dict__[self.provider_type]
@@ -27,6 +34,9 @@ class ProviderController():
             # Try to load provider from plugins
             Driver = plugins.get_driver(self.provider_type)
             logging.debug('selected "%s" plugin driver' % self.provider_type)
+            # Plugins get the extra parameter as a keyword argument
+            if self.extra_param_name:
+                kwargs[str(self.extra_param_name)] = str(self.extra_param_value)
         except Exception, e:
             logging.critical(
                 'ProviderController can\'t find a driver for %s' % self.provider_type)
@@ -34,62 +44,33 @@ class ProviderController():
         
         # Providers with only one access key
         if provider.secret_key == "":
-            self.conn = Driver(str(provider.access_key))
+            self.conn = Driver(str(provider.access_key), **kwargs)
         # Providers with 2 keys
         else:
-            self.conn = Driver(str(provider.access_key), str(provider.secret_key))
+            self.conn = Driver(
+                str(provider.access_key), str(provider.secret_key), **kwargs)
+        
+        # Drivers flagged as rate_limited throttle their own requests
+        self.throttle = None
+        if not getattr(self.conn, 'rate_limited', False):
+            self.throttle = ratelimit.limiter.get(
+                self.provider_type, provider.access_key)
+    
+    def _call(self, func, *args, **kwargs):
+        '''Call a driver method through the account's rate limiter'''
+        if self.throttle is None:
+            return func(*args, **kwargs)
+        return self.throttle.call(func, *args, **kwargs)
+    
+    def _call_once(self, func, *args, **kwargs):
+        '''Like _call, but throttled calls are not retried'''
+        if self.throttle is None:
+            return func(*args, **kwargs)
+        return self.throttle.call_once(func, *args, **kwargs)
     
     def create_node(self, form):
-        name   = form.cleaned_data['name']
-        image  = NodeImage(
-            form.cleaned_data.get('image').image_id, '', self.conn)
-        size = NodeSize(form.cleaned_data.get('size').size_id, '', '', '',
-            None, None, driver=self.conn)
-        location  = NodeLocation(
-            form.cleaned_data.get('location').location_id, '', '', self.conn)
-        
-        # Choose node creation strategy
-        features = self.conn.features.get('create_node', [])
         try:
-            if "ssh_key" in features:
-                # Pass on public key and we are done
-                logging.debug("Provider feature: ssh_key. Pass on key")
-                node = self.conn.create_node(
-                    name=name, image=image, size=size, location=location,
-                    auth=NodeAuthSSHKey(settings.PUBLIC_KEY)
-                )
-            elif 'generates_password' in features:
-                # Use deploy_node to deploy public key
-                logging.debug(
-                    "Provider feature: generates_password. Use deploy_node")
-                pubkey = SSHKeyDeployment(settings.PUBLIC_KEY) 
-                node = self.conn.deploy_node(
-                    name=name, image=image, size=size, location=location,
-                    deploy=pubkey
-                )
-            elif 'password' in features:
-                # Pass on password and use deploy_node to deploy public key
-                pubkey = SSHKeyDeployment(settings.PUBLIC_KEY)
-                rpassword = generate_random_password(15)
-                logging.debug("Provider feature: password. Pass on password=%s to deploy_node" % rpassword)
-                node = self.conn.deploy_node(
-                    name=name, image=image, size=size, location=location,
-                    auth=NodeAuthPassword(rpassword), deploy=pubkey
-                )
-            else:
-                # Create node without any extra steps nor parameters
-                logging.debug("Provider feature: none. call create_node")
-                # Include all plugin form fields in the argument dict
-                args = copy.deepcopy(form.cleaned_data)
-                # Remove unneeded fields
-                for field in ['name', 'image', 'size', 'location', 'provider']:
-                    if field in args:
-                        del args[field]#Avoid colissions with default args
-                args[str(self.extra_param_name)] = str(self.extra_param_value)
-                
-                node = self.conn.create_node(
-                    name=name, image=image, size=size, location=location, **args
-                )
+            node = self._create_node(form)
         except Exception, e:
             logging.error('while creating node. %s: %s' % (type(e), e))
             return e, None
@@ -101,37 +82,200 @@ class ProviderController():
             'extra': node.extra,
         }
     
+    @instrumented('create_node')
+    def _create_node(self, form):
+        name   = form.cleaned_data['name']
+        image  = NodeImage(
+            form.cleaned_data.get('image').image_id, '', self.conn)
+        size = NodeSize(form.cleaned_data.get('size').size_id, '', '', '',
+            None, None, driver=self.conn)
+        location  = NodeLocation(
+            form.cleaned_data.get('location').location_id, '', '', self.conn)
+        
+        # Choose node creation strategy
+        features = self.conn.features.get('create_node', [])
+        if "ssh_key" in features:
+            # Pass on public key and we are done
+            logging.debug("Provider feature: ssh_key. Pass on key")
+            node = self._call_once(self.conn.create_node,
+                name=name, image=image, size=size, location=location,
+                auth=NodeAuthSSHKey(settings.PUBLIC_KEY)
+            )
+        elif 'generates_password' in features:
+            # Use deploy_node to deploy public key
+            logging.debug(
+                "Provider feature: generates_password. Use deploy_node")
+            pubkey = SSHKeyDeployment(settings.PUBLIC_KEY) 
+            node = self._call_once(self.conn.deploy_node,
+                name=name, image=image, size=size, location=location,
+                deploy=pubkey
+            )
+        elif 'password' in features:
+            # Pass on password and use deploy_node to deploy public key
+            pubkey = SSHKeyDeployment(settings.PUBLIC_KEY)
+            rpassword = generate_random_password(15)
+            logging.debug("Provider feature: password. Pass on password=%s to deploy_node" % rpassword)
+            node = self._call_once(self.conn.deploy_node,
+                name=name, image=image, size=size, location=location,
+                auth=NodeAuthPassword(rpassword), deploy=pubkey
+            )
+        else:
+            # Create node without any extra steps nor parameters
+            logging.debug("Provider feature: none. call create_node")
+            # Include all plugin form fields in the argument dict
+            args = copy.deepcopy(form.cleaned_data)
+            # Remove unneeded fields
+            for field in ['name', 'image', 'size', 'location', 'provider']:
+                if field in args:
+                    del args[field]#Avoid colissions with default args
+            args[str(self.extra_param_name)] = str(self.extra_param_value)
+            
+            node = self._call_once(self.conn.create_node,
+                name=name, image=image, size=size, location=location, **args
+            )
+        return node
+    
+    def _index_nodes(self, nodes):
+        self.node_index = dict([(n.uuid, n) for n in nodes])
+        self.node_index_time = time.time()
+    
+    def get_node(self, uuid):
+        '''Returns the libcloud Node with the given uuid or None
+        Uses the last listing if it is recent enough, so bulk operations
+        cost one listing per provider. Drivers implementing get_node(uuid)
+        are asked for the single node instead of listing all of them
+        '''
+        if time.time() - self.node_index_time < self.node_index_ttl:
+            node = self.node_index.get(uuid)
+            if node is not None:
+                return node
+        if hasattr(self.conn, 'get_node'):
+            return self._call(self.conn.get_node, uuid)
+        self.get_nodes()
+        return self.node_index.get(uuid)
+    
+    @instrumented('reboot_node')
     def reboot_node(self, node):
-        #TODO: this is braindead
-        #We should be able to do self.conn.get_node(uuid=uuid)
-        for n in self.conn.list_nodes():
-            if n.uuid == node.uuid:
-                return self.conn.reboot_node(n)
-        return False
+        n = self.get_node(node.uuid)
+        if n is None:
+            return False
+        return self._call(self.conn.reboot_node, n)
     
+    @instrumented('destroy_node')
     def destroy_node(self, node):
-        #TODO: this is braindead
-        #We should be able to do self.conn.get_node(uuid=uuid)
-        for n in self.conn.list_nodes():
-            if n.uuid == node.uuid:
-                return self.conn.destroy_node(n)
-        return False
+        n = self.get_node(node.uuid)
+        if n is None:
+            return False
+        ret = self._call(self.conn.destroy_node, n)
+        if ret:
+            self.node_index.pop(node.uuid, None)
+        return ret
     
+    @instrumented('get_nodes')
     def get_nodes(self):
-        return self.conn.list_nodes()
+        nodes = self._call(self.conn.list_nodes)
+        self._index_nodes(nodes)
+        return nodes
     
+    @instrumented('get_images')
     def get_images(self):
-        images = self.conn.list_images()
+        images = self._call(self.conn.list_images)
         # Hack for Amazon's EC2: only retrieve AMI images
         if self.provider_type.startswith("EC2"):
             images = [image for image in images if image.id.startswith('ami')]
         return images
     
+    @instrumented('get_sizes')
     def get_sizes(self):
-        return self.conn.list_sizes()
+        return self._call(self.conn.list_sizes)
     
+    @instrumented('get_locations')
     def get_locations(self):
-        return self.conn.list_locations()
+        return self._call(self.conn.list_locations)
+
+
+class ControllerPool(object):
+    '''Process wide cache of ProviderController instances
+    Controllers are keyed by provider type and credentials, so that all
+    Provider instances of an account share one driver and its connection.
+    libcloud drivers and the controllers' node index are not thread safe,
+    so every thread gets its own controller for an account: a controller
+    is only ever used by the thread that created it.
+    Entries expire after ttl seconds and the least recently used one is
+    evicted when there are more than max_size. The pool itself can be
+    used from any thread
+    '''
+    def __init__(self, max_size=50, ttl=600):
+        self.max_size  = max_size
+        self.ttl       = ttl
+        self.lock      = threading.Lock()
+        self.entries   = {}# (key, thread id) => [controller, created, last_used]
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+    
+    def key(self, provider):
+        return (provider.provider_type, provider.access_key,
+            provider.secret_key, provider.extra_param_name,
+            provider.extra_param_value)
+    
+    def get(self, provider):
+        '''Returns the controller of the provider's account for the
+        calling thread'''
+        key = (self.key(provider), threading.current_thread().ident)
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.hits += 1
+                entry[2] = now
+                return entry[0]
+            self.misses += 1
+        finally:
+            self.lock.release()
+        
+        # Build the controller outside the lock, drivers may be slow to load
+        controller = ProviderController(provider)
+        self.lock.acquire()
+        try:
+            self.entries[key] = [controller, now, now]
+            while len(self.entries) > self.max_size:
+                lru = min(self.entries, key=lambda k: self.entries[k][2])
+                del self.entries[lru]
+                self.evictions += 1
+        finally:
+            self.lock.release()
+        return controller
+    
+    def invalidate(self, key):
+        '''Drop the controllers of all threads for the credentials key'''
+        self.lock.acquire()
+        try:
+            for entry_key in self.entries.keys():
+                if entry_key[0] == key:
+                    del self.entries[entry_key]
+        finally:
+            self.lock.release()
+    
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+    
+    def stats(self):
+        return {
+            'size': len(self.entries), 'hits': self.hits,
+            'misses': self.misses, 'evictions': self.evictions,
+        }
+
+
+controller_pool = ControllerPool(
+    getattr(settings, 'CONTROLLER_POOL_SIZE', 50),
+    getattr(settings, 'CONTROLLER_POOL_TTL', 600),
+)
 
 
 def generate_random_password(length):
@@ -1,8 +1,10 @@
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.forms import UserCreationForm
 
-from provisioning.models import Provider, Node, Image, Location, Size
+from provisioning.models import Provider, Node, Image, node_form_cache_key
 from provisioning.provider_meta import PROVIDERS
 
 class ProviderForm(forms.ModelForm):
@@ -27,6 +29,35 @@ class ProviderForm(forms.ModelForm):
         fields = ('name', 'provider_type', 'access_key', 'secret_key')
 
 
+# NodeForm fields whose choices come from the provider catalog
+CATALOG_FIELDS = ('location', 'size', 'image')
+
+def node_form_metadata(provider_id):
+    '''Returns the provider type and, for every catalog field of its form,
+    the choices and an id => object map. Cached until the locations, sizes
+    or favorite images of the provider change
+    '''
+    key = node_form_cache_key(provider_id)
+    metadata = cache.get(key)
+    if metadata is None:
+        prov = Provider.objects.get(id=provider_id)
+        metadata = {'provider_type': prov.provider_type}
+        form_fields = PROVIDERS[prov.provider_type].get('form_fields', [])
+        querysets = {
+            'location': prov.get_locations(),
+            'size':     prov.get_sizes(),
+            'image':    prov.get_fav_images().order_by('name'),
+        }
+        for field in CATALOG_FIELDS:
+            objects = field in form_fields and list(querysets[field]) or []
+            metadata[field] = {
+                'choices': [(obj.id, unicode(obj)) for obj in objects],
+                'objects': dict([(unicode(obj.id), obj) for obj in objects]),
+            }
+        cache.set(key, metadata, getattr(settings, 'NODE_FORM_CACHE_TIMEOUT', 3600))
+    return metadata
+
+
 class AddImageForm(forms.Form):
     provider = forms.ModelChoiceField(
         queryset = Provider.objects.all(),
@@ -34,31 +65,36 @@ class AddImageForm(forms.Form):
     )
     image_id = forms.CharField(widget=forms.HiddenInput, required=False)
     favimage1 = forms.CharField(label="Type an image id", required=False)
-    favimage2 = forms.ChoiceField(label="Select an image", choices=[])
+    # Filled in by the search box, which queries /node/image/search/
+    favimage2 = forms.CharField(widget=forms.HiddenInput, required=False)
+    search = forms.CharField(label="Or search for an image", required=False,
+        widget=forms.TextInput(attrs={'autocomplete': 'off'}))
     
     def __init__(self, provider_id, *args, **kwargs):
         super(AddImageForm, self).__init__(*args, **kwargs)
-        prov = Provider.objects.get(id=provider_id)
-        self.fields['provider'].initial = prov.id
-        self.fields['favimage2'].choices = []
-        for img in prov.get_images().order_by('name'):
-            self.fields['favimage2'].choices += [(img.id, img)]
+        self.fields['provider'].initial = provider_id
     
     def clean(self):
         cleaned_data = self.cleaned_data
+        provider = cleaned_data.get('provider')
+        if provider is None:
+            return cleaned_data
         image = cleaned_data.get('favimage1')
-        if image != "":
-            try:
+        try:
+            if image:
                 cleaned_data['image'] = Image.objects.get(
-                    provider=cleaned_data['provider'],
-                    image_id=image
-                )
-            except Image.DoesNotExist:
-                msg = u"Invalid image id"
+                    provider=provider, image_id=image)
+            elif cleaned_data.get('favimage2'):
+                cleaned_data['image'] = Image.objects.get(
+                    provider=provider, id=cleaned_data['favimage2'])
+            else:
+                msg = u"Type an image id or search for an image"
                 self._errors['favimage1'] = self.error_class([msg])
-        else:
-            cleaned_data['image'] = Image.objects.get(
-                    id=cleaned_data.get('favimage2'))
+                return cleaned_data
+        except (Image.DoesNotExist, ValueError):
+            msg = u"Invalid image id"
+            self._errors['favimage1'] = self.error_class([msg])
+            return cleaned_data
         if cleaned_data['image'].favorite:
             msg = u"This image is already marked as favorite"
             self._errors['favimage1'] = self.error_class([msg])
@@ -73,62 +109,40 @@ class NodeForm(forms.ModelForm):
     
     def __init__(self, provider_id, *args, **kwargs):
         super(NodeForm, self).__init__(*args, **kwargs)
-        prov = Provider.objects.get(id=provider_id)
-        self.fields['provider'].initial = prov.id
-        provider_info = PROVIDERS[prov.provider_type]
+        self.metadata = node_form_metadata(provider_id)
+        self.fields['provider'].initial = provider_id
+        form_fields = PROVIDERS[self.metadata['provider_type']].get('form_fields', [])
         # Add custom plugin fields
-        for field in provider_info.get('form_fields', []):
+        for field in form_fields:
             # These fields will be added later
-            if field in ['location', 'size', 'image']:
+            if field in CATALOG_FIELDS:
                 continue
             self.fields[field] = forms.CharField(max_length=30)
         
-        # Add location field
-        if 'location' in provider_info.get('form_fields', []):
-            self.fields['location'] = forms.ChoiceField()
-            for location in prov.get_locations():
-                self.fields['location'].choices += [
-                    (location.id, location)
-                ]
-        # Add size field
-        if 'size' in provider_info.get('form_fields', []):
-            self.fields['size'] = forms.ChoiceField()
-            for size in prov.get_sizes():
-                self.fields['size'].choices += [(size.id, size)]
-        # Add image field
-        if 'image' in provider_info.get('form_fields', []):
-            self.fields['image'] = forms.ChoiceField()
-            for img in prov.get_fav_images().order_by('name'):
-                self.fields['image'].choices += [(img.id, img)]
+        # Add location, size and image fields
+        for field in CATALOG_FIELDS:
+            if field in form_fields:
+                self.fields[field] = forms.ChoiceField(
+                    choices=self.metadata[field]['choices'])
+    
+    def clean_catalog_field(self, field):
+        '''Transform a location, size or image id to a proper object'''
+        value = self.cleaned_data.get(field)
+        obj = self.metadata[field]['objects'].get(value)
+        if obj is None:
+            msg = u"This %s id doesn't exist for this provider" % field
+            self._errors[field] = self.error_class([msg])
+            return value
+        return obj
     
     def clean_image(self):
-        '''Transform image id to a proper object'''
-        image = self.cleaned_data.get('image')
-        try:
-            image = Image.objects.get(id=image)
-        except Image.DoesNotExist:
-            msg = u"This image id doesn't exist for this provider"
-            self._errors['image'] = self.error_class([msg])
-        return image
+        return self.clean_catalog_field('image')
     
     def clean_location(self):
-        location = self.cleaned_data.get('location')
-        try:
-            location = Location.objects.get(id=location)
-        except Location.DoesNotExist:
-            msg = u"This location id doesn't exist for this provider"
-            self._errors['location'] = self.error_class([msg])
-        return location
+        return self.clean_catalog_field('location')
     
     def clean_size(self):
-        size = self.cleaned_data.get('size')
-        
-        try:
-            size = Size.objects.get(id=size)
-        except Size.DoesNotExist:
-            msg = u"This size id doesn't exist for this provider"
-            self._errors['size'] = self.error_class([msg])
-        return size
+        return self.clean_catalog_field('size')
     
     class Meta:
         model  = Node
@@ -0,0 +1,227 @@
+# Response cache for the HTTP calls of provisioning plugins
+import simplejson as json
+import base64, hashlib, os, re, threading, time, logging
+
+
+class ResponseCache(object):
+    '''Thread safe LRU cache of HTTP GET responses
+
+    location:    directory where entries are persisted. None keeps
+                 them in memory only
+    max_entries: the least recently used entries above this are evicted
+    ttls:        list of (url regex, seconds) pairs. The first match sets
+                 how long a response is served without asking the server
+    default_ttl: seconds for urls not matching any regex
+    Stale responses having an ETag or Last-Modified header are revalidated
+    with a conditional request instead of being downloaded again.
+    Entries are persisted as JSON, never unpickled, so that a writable cache
+    directory can't be used to run code
+    '''
+    def __init__(self, location=None, max_entries=1000, ttls=(), default_ttl=0):
+        self.location    = location
+        self.max_entries = max_entries
+        self.ttls        = [(re.compile(regex), ttl) for regex, ttl in ttls]
+        self.default_ttl = default_ttl
+        self.lock        = threading.Lock()
+        self.entries     = {}# key => entry dict
+        self.hits        = 0
+        self.misses      = 0
+        self.revalidated = 0
+        self.evictions   = 0
+        if self.location is not None:
+            self._load()
+
+    def _filename(self, key):
+        # The same for the key read back from JSON (a list of unicode)
+        return os.path.join(self.location,
+            hashlib.md5(json.dumps(list(key))).hexdigest())
+
+    def _remove(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError, e:
+            logging.warning('Could not remove http cache file: %s' % e)
+
+    def _save(self, entry):
+        data = dict(entry, key=list(entry['key']),
+            content=base64.b64encode(entry['content']))
+        try:
+            f = open(self._filename(entry['key']), 'wb')
+            try:
+                json.dump(data, f)
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            logging.warning('Could not write http cache file: %s' % e)
+
+    def _load(self):
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+        for name in os.listdir(self.location):
+            filename = os.path.join(self.location, name)
+            try:
+                f = open(filename, 'rb')
+                try:
+                    data = json.load(f)
+                finally:
+                    f.close()
+                entry = {
+                    'key': tuple(data['key']), 'response': dict(data['response']),
+                    'content': base64.b64decode(data['content']),
+                    'stored': float(data['stored']),
+                    'last_used': float(data['last_used']),
+                }
+                self.entries[entry['key']] = entry
+            except Exception, e:
+                # Unreadable, or written by an older version (pickled)
+                logging.warning('Removing http cache file %s: %s' % (name, e))
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+        self._evict()
+
+    def _count(self, counter):
+        self.lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self.lock.release()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            key = min(self.entries, key=lambda k: self.entries[k]['last_used'])
+            del self.entries[key]
+            self.evictions += 1
+            if self.location is not None:
+                self._remove(key)
+
+    def ttl(self, url):
+        for regex, ttl in self.ttls:
+            if regex.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+            return entry
+        finally:
+            self.lock.release()
+
+    def set(self, key, response, content):
+        now = time.time()
+        entry = {
+            'key': key, 'response': dict(response), 'content': content,
+            'stored': now, 'last_used': now,
+        }
+        self.lock.acquire()
+        try:
+            self.entries[key] = entry
+            if self.location is not None:
+                self._save(entry)
+            self._evict()
+        finally:
+            self.lock.release()
+        return entry
+
+    def invalidate(self, key=None):
+        '''Forget one entry, or all of them if key is None'''
+        self.lock.acquire()
+        try:
+            keys = key is None and self.entries.keys() or [key]
+            for k in keys:
+                if self.entries.pop(k, None) and self.location is not None:
+                    self._remove(k)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            lookups = self.hits + self.misses + self.revalidated
+            return {
+                'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'hit_rate': lookups and float(self.hits + self.revalidated) / lookups,
+            }
+        finally:
+            self.lock.release()
+
+    def fresh(self, url, user=None):
+        '''Returns the cached (response, content) of a GET to url if it is
+        younger than its ttl, or None when a request is needed'''
+        ttl = self.ttl(url)
+        self.lock.acquire()
+        try:
+            entry = self.entries.get((user, url))
+            if entry is None or time.time() - entry['stored'] >= ttl:
+                return None
+            entry['last_used'] = time.time()
+            self.hits += 1
+            return entry['response'], entry['content']
+        finally:
+            self.lock.release()
+    
+    def request(self, http, url, method='GET', body=None, user=None):
+        '''Send a request with the httplib2.Http http, serving GETs from the
+        cache when possible. user is part of the cache key, so that
+        accounts sharing a cache never see each other's responses.
+        Returns (response, content) like httplib2
+        '''
+        if method != 'GET':
+            return http.request(url, method, body)
+
+        cached = self.fresh(url, user)
+        if cached is not None:
+            return cached
+        key = (user, url)
+        entry = self.get(key)
+        headers = {}
+        if entry is not None:
+            if entry['response'].get('etag'):
+                headers['If-None-Match'] = entry['response']['etag']
+            if entry['response'].get('last-modified'):
+                headers['If-Modified-Since'] = entry['response']['last-modified']
+
+        response, content = http.request(url, method, body, headers=headers)
+        if response.get('status') == '304' and headers:
+            self._count('revalidated')
+            entry = self.set(key, entry['response'], entry['content'])
+            return entry['response'], entry['content']
+
+        self._count('misses')
+        if response.get('status') == '200' and (self.ttl(url) or
+                response.get('etag') or response.get('last-modified')):
+            self.set(key, response, content)
+        return response, content
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def shared_cache(name, ttls=(), default_ttl=0):
+    '''Returns the process wide cache of the plugin name, stored in a
+    subdirectory of settings.PLUGIN_HTTP_CACHE_DIR (in memory if it is None)
+    and holding up to settings.PLUGIN_HTTP_CACHE_SIZE entries
+    '''
+    _caches_lock.acquire()
+    try:
+        if name not in _caches:
+            try:
+                from django.conf import settings
+                location = getattr(settings, 'PLUGIN_HTTP_CACHE_DIR', None)
+                max_entries = getattr(settings, 'PLUGIN_HTTP_CACHE_SIZE', 1000)
+            except ImportError:
+                # Django is not configured
+                location, max_entries = None, 1000
+            if location is not None:
+                location = os.path.join(location, name)
+            _caches[name] = ResponseCache(location, max_entries, ttls, default_ttl)
+        return _caches[name]
+    finally:
+        _caches_lock.release()
@@ -0,0 +1,166 @@
+# DB backed job queue. Jobs are run by "manage.py runworker"
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from django.db.models import F
+from libcloud.types import InvalidCredsException
+from provisioning.models import Job
+from datetime import datetime, timedelta
+import time, logging, threading
+
+
+def import_provider(job):
+    '''Import images, locations, sizes and nodes of a new provider'''
+    provider = job.provider
+    try:
+        if provider.supports('images'): provider.import_images()
+        if provider.supports('locations'): provider.import_locations()
+        if provider.supports('sizes'): provider.import_sizes()
+        provider.import_nodes()
+    except InvalidCredsException:
+        # Keep the job for status polling but delete the provider
+        job.provider = None
+        job.max_attempts = job.attempts
+        job.save()
+        provider.delete()
+        raise Exception, 'Invalid account credentials'
+
+TASKS = {
+    'import_provider': import_provider,
+}
+
+def enqueue(task, provider=None, max_attempts=None):
+    if task not in TASKS:
+        raise Exception, 'Unknown task "%s"' % task
+    job = Job(task=task, provider=provider)
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    job.save()
+    logging.debug('Queued %s' % job)
+    return job
+
+def get_lease():
+    return getattr(settings, 'JOB_LEASE', 300)
+
+def requeue_expired():
+    '''Queue again the running jobs whose lease expired, their worker
+    died. Jobs without attempts left fail. Returns the number of jobs'''
+    now = datetime.now()
+    expired = Job.objects.filter(status='Running', lease_until__lt=now)
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status='Failed', error='Worker lost', finished=now, lease_until=None)
+    requeued = expired.update(
+        status='Queued', error='Worker lost', run_at=now, lease_until=None)
+    if failed or requeued:
+        logging.warning('Worker lost: %s jobs queued again, %s failed' % (
+            requeued, failed))
+    return failed + requeued
+
+def claim_next():
+    '''Mark the oldest due job as running and return it
+    Returns None if there are no jobs waiting to run. The conditional
+    UPDATE makes sure several workers never claim the same job.
+    The job is leased for settings.JOB_LEASE seconds, which its worker
+    extends while it runs (see Heartbeat)
+    '''
+    requeue_expired()
+    while True:
+        try:
+            job = Job.objects.filter(
+                status='Queued', run_at__lte=datetime.now()
+            ).order_by('run_at', 'id')[0]
+        except IndexError:
+            return None
+        claimed = Job.objects.filter(id=job.id, status='Queued').update(
+            status='Running', attempts=F('attempts') + 1,
+            lease_until=datetime.now() + timedelta(seconds=get_lease()))
+        if claimed:
+            return Job.objects.get(id=job.id)
+
+
+class Heartbeat(threading.Thread):
+    '''Extends the lease of a running job every third of the lease until
+    stopped, so that only jobs of dead workers expire'''
+    def __init__(self, job, lease=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.job_id = job.id
+        self.lease = lease or get_lease()
+        self.stopped = threading.Event()
+    
+    def run(self):
+        try:
+            while not self.stopped.wait(self.lease / 3.0):
+                try:
+                    Job.objects.filter(id=self.job_id, status='Running').update(
+                        lease_until=datetime.now() + timedelta(seconds=self.lease))
+                except Exception, e:
+                    # Like a locked DB, the next beat may get through
+                    logging.error('Could not renew the lease of job #%s: %s' % (
+                        self.job_id, e))
+                    try:
+                        transaction.rollback_unless_managed()
+                    except Exception:
+                        pass
+        finally:
+            # Every thread has its own DB connection
+            connection.close()
+    
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job):
+    '''Run a claimed job, scheduling a retry with exponential backoff if
+    it fails and has attempts left. Returns True if the job succeeded
+    '''
+    logging.info('Running %s, attempt %s' % (job, job.attempts))
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        try:
+            TASKS[job.task](job)
+        finally:
+            heartbeat.stop()
+    except Exception, e:
+        job.lease_until = None
+        job.error = unicode(e)
+        if job.attempts < job.max_attempts:
+            delay = getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (job.attempts - 1)
+            job.status = 'Queued'
+            job.run_at = datetime.now() + timedelta(seconds=delay)
+            logging.warning('%s failed: %s. Retrying in %ss' % (job, e, delay))
+        else:
+            job.status = 'Failed'
+            job.finished = datetime.now()
+            logging.error('%s failed: %s' % (job, e))
+        job.save()
+        return False
+    job.status = 'Done'
+    job.error = ''
+    job.lease_until = None
+    job.finished = datetime.now()
+    job.save()
+    logging.info('Finished %s' % job)
+    return True
+
+def run_pending():
+    '''Run all due jobs. Returns the number of jobs run'''
+    count = 0
+    job = claim_next()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next()
+    return count
+
+def work(interval=None):
+    '''Run jobs forever, polling the queue every interval seconds'''
+    if interval is None:
+        interval = getattr(settings, 'JOB_POLL_INTERVAL', 5)
+    logging.info('Worker started')
+    while True:
+        # Don't let the query log grow forever with DEBUG
+        reset_queries()
+        if not run_pending():
+            time.sleep(interval)
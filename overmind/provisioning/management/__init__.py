@@ -4,6 +4,8 @@ Creates predefined user Roles
 from django.db.models import signals
 from django.core.management import call_command
 from  overmind.provisioning import models as provisioning_app
+# Connect the creation of permissions first, create_groups needs them
+import django.contrib.auth.management
 
 def create_groups(app, created_models, verbosity, **kwargs):
     call_command("create_groups")
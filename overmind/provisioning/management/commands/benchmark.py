@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from optparse import make_option
+from benchmarks import fleet
+import simplejson as json
+import logging
+
+class Command(BaseCommand):
+    help = ('Measures imports, resyncs, decommissioning, the overview page '
+        'and the node API on a synthetic fleet, using a test database')
+    option_list = BaseCommand.option_list + (
+        make_option('--providers', type='int', dest='providers',
+            help='Number of providers (default %(providers)s)' % fleet.DEFAULTS),
+        make_option('--images', type='int', dest='images',
+            help='Total number of images (default %(images)s)' % fleet.DEFAULTS),
+        make_option('--sizes', type='int', dest='sizes',
+            help='Total number of sizes (default %(sizes)s)' % fleet.DEFAULTS),
+        make_option('--locations', type='int', dest='locations',
+            help='Total number of locations (default %(locations)s)' % fleet.DEFAULTS),
+        make_option('--nodes', type='int', dest='nodes',
+            help='Total number of nodes (default %(nodes)s)' % fleet.DEFAULTS),
+        make_option('--churn', type='float', dest='churn',
+            help='Fraction of nodes changed before the churn resync '
+                '(default %(churn)s)' % fleet.DEFAULTS),
+        make_option('--decommission', type='int', dest='decommission',
+            help='Number of nodes decommissioned (default %(decommission)s)'
+                % fleet.DEFAULTS),
+        make_option('--output', dest='output',
+            help='Write the results as JSON to this file'),
+        make_option('--compare', dest='compare',
+            help='Compare with the results of a previous run'),
+    )
+
+    def handle(self, *args, **options):
+        params = dict([(key, options[key]) for key in fleet.DEFAULTS
+            if options.get(key) is not None])
+        verbosity = int(options.get('verbosity', 1))
+        if verbosity < 2:
+            # Logging every imported node would dominate the timings
+            logging.getLogger().setLevel(logging.WARNING)
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            results = fleet.run(**params)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options.get('output'):
+            f = open(options['output'], 'w')
+            try:
+                json.dump(results, f, indent=4, sort_keys=True)
+                f.write('\n')
+            finally:
+                f.close()
+        if verbosity >= 1:
+            for stage in results['stages']:
+                print('%(name)-24s %(wall)9.3fs %(queries)7s queries '
+                    '%(rss_kb)8sKB rss %(rss_delta_kb)8sKB grown  %(detail)s'
+                    % stage)
+            if options.get('compare'):
+                print('')
+                for line in fleet.compare(results, json.load(open(options['compare']))):
+                    print(line)
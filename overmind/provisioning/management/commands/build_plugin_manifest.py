@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from provisioning import plugins
+
+class Command(BaseCommand):
+    help = 'Writes the metadata of all provisioning plugins to their manifest'
+
+    def handle(self, *args, **options):
+        manifest = plugins.build_manifest()
+        if int(options.get('verbosity', 1)) >= 1:
+            print('Wrote %s plugins to %s' % (len(manifest), plugins.MANIFEST))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from provisioning.poller import Poller
+from provisioning import metrics
+
+class Command(BaseCommand):
+    help = 'Refreshes nodes in transitional states (Pending, Rebooting...) until they settle'
+    option_list = BaseCommand.option_list + (
+        make_option('--until-settled', action='store_true',
+            dest='until_settled', default=False,
+            help='Exit once no node is in a transitional state'),
+        make_option('--interval', type='float', dest='interval', default=None,
+            help='Seconds between checks for transitional nodes'),
+        make_option('--metrics-port', type='int', dest='metrics_port',
+            default=None,
+            help='Serve the metrics of the poller at this port under /metrics'),
+    )
+
+    def handle(self, *args, **options):
+        port = options.get('metrics_port') or getattr(settings, 'POLLER_METRICS_PORT', None)
+        if port:
+            metrics.serve(port)
+        Poller().run(options.get('interval'), options.get('until_settled'))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from provisioning import jobs, metrics
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs such as provider imports'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='Run all due jobs and exit'),
+        make_option('--interval', type='float', dest='interval', default=None,
+            help='Seconds to wait between queue polls'),
+        make_option('--metrics-port', type='int', dest='metrics_port',
+            default=None,
+            help='Serve the metrics of the worker at this port under /metrics'),
+    )
+
+    def handle(self, *args, **options):
+        port = options.get('metrics_port') or getattr(settings, 'WORKER_METRICS_PORT', None)
+        if port:
+            metrics.serve(port)
+        if options.get('once'):
+            count = jobs.run_pending()
+            if int(options.get('verbosity', 1)) >= 1:
+                print('Ran %s jobs' % count)
+        else:
+            jobs.work(options.get('interval'))
@@ -0,0 +1,225 @@
+# Process wide metrics of provider calls and syncs in the Prometheus text
+# format. The web server exposes them at /api/metrics, the worker and node
+# poller processes (which have their own metrics) with serve()
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import threading, time
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def escape(value):
+    return unicode(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def format_labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, escape(value))
+        for name, value in pairs])
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    '''A value per label combination that only goes up'''
+    kind = 'counter'
+    
+    def __init__(self, name, help, labels=()):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self.lock   = threading.Lock()
+        self.values = {}# label values => value
+    
+    def inc(self, amount=1, **labels):
+        key = tuple([labels[name] for name in self.labels])
+        self.lock.acquire()
+        try:
+            self.values[key] = self.values.get(key, 0) + amount
+        finally:
+            self.lock.release()
+    
+    def get(self, **labels):
+        return self.values.get(tuple([labels[name] for name in self.labels]), 0)
+    
+    def samples(self):
+        self.lock.acquire()
+        try:
+            items = sorted(self.values.items())
+        finally:
+            self.lock.release()
+        return [(self.name, format_labels(self.labels, key), value)
+            for key, value in items]
+
+
+class Histogram(object):
+    '''Distribution of observed values per label combination'''
+    kind = 'histogram'
+    
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name    = name
+        self.help    = help
+        self.labels  = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.lock    = threading.Lock()
+        self.values  = {}# label values => [bucket counts, sum, count]
+    
+    def observe(self, value, **labels):
+        key = tuple([labels[name] for name in self.labels])
+        self.lock.acquire()
+        try:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+        finally:
+            self.lock.release()
+    
+    def get(self, **labels):
+        '''Returns (sum, count) of the values observed with labels'''
+        entry = self.values.get(tuple([labels[name] for name in self.labels]))
+        return entry and (entry[1], entry[2]) or (0, 0)
+    
+    def samples(self):
+        self.lock.acquire()
+        try:
+            items = sorted([(key, ([] + e[0], e[1], e[2]))
+                for key, e in self.values.items()])
+        finally:
+            self.lock.release()
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((self.name + '_bucket', format_labels(
+                    self.labels, key, [('le', format_value(bound))]), cumulative))
+            labels = format_labels(self.labels, key)
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self):
+        '''Returns all metrics in the Prometheus text format'''
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        content = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+def serve(port, host=''):
+    '''Expose the metrics of this process at http://host:port/metrics from
+    a background thread. For processes other than the web server, like
+    runworker and pollnodes. Returns the HTTPServer
+    '''
+    server = HTTPServer((host, port), MetricsRequestHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server
+
+provider_calls = registry.register(Counter('overmind_provider_calls_total',
+    'Calls to provider APIs', ('provider', 'provider_type', 'operation')))
+provider_errors = registry.register(Counter('overmind_provider_errors_total',
+    'Calls to provider APIs that failed',
+    ('provider', 'provider_type', 'operation')))
+provider_latency = registry.register(Histogram(
+    'overmind_provider_call_duration_seconds',
+    'Duration of calls to provider APIs',
+    ('provider', 'provider_type', 'operation')))
+sync_duration = registry.register(Histogram(
+    'overmind_sync_stage_duration_seconds',
+    'Duration of provider sync stages (import_images, import_nodes...)',
+    ('provider', 'stage')))
+sync_errors = registry.register(Counter('overmind_sync_stage_errors_total',
+    'Provider sync stages that failed', ('provider', 'stage')))
+sync_rows = registry.register(Counter('overmind_sync_rows_total',
+    'Rows processed by provider sync stages, by outcome',
+    ('provider', 'stage', 'outcome')))
+
+
+def instrumented(operation):
+    '''Decorator for ProviderController methods recording the number of
+    calls, errors and their duration. The controller needs provider_name
+    and provider_type attributes
+    '''
+    def decorator(func):
+        def wrapper(self, *args, **kwargs):
+            labels = {'provider': self.provider_name,
+                'provider_type': self.provider_type, 'operation': operation}
+            start = time.time()
+            try:
+                return func(self, *args, **kwargs)
+            except:
+                provider_errors.inc(**labels)
+                raise
+            finally:
+                provider_calls.inc(**labels)
+                provider_latency.observe(time.time() - start, **labels)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+def sync_stage(stage):
+    '''Decorator for Provider import methods recording their duration,
+    failures and the row counts of the stats dict they return
+    '''
+    def decorator(func):
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                stats = func(self, *args, **kwargs)
+            except:
+                sync_errors.inc(provider=self.name, stage=stage)
+                raise
+            finally:
+                sync_duration.observe(
+                    time.time() - start, provider=self.name, stage=stage)
+            for outcome, count in (stats or {}).items():
+                sync_rows.inc(count, provider=self.name, stage=stage,
+                    outcome=outcome)
+            return stats
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
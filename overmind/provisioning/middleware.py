@@ -0,0 +1,157 @@
+# Sampling SQL profiler. Enable it by adding
+# 'provisioning.middleware.SQLProfileMiddleware' to MIDDLEWARE_CLASSES
+from django.conf import settings
+from django.db import connections
+from provisioning import metrics
+import logging, random, re, time
+
+# Statements that only differ in their parameters share a fingerprint
+_in_list = re.compile(r'IN \(\s*%s(\s*,\s*%s)*\s*\)')
+_literals = re.compile(r"'[^']*'|\b\d+\b")
+_spaces = re.compile(r'\s+')
+
+sql_queries = metrics.registry.register(metrics.Histogram(
+    'overmind_sql_queries_per_request', 'SQL queries run by sampled requests',
+    ('endpoint',), buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)))
+sql_duration = metrics.registry.register(metrics.Histogram(
+    'overmind_sql_duration_seconds', 'SQL time of sampled requests',
+    ('endpoint',)))
+sql_n_plus_one = metrics.registry.register(metrics.Counter(
+    'overmind_sql_n_plus_one_total',
+    'Sampled requests repeating a statement more than SQL_PROFILE_REPEAT_THRESHOLD times',
+    ('endpoint',)))
+
+
+def fingerprint(sql):
+    '''Returns the shape of a statement, without its parameters'''
+    sql = _literals.sub('?', _in_list.sub('IN (...)', sql))
+    return _spaces.sub(' ', sql.replace('%s', '?')).strip()
+
+
+class Profile(object):
+    '''SQL statements run while handling one request'''
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self.statements = {}# fingerprint => [count, time]
+    
+    def record(self, sql, elapsed):
+        self.queries += 1
+        self.time += elapsed
+        entry = self.statements.setdefault(fingerprint(sql), [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+    
+    def duplicates(self):
+        '''Returns (count, time, fingerprint) of the statements run more than
+        once, most repeated first'''
+        dups = [(count, t, sql) for sql, (count, t) in self.statements.items()
+            if count > 1]
+        dups.sort(reverse=True)
+        return dups
+    
+    def n_plus_one(self, threshold):
+        '''Statements repeated more than threshold times, usually a query
+        run in a loop over the rows of another one'''
+        return [d for d in self.duplicates() if d[0] > threshold]
+
+
+class ProfilingCursor(object):
+    def __init__(self, cursor, profile):
+        self.cursor = cursor
+        self.profile = profile
+    
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.profile.record(sql, time.time() - start)
+    
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.profile.record(sql, time.time() - start)
+    
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+    
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class SQLProfileMiddleware(object):
+    '''Records the number of queries, SQL time and repeated statements of
+    a sample of requests and logs a summary of each.
+    settings.SQL_PROFILE_SAMPLE_RATE is the fraction of requests profiled.
+    Requests repeating a statement more than
+    settings.SQL_PROFILE_REPEAT_THRESHOLD times are logged as suspected
+    N+1 queries. Totals per endpoint are exposed at /api/metrics.
+    Database connections are thread local, so only the queries of the
+    request's own thread are counted
+    '''
+    def __init__(self):
+        self.sample_rate = getattr(settings, 'SQL_PROFILE_SAMPLE_RATE', 0.01)
+        self.threshold = getattr(settings, 'SQL_PROFILE_REPEAT_THRESHOLD', 10)
+    
+    def process_request(self, request):
+        if random.random() >= self.sample_rate:
+            return
+        profile = Profile()
+        request._sql_profile = profile
+        request._sql_endpoint = request.path
+        for conn in connections.all():
+            self._install(conn, profile)
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_sql_profile'):
+            # Piston resources are named after their handler
+            view = getattr(view_func, 'handler', view_func)
+            if not hasattr(view, '__name__'):
+                view = view.__class__
+            request._sql_endpoint = '%s.%s' % (view.__module__, view.__name__)
+    
+    def process_response(self, request, response):
+        if not hasattr(request, '_sql_profile'):
+            return response
+        if not getattr(response, '_is_string', True):
+            # Streamed content queries the DB while it is sent
+            response._container = self._finish_after(
+                response._container, request, response)
+        else:
+            self._finish(request, response)
+        return response
+    
+    def _install(self, conn, profile):
+        # Connections are thread local, the instance attribute only
+        # affects this thread
+        conn.__dict__.pop('cursor', None)
+        cursor = conn.cursor
+        conn.cursor = lambda: ProfilingCursor(cursor(), profile)
+    
+    def _finish_after(self, content, request, response):
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            self._finish(request, response)
+    
+    def _finish(self, request, response):
+        for conn in connections.all():
+            conn.__dict__.pop('cursor', None)
+        profile = request._sql_profile
+        endpoint = request._sql_endpoint
+        sql_queries.observe(profile.queries, endpoint=endpoint)
+        sql_duration.observe(profile.time, endpoint=endpoint)
+        dups = profile.duplicates()
+        logging.info('SQL %s %s (%s): %s queries in %.1fms, %s repeated' % (
+            request.method, request.path, endpoint, profile.queries,
+            profile.time * 1000, sum([d[0] - 1 for d in dups])))
+        suspects = profile.n_plus_one(self.threshold)
+        if suspects:
+            sql_n_plus_one.inc(endpoint=endpoint)
+        for count, t, sql in suspects:
+            logging.warning('Possible N+1 in %s: %s times (%.1fms) %s' % (
+                endpoint, count, t * 1000, sql[:300]))
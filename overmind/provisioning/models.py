@@ -1,7 +1,14 @@
-from django.db import models, transaction
-from provisioning.controllers import ProviderController
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.core.cache import cache
+from provisioning.controllers import controller_pool
+from provisioning.metrics import sync_stage
+from provisioning.bulk import upsert_catalog, bulk_update
+from provisioning.workers import check_abandoned
 from provisioning.provider_meta import PROVIDERS
-import logging
+from datetime import datetime
+import logging, operator, threading
 import simplejson as json
 
 provider_meta_keys = PROVIDERS.keys()
@@ -17,10 +24,48 @@ STATES = {
     4: 'Unknown',
 }
 
+# Times renaming decommissioned nodes is retried when a name is taken
+DECOM_RETRIES = 3
+# Names whose taken DECOM names are looked up with a single query
+DECOM_QUERY_NAMES = 100
+
 def get_state(state):
     if state not in STATES: state = 4
     return STATES[state]
 
+# Tables changed by the running bump_versions_once operation of each thread
+_changed_tables = threading.local()
+
+def bump_versions_once(func):
+    '''Decorator for operations saving many rows: the change version of
+    every table they touch is bumped once when they return, instead of
+    once for every saved row
+    '''
+    def wrapper(*args, **kwargs):
+        if getattr(_changed_tables, 'names', None) is not None:
+            # Nested, the outermost operation bumps
+            return func(*args, **kwargs)
+        _changed_tables.names = set()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            names = _changed_tables.names
+            _changed_tables.names = None
+            for name in names:
+                bump_version(name)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+def table_changed(name):
+    '''Bump the version of table name now, or at the end of the running
+    bump_versions_once operation'''
+    names = getattr(_changed_tables, 'names', None)
+    if names is None:
+        bump_version(name)
+    else:
+        names.add(name)
+
 
 class Action(models.Model):
     name = models.CharField(unique=True, max_length=20)
@@ -30,6 +75,76 @@ class Action(models.Model):
         return self.name
 
 
+class CapabilityCache(object):
+    '''Process wide cache of the actions every provider supports
+    Loaded from the Provider.actions M2M the first time a provider is
+    checked and dropped when a provider or an action changes in this
+    process, so capability checks cost no queries. Thread safe
+    '''
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.entries    = {}# provider id => (action names, shown action names)
+        self.generation = 0
+    
+    def _fetch(self, provider_ids):
+        generation = self.generation
+        loaded = dict([(pid, (set(), set())) for pid in provider_ids])
+        for pid, name, show in Provider.actions.through.objects.filter(
+                provider__in=provider_ids).values_list(
+                'provider', 'action__name', 'action__show'):
+            loaded[pid][0].add(name)
+            if show:
+                loaded[pid][1].add(name)
+        for pid, (names, shown) in loaded.items():
+            loaded[pid] = (frozenset(names), frozenset(shown))
+        self.lock.acquire()
+        try:
+            # Don't keep what was read before an invalidation
+            if generation == self.generation:
+                self.entries.update(loaded)
+        finally:
+            self.lock.release()
+        return loaded
+    
+    def load(self, provider_ids):
+        '''Fetch the actions of all uncached providers with one query'''
+        missing = [pid for pid in provider_ids if pid not in self.entries]
+        if missing:
+            self._fetch(missing)
+    
+    def get(self, provider_id):
+        entry = self.entries.get(provider_id)
+        if entry is None:
+            entry = self._fetch([provider_id])[provider_id]
+        return entry
+    
+    def supported(self, provider_id):
+        '''Names of the actions a provider supports'''
+        return self.get(provider_id)[0]
+    
+    def shown(self, provider_id):
+        '''Names of the supported actions with show=True'''
+        return self.get(provider_id)[1]
+    
+    def invalidate(self, provider_id=None):
+        '''Drop one provider, or all of them'''
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            if provider_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(provider_id, None)
+        finally:
+            self.lock.release()
+    
+    def clear(self):
+        self.invalidate()
+
+
+capabilities = CapabilityCache()
+
+
 class Provider(models.Model):
     name              = models.CharField(unique=True, max_length=25)
     provider_type     = models.CharField(
@@ -40,10 +155,11 @@ class Provider(models.Model):
     extra_param_name  = models.CharField(
         "Extra parameter name", max_length=30, blank=True)
     extra_param_value = models.CharField(
-        "Extra parameter value", max_length=30, blank=True)
+        "Extra parameter value", max_length=200, blank=True)
     
     actions = models.ManyToManyField(Action)
     conn    = None
+    _conn_key = None
     
     class Meta:
         unique_together = ('provider_type', 'access_key')
@@ -79,73 +195,95 @@ class Provider(models.Model):
             self.actions.add(action)
     
     def supports(self, action):
-        try:
-            self.actions.get(name=action)
-            return True
-        except Action.DoesNotExist:
-            return False
+        if self.id is None:
+            return action in PROVIDERS[self.provider_type]['supported_actions']
+        return action in capabilities.supported(self.id)
     
     def create_connection(self):
-        if self.conn is None:
-            self.conn = ProviderController(self)
-    
+        '''Get a controller from the pool for the current credentials'''
+        key = controller_pool.key(self)
+        if self.conn is not None and self._conn_key != key:
+            # Credentials changed, drop the controller of the old ones
+            controller_pool.invalidate(self._conn_key)
+        self.conn = controller_pool.get(self)
+        self._conn_key = key
+    
+    def delete(self, *args, **kwargs):
+        controller_pool.invalidate(controller_pool.key(self))
+        super(Provider, self).delete(*args, **kwargs)
+    
+    @sync_stage('import_nodes')
+    @bump_versions_once
     def import_nodes(self):
-        '''Sync nodes present at a provider with Overmind's DB'''
+        '''Sync nodes present at a provider with Overmind's DB
+        All nodes and catalog rows of this provider are loaded up front,
+        so the sync costs a fixed number of queries plus one write for
+        every new, changed or vanished node.
+        Returns a dict with created, updated, unchanged and decommissioned counts
+        '''
         if not self.supports('list'): return
         self.create_connection()
         nodes = self.conn.get_nodes()
-        # Import nodes not present in the DB
+        # Don't write anything if a concurrent sync gave up on this one
+        check_abandoned()
+        
+        existing  = dict([(n.uuid, n) for n in Node.objects.filter(provider=self)])
+        images    = dict(Image.objects.filter(
+            provider=self).values_list('image_id', 'id'))
+        locations = dict(Location.objects.filter(
+            provider=self).values_list('location_id', 'id'))
+        sizes     = dict(Size.objects.filter(
+            provider=self).values_list('size_id', 'id'))
+        
+        stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'decommissioned': 0}
+        remote_uuids = set()
         for node in nodes:
-            try:
-                n = Node.objects.get(provider=self, uuid=node.uuid)
-            except Node.DoesNotExist:
+            remote_uuids.add(node.uuid)
+            n = existing.get(node.uuid)
+            if n is None:
                 # Create a new Node
                 logging.info("import_nodes(): adding %s ..." % node)
+                size_id = node.extra.get('instancetype') or\
+                    node.extra.get('flavorId')
                 n = Node(
-                    name      = node.name,
-                    uuid      = node.uuid,
-                    provider  = self,
-                    creator   = 'imported by Overmind',
+                    name        = node.name,
+                    uuid        = node.uuid,
+                    provider    = self,
+                    creator     = 'imported by Overmind',
+                    image_id    = images.get(node.extra.get('imageId')),
+                    location_id = locations.get(node.extra.get('availability')),
+                    size_id     = sizes.get(size_id),
                 )
-                try:
-                    n.image = Image.objects.get(
-                        image_id=node.extra.get('imageId'), provider=self)
-                except Image.DoesNotExist:
-                    n.image = None
-                try:
-                    n.location = Location.objects.get(
-                        location_id=node.extra.get('availability'), provider=self)
-                except Location.DoesNotExist:
-                    n.location = None
-                try:
-                    size_id = node.extra.get('instancetype') or\
-                        node.extra.get('flavorId')
-                    n.size = Size.objects.get(size_id=size_id, provider=self)
-                except Size.DoesNotExist:
-                    n.size = None
+                existing[node.uuid] = n
             
             # Import/Update node info
+            old = (n.public_ip, n.state)
             n.public_ip = node.public_ip[0]
             n.state = get_state(node.state)
-            n.save_extra_data(node.extra)
+            extra_changed = n.save_extra_data(node.extra)
+            if n.id is None:
+                stats['created'] += 1
+            elif extra_changed or old != (n.public_ip, n.state):
+                stats['updated'] += 1
+            else:
+                stats['unchanged'] += 1
+                continue
             n.save()
             logging.debug("import_nodes(): succesfully saved %s" % node.name)
         
-        # Delete nodes in the DB not listed by the provider
-        for n in Node.objects.filter(provider=self
-            ).exclude(environment='Decommissioned'):
-            found = False
-            for node in nodes:
-                if n.uuid == node.uuid:
-                    found = True
-                    break
-            # This node was probably removed from the provider by another tool
-            # TODO: Needs user notification
-            if not found:
-                logging.info("import_nodes(): Delete node %s" % n)
-                n.decommission()
-        logging.debug("Finished synching")
-    
+        # Decommission nodes in the DB not listed by the provider
+        # They were probably removed from the provider by another tool
+        # TODO: Needs user notification
+        missing = [n for n in existing.values() if n.uuid not in remote_uuids
+            and n.environment != 'Decommissioned']
+        missing.sort(key=lambda n: n.id)
+        for n in missing:
+            logging.info("import_nodes(): Delete node %s" % n)
+        stats['decommissioned'] = self.decommission_nodes(missing)
+        logging.debug("Finished synching: %s" % stats)
+        return stats
+    
+    @sync_stage('import_images')
     @transaction.commit_on_success()
     def import_images(self):
         '''Get all images from this provider and store them in the DB
@@ -154,71 +292,101 @@ class Provider(models.Model):
         to save to the DB as separated transactions
         '''
         self.create_connection()
-        for image in self.conn.get_images():
-            try:
-                # Update image if it exists
-                img = Image.objects.get(image_id=image.id, provider=self)
-            except Image.DoesNotExist:
-                # Create new image if it didn't exist
-                img = Image(
-                    image_id = image.id,
-                    provider = self,
-                )
-            img.name = image.name
-            img.save()
-            logging.debug(
-                "Added new image '%s' for provider %s" % (img.name, self))
-        logging.debug("Imported all images for provider %s" % self)
-    
+        rows = [{
+            'image_id':    image.id,
+            'name':        image.name,
+            'search_name': image.name.lower(),
+        } for image in self.conn.get_images()]
+        stats = upsert_catalog(
+            self, Image, 'image_id', rows, ['name', 'search_name'])
+        if stats['created'] or stats['updated']:
+            invalidate_node_form(self.id)
+        logging.debug("Imported all images for provider %s: %s" % (self, stats))
+        return stats
+    
+    @sync_stage('import_locations')
     @transaction.commit_on_success()
     def import_locations(self):
         '''Get all locations from this provider and store them in the DB'''
         self.create_connection()
-        for location in self.conn.get_locations():
-            try:
-                # Update location if it exists
-                loc = Location.objects.get(location_id=location.id, provider=self)
-            except Location.DoesNotExist:
-                # Create new location if it didn't exist
-                loc = Location(
-                    location_id = location.id,
-                    provider = self,
-                )
-            loc.name    = location.name
-            loc.country = location.country
-            loc.save()
-            logging.debug(
-                "Added new location '%s' for provider %s" % (loc.name, self))
-        logging.debug("Imported all locations for provider %s" % self)
-    
+        rows = [{
+            'location_id': location.id,
+            'name':        location.name,
+            'country':     location.country,
+        } for location in self.conn.get_locations()]
+        stats = upsert_catalog(
+            self, Location, 'location_id', rows, ['name', 'country'])
+        if stats['created'] or stats['updated']:
+            invalidate_node_form(self.id)
+        logging.debug(
+            "Imported all locations for provider %s: %s" % (self, stats))
+        return stats
+    
+    @sync_stage('import_sizes')
     @transaction.commit_on_success()
     def import_sizes(self):
         '''Get all sizes from this provider and store them in the DB'''
         self.create_connection()
-        for size in self.conn.get_sizes():
+        rows = [{
+            'size_id':   size.id,
+            'name':      size.name,
+            'ram':       size.ram,
+            'disk':      size.disk or "",
+            'bandwidth': size.bandwidth or "",
+            'price':     size.price or "",
+        } for size in self.conn.get_sizes()]
+        stats = upsert_catalog(self, Size, 'size_id', rows,
+            ['name', 'ram', 'disk', 'bandwidth', 'price'])
+        if stats['created'] or stats['updated']:
+            invalidate_node_form(self.id)
+        logging.debug("Imported all sizes for provider %s: %s" % (self, stats))
+        return stats
+    
+    def decommission_nodes(self, nodes):
+        '''Rename nodes of this provider and mark them as decommissioned
+        Free DECOM names are found with a single query and all nodes are
+        written with batched updates in one transaction. Retried if a
+        concurrent sync takes one of the names first.
+        Returns the number of decommissioned nodes
+        '''
+        nodes = list(nodes)
+        if not nodes: return 0
+        original = [(n.name, n.state, n.environment) for n in nodes]
+        for attempt in range(DECOM_RETRIES):
+            newnames = decom_names(self, [n.name for n in nodes])
+            for n, newname in zip(nodes, newnames):
+                n.name = newname
+                n.state = 'Terminated'
+                n.environment = 'Decommissioned'
             try:
-                # Update size if it exists
-                siz = Size.objects.get(size_id=size.id, provider=self)
-            except Size.DoesNotExist:
-                # Create new size if it didn't exist
-                siz = Size(
-                    size_id = size.id,
-                    provider = self,
-                )
-            siz.name      = size.name
-            siz.ram       = size.ram
-            siz.disk      = size.disk or ""
-            siz.bandwidth = size.bandwidth or ""
-            siz.price     = size.price or ""
-            siz.save()
-            logging.debug(
-                "Added new size '%s' for provider %s" % (siz.name, self))
-        logging.debug("Imported all sizes for provider %s" % self)
+                self._write_decommissioned(nodes)
+                return len(nodes)
+            except IntegrityError:
+                if attempt == DECOM_RETRIES - 1: raise
+                for n, values in zip(nodes, original):
+                    n.name, n.state, n.environment = values
+                logging.warning("decommission_nodes(): name taken, retrying")
+    
+    @transaction.commit_on_success()
+    def _write_decommissioned(self, nodes):
+        bulk_update(Node, nodes, ['name', 'state', 'environment'])
+        # Signals are not sent for bulk updates
+        table_changed('node')
     
     def update(self):
+        '''Save provider and sync its nodes. Returns import_nodes() stats'''
         logging.debug('Updating provider "%s"...' % self.name)
         self.save()
-        self.import_nodes()
+        return self.refresh()
+    
+    def refresh(self):
+        '''Sync the nodes of a saved provider. Unlike update(), the provider
+        and its actions are not written again and the credentials are not
+        checked, the pooled connection is reused.
+        Returns import_nodes() stats
+        '''
+        logging.debug('Refreshing provider "%s"...' % self.name)
+        return self.import_nodes()
     
     def get_sizes(self):
         return self.size_set.all()
@@ -229,6 +397,29 @@ class Provider(models.Model):
     def get_fav_images(self):
         return self.image_set.filter(favorite=True)
     
+    def search_images(self, query, offset=0, limit=20):
+        '''Returns up to limit images whose name or image_id matches query,
+        starting at offset. Prefix matches come first, then the images
+        containing query elsewhere, each group ordered by name.
+        Names are matched case insensitively, prefixes through the indexed
+        search_name. Substring matches scan the provider's images
+        '''
+        images = self.image_set.order_by('name', 'image_id')
+        prefix = Q(search_name__startswith=query.lower()) | \
+            Q(image_id__startswith=query)
+        matches = images.filter(prefix)
+        results = list(matches[offset:offset + limit])
+        if len(results) < limit:
+            skip = 0
+            if offset:
+                # Count the prefix matches only when paging past them
+                skip = max(0, offset - matches.count())
+            substring = images.filter(
+                Q(name__icontains=query) | Q(image_id__icontains=query)
+            ).exclude(prefix)
+            results += list(substring[skip:skip + limit - len(results)])
+        return results
+    
     def get_locations(self):
         return self.location_set.all()
     
@@ -252,12 +443,19 @@ class Image(models.Model):
     '''OS image model'''
     image_id = models.CharField(max_length=20)
     name     = models.CharField(max_length=30)
+    # Lowercase name, so that case insensitive prefix searches can use an
+    # index (istartswith on name can't)
+    search_name = models.CharField(max_length=30, db_index=True, editable=False)
     provider = models.ForeignKey(Provider)
     favorite = models.BooleanField(default=False)
     
     def __unicode__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        self.search_name = self.name.lower()
+        super(Image, self).save(*args, **kwargs)
+    
     class Meta:
         unique_together  = ('provider', 'image_id')
 
@@ -321,12 +519,15 @@ class Node(models.Model):
     size        = models.ForeignKey(Size, null=True, blank=True)
     
     state       = models.CharField(
-        default='Begin', max_length=20, choices=STATE_CHOICES
+        default='Begin', max_length=20, choices=STATE_CHOICES, db_index=True
     )
     public_ip   = models.CharField(max_length=25)
     internal_ip = models.CharField(max_length=25, blank=True)
     hostname    = models.CharField(max_length=25, blank=True)
     _extra_data = models.TextField(blank=True)
+    # Promoted from extra data, see EXTRA_DATA_COLUMNS
+    instance_type     = models.CharField(max_length=30, blank=True, db_index=True)
+    availability_zone = models.CharField(max_length=30, blank=True, db_index=True)
     
     # Overmind related fields
     environment = models.CharField(
@@ -335,6 +536,14 @@ class Node(models.Model):
     creator     = models.CharField(max_length=25)
     timestamp   = models.DateTimeField(auto_now_add=True)
     
+    # Extra data keys, in order of preference, copied to indexed columns
+    # (EC2, Rackspace and Hetzner keys) so that nodes can be filtered on them
+    EXTRA_DATA_COLUMNS = (
+        ('instance_type', ('instancetype', 'flavorId', 'product')),
+        ('availability_zone', ('availability', 'location')),
+    )
+    _extra_data_cache = None
+    
     class Meta:
         unique_together  = (('provider', 'name'), ('provider', 'uuid'))
     
@@ -342,16 +551,44 @@ class Node(models.Model):
         return "<" + str(self.provider) + ": " + self.name + " - " + self.public_ip + " - " + self.uuid + ">"
     
     def save_extra_data(self, data):
-        self._extra_data = json.dumps(data)
+        '''Serialize data into _extra_data and copy the keys listed in
+        EXTRA_DATA_COLUMNS to their columns.
+        Returns False if the serialized data didn't change
+        '''
+        serialized = json.dumps(data, sort_keys=True)
+        if serialized == self._extra_data:
+            return False
+        self._extra_data = serialized
+        if isinstance(data, dict):
+            for column, keys in self.EXTRA_DATA_COLUMNS:
+                value = ""
+                for key in keys:
+                    if data.get(key):
+                        value = unicode(data[key])
+                        break
+                setattr(self, column, value)
+        return True
     
     def extra_data(self):
+        '''Returns the decoded extra data. It is decoded only once
+        for every value of _extra_data
+        '''
         if self._extra_data == '':
             return {}
-        return json.loads(self._extra_data)
+        if self._extra_data_cache is None or \
+            self._extra_data_cache[0] is not self._extra_data:
+            self._extra_data_cache = (
+                self._extra_data, json.loads(self._extra_data))
+        return self._extra_data_cache[1]
     
     def reboot(self):
         '''Returns True if the reboot was successful, otherwise False'''
-        return self.provider.reboot_node(self)
+        ret = self.provider.reboot_node(self)
+        if ret:
+            # Until the poller or a sync sees it running again
+            self.state = 'Rebooting'
+            self.save()
+        return ret
     
     def destroy(self):
         '''Returns True if the destroy was successful, otherwise False'''
@@ -367,18 +604,161 @@ class Node(models.Model):
     
     def decommission(self):
         '''Rename node and set its environment to decomissioned'''
-        self.state = 'Terminated'
-        # Rename node to free the name for future use
+        name = self.name
+        for attempt in range(DECOM_RETRIES):
+            self.state = 'Terminated'
+            # Rename node to free the name for future use
+            self.name = decom_names(self.provider_id, [name], exclude=self.id)[0]
+            # Mark as decommissioned and save
+            self.environment = 'Decommissioned'
+            try:
+                self.save()
+                return
+            except IntegrityError:
+                # A concurrent sync took the name
+                transaction.rollback_unless_managed()
+                if attempt == DECOM_RETRIES - 1: raise
+
+
+def decom_names(provider, names, exclude=None):
+    '''Returns the first free "DECOM<n>-<name>" name of the provider (or
+    provider id) for every name in names. Only the DECOM names ending in one of names are
+    fetched, with a query per DECOM_QUERY_NAMES names.
+    exclude is the id of a node whose name is not considered taken
+    '''
+    unique = list(set(names))
+    taken = set()
+    for i in range(0, len(unique), DECOM_QUERY_NAMES):
+        endings = reduce(operator.or_, [Q(name__endswith='-' + name)
+            for name in unique[i:i + DECOM_QUERY_NAMES]])
+        query = Node.objects.filter(
+            endings, provider=provider, name__startswith='DECOM')
+        if exclude is not None:
+            query = query.exclude(id=exclude)
+        taken.update(query.values_list('name', flat=True))
+    newnames = []
+    for name in names:
         counter = 1
-        newname = "DECOM" + str(counter) + "-" + self.name
-        while(len(Node.objects.filter(
-                provider=self.provider,name=newname
-            ).exclude(
-                id=self.id
-            ))):
+        newname = "DECOM" + str(counter) + "-" + name
+        while newname in taken:
             counter += 1
-            newname = "DECOM" + str(counter) + "-" + self.name
-        self.name = newname
-        # Mark as decommissioned and save
-        self.environment = 'Decommissioned'
-        self.save()
+            newname = "DECOM" + str(counter) + "-" + name
+        taken.add(newname)
+        newnames.append(newname)
+    return newnames
+
+
+class Job(models.Model):
+    '''Task run in the background by the worker (manage.py runworker)'''
+    STATUS_CHOICES = (
+        (u'Queued', u'Queued'),
+        (u'Running', u'Running'),
+        (u'Done', u'Done'),
+        (u'Failed', u'Failed'),
+    )
+    task         = models.CharField(max_length=30)
+    provider     = models.ForeignKey(Provider, null=True, blank=True)
+    status       = models.CharField(
+        default='Queued', max_length=10, choices=STATUS_CHOICES, db_index=True
+    )
+    attempts     = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    error        = models.TextField(blank=True)
+    run_at       = models.DateTimeField(default=datetime.now)
+    # A running job is queued again if its worker doesn't renew the lease
+    lease_until  = models.DateTimeField(null=True, blank=True)
+    created      = models.DateTimeField(auto_now_add=True)
+    finished     = models.DateTimeField(null=True, blank=True)
+    
+    def __unicode__(self):
+        return "%s #%s (%s)" % (self.task, self.id, self.status)
+
+
+class ChangeVersion(models.Model):
+    '''Counter bumped every time a row of the named table changes'''
+    name    = models.CharField(unique=True, max_length=30)
+    version = models.IntegerField(default=0)
+    
+    def __unicode__(self):
+        return "%s: %s" % (self.name, self.version)
+
+
+def bump_version(name):
+    if ChangeVersion.objects.filter(name=name).update(
+            version=F('version') + 1):
+        return
+    sid = transaction.savepoint()
+    try:
+        ChangeVersion(name=name, version=1).save()
+    except IntegrityError:
+        # A concurrent bump created the row since the update
+        transaction.savepoint_rollback(sid)
+        transaction.rollback_unless_managed()
+        ChangeVersion.objects.filter(name=name).update(
+            version=F('version') + 1)
+    else:
+        transaction.savepoint_commit(sid)
+
+def get_versions(names):
+    '''Returns a dict with the current version of every table in names'''
+    versions = dict([(name, 0) for name in names])
+    versions.update(dict(ChangeVersion.objects.filter(
+        name__in=names).values_list('name', 'version')))
+    return versions
+
+def bump_table_version(sender, **kwargs):
+    table_changed(sender._meta.object_name.lower())
+
+# This module is imported both as provisioning.models and
+# overmind.provisioning.models, dispatch_uid connects every receiver once
+for model in (Provider, Node):
+    post_save.connect(bump_table_version, sender=model,
+        dispatch_uid='provisioning.bump_table_version.save.%s' % model.__name__)
+    post_delete.connect(bump_table_version, sender=model,
+        dispatch_uid='provisioning.bump_table_version.delete.%s' % model.__name__)
+
+
+def catalog_version_name(provider_id):
+    return 'catalog.%s' % provider_id
+
+def node_form_cache_key(provider_id):
+    '''The key includes the provider's catalog version, which is stored in
+    the DB: processes with their own cache (like the default locmem cache)
+    stop using their copy as soon as any process changes the catalog
+    '''
+    name = catalog_version_name(provider_id)
+    return 'provisioning.nodeform.%s.%s' % (
+        provider_id, get_versions([name])[name])
+
+def invalidate_node_form(provider_id):
+    '''Outdate the cached NodeForm choices of a provider in all processes'''
+    table_changed(catalog_version_name(provider_id))
+
+def invalidate_catalog(sender, instance, **kwargs):
+    invalidate_node_form(getattr(instance, 'provider_id', instance.id))
+
+for model in (Provider, Image, Location, Size):
+    post_save.connect(invalidate_catalog, sender=model,
+        dispatch_uid='provisioning.invalidate_catalog.save.%s' % model.__name__)
+    post_delete.connect(invalidate_catalog, sender=model,
+        dispatch_uid='provisioning.invalidate_catalog.delete.%s' % model.__name__)
+
+
+def invalidate_capabilities(sender, instance, **kwargs):
+    if isinstance(instance, Provider):
+        capabilities.invalidate(instance.id)
+    else:
+        # An action changed or its providers were edited from its side
+        capabilities.invalidate()
+
+# Unlike the receivers above, connected once per name the module is
+# imported as: every copy of the module has its own capabilities
+for model in (Provider, Action):
+    post_save.connect(invalidate_capabilities, sender=model,
+        dispatch_uid='%s.invalidate_capabilities.save.%s' % (
+            __name__, model.__name__))
+    post_delete.connect(invalidate_capabilities, sender=model,
+        dispatch_uid='%s.invalidate_capabilities.delete.%s' % (
+            __name__, model.__name__))
+m2m_changed.connect(invalidate_capabilities, sender=Provider.actions.through,
+    dispatch_uid='%s.invalidate_capabilities.actions' % __name__)
@@ -1,27 +1,70 @@
 # Provisioning plugins module
+# Plugin metadata is read from manifest.json so that plugin modules (and
+# their dependencies) are only imported when their driver is first used.
+# Regenerate the manifest with "manage.py build_plugin_manifest"
+import os
+import simplejson as json
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = os.path.join(PLUGIN_DIR, 'manifest.json')
+
 
 def get_driver(provider):
-    """Gets a driver
+    """Gets a driver, importing its plugin module on first use
     @param provider: name of provider to get driver
     """
     _mod = __import__(provider, globals(), locals())
     return getattr(_mod, "Driver")
 
-def load_plugins():
-    import os
+def plugin_names():
+    return sorted([f[:-3] for f in os.listdir(PLUGIN_DIR)
+        if f.endswith('.py') and f != '__init__.py' and f != 'providerplugin.py'])
+
+def read_meta(driver_name):
+    """Imports a plugin and returns its metadata"""
+    _mod = __import__(driver_name, globals(), locals())
+    return {
+        'display_name': _mod.display_name,
+        'access_key': _mod.access_key,
+        'secret_key': _mod.secret_key,
+        'form_fields': _mod.form_fields,
+        'supported_actions': _mod.supported_actions,
+        'rate_limit': getattr(_mod, 'rate_limit', None),
+        'offline': getattr(_mod, 'offline', False),
+    }
+
+def build_manifest():
+    """Imports all plugins and writes their metadata to the manifest"""
+    manifest = dict([(name, read_meta(name)) for name in plugin_names()])
+    f = open(MANIFEST, 'w')
+    try:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+        f.write('\n')
+    finally:
+        f.close()
+    return manifest
+
+def load_plugins(eager=False):
+    """Returns the metadata of all plugins
+    Plugins missing from the manifest or modified after it was built are
+    imported to read their metadata. eager=True imports all of them
+    """
+    manifest = {}
+    manifest_mtime = 0
+    if not eager:
+        try:
+            manifest = json.load(open(MANIFEST))
+            manifest_mtime = os.path.getmtime(MANIFEST)
+        except (IOError, OSError, ValueError):
+            pass
+
     plugin_list = {}
-    for f in os.listdir(os.path.dirname(__file__)):
-        if f.endswith('.py') and f != '__init__.py' and f != 'providerplugin.py':
-            driver_name = f.rstrip('.py')
-            _mod = __import__(driver_name, globals(), locals())
-            
-            meta = {
-                'display_name': _mod.display_name,
-                'access_key': _mod.access_key,
-                'secret_key': _mod.secret_key,
-                'plugin'    : True,
-                'form_fields': _mod.form_fields,
-                'supported_actions': _mod.supported_actions,
-            }
-            plugin_list[driver_name] = meta
+    for driver_name in plugin_names():
+        meta = manifest.get(driver_name)
+        path = os.path.join(PLUGIN_DIR, driver_name + '.py')
+        if meta is None or os.path.getmtime(path) > manifest_mtime:
+            meta = read_meta(driver_name)
+        meta = dict(meta)
+        meta['plugin'] = True
+        plugin_list[driver_name] = meta
     return plugin_list
@@ -4,6 +4,9 @@ from libcloud.types import NodeState, InvalidCredsException
 import httplib2
 import simplejson as json
 from urllib import urlencode
+from provisioning.httpcache import shared_cache
+from provisioning.ratelimit import limiter, ThrottledError
+import Queue, threading, logging
 
 display_name = "Hetzner"
 access_key   = 'User'
@@ -11,20 +14,63 @@ secret_key   = 'Password'
 form_fields  = None
 # It seems that reboot (reset in the Hetzner API) doesn't work, so don't add
 supported_actions = ['list']
+# Requests per second and burst allowed per account. The robot webservice
+# allows 200 server requests per hour and account and blocks the account
+# when they are exceeded, so the bucket holds an hour's quota (a whole
+# listing of a small account goes out at once, fully concurrent) and refills
+# at the quota's rate. Cached server details don't take tokens
+rate_limit = [200 / 3600.0, 200]
+
+# Number of server detail requests sent in parallel
+DETAIL_CONCURRENCY = 8
+# Times a failed server detail request is retried
+DETAIL_RETRIES = 2
+# Seconds responses are served from the cache. Server details (ips,
+# subnets) rarely change, the server list is always fetched
+CACHE_TTLS = [(r'/server/[^/]+$', 3600)]
 
 
 class Connection():
     host = "https://robot-ws.your-server.de/"
     
-    def __init__(self, user, password):
-        self.conn = httplib2.Http(".cache")
-        self.conn.add_credentials(user, password)
-        
+    def __init__(self, user, password, host=None, cache=None):
+        self.user = user
+        self.password = password
+        if host is not None:
+            self.host = host
+        if cache is None:
+            cache = shared_cache('hetzner', CACHE_TTLS)
+        self.cache = cache
+        self.throttle = limiter.get('hetzner', user)
+        # httplib2.Http objects are not thread safe, every request borrows
+        # one. They keep their connections alive between requests
+        self.pool = Queue.Queue()
+    
+    def _get_http(self):
+        try:
+            return self.pool.get_nowait()
+        except Queue.Empty:
+            http = httplib2.Http()
+            http.add_credentials(self.user, self.password)
+            return http
+    
+    def close(self):
+        '''Close all kept alive connections'''
+        while True:
+            try:
+                http = self.pool.get_nowait()
+            except Queue.Empty:
+                return
+            for conn in http.connections.values():
+                conn.close()
+    
     def _raise_error(self, response, content):
         if response.get('status') == '400':
             raise Exception, "Invalid parameters"
         elif response.get('status') == '401':
             raise InvalidCredsException
+        elif response.get('status') == '403' and 'RATE_LIMIT_EXCEEDED' in content:
+            raise ThrottledError('Request limit exceeded', driver=None)
         elif response.get('status') == '404' and content == 'Server not found':
             raise Exception, "Server not found"
         elif response.get('status') == '404':
@@ -35,41 +81,114 @@ class Connection():
             raise Exception, "Unknown error: " + response.get('status')
     
     def request(self, path, method='GET', params=None):
+        '''Send a request, waiting for the account's rate limit and
+        backing off when the API throttles it'''
         if method != 'GET' and method != 'POST': return None
-        data = None
-        if params: data = urlencode(params)
-        response, content = self.conn.request(
-            self.host + path,
-            method,
-            data,
-        )
+        if method == 'GET':
+            # Fresh cached responses don't count against the limit
+            cached = self.cache.fresh(self.host + path, self.user)
+            if cached is not None:
+                return self._parse(*cached)
+        return self.throttle.call(self._request, path, method, params)
+    
+    def _parse(self, response, content):
         if response.get('status') == '200':
             return json.loads(content)
         else:
             self._raise_error(response, content)
+    
+    def _request(self, path, method, params):
+        data = None
+        if params: data = urlencode(params)
+        http = self._get_http()
+        try:
+            response, content = self.cache.request(
+                http,
+                self.host + path,
+                method,
+                data,
+                self.user,
+            )
+        finally:
+            self.pool.put(http)
+        return self._parse(response, content)
 
 
 class Driver(NodeDriver):
     name = display_name
     type = 0
+    # Connection throttles every request
+    rate_limited = True
     
     NODE_STATE_MAP = {
         'ready': NodeState.RUNNING,
         'process': NodeState.PENDING,
     }
     
-    def __init__(self, user, password):
-        self.connection = Connection(user, password)
+    def __init__(self, user, password, host=None,
+                 concurrency=DETAIL_CONCURRENCY, retries=DETAIL_RETRIES):
+        self.connection = Connection(user, password, host)
+        self.concurrency = concurrency
+        self.retries = retries
+    
+    def _get_details(self, ip):
+        '''Fetch server details, retrying failed requests.
+        Returns None if all attempts failed
+        '''
+        for attempt in range(self.retries + 1):
+            try:
+                return self.connection.request('server/%s' % ip)
+            except (InvalidCredsException, ThrottledError):
+                raise
+            except Exception, e:
+                logging.warning('Hetzner: details of server %s failed '
+                    '(attempt %s): %s' % (ip, attempt + 1, e))
+        return None
+    
+    def _get_all_details(self, ips):
+        '''Fetch the details of all servers using up to self.concurrency
+        threads. Returns a dict of ip => details (None if they failed)
+        '''
+        details = {}
+        errors = []
+        work = Queue.Queue()
+        for ip in ips:
+            work.put(ip)
+        def worker():
+            while True:
+                try:
+                    ip = work.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    details[ip] = self._get_details(ip)
+                except Exception, e:
+                    errors.append(e)
+                    return
+        threads = [threading.Thread(target=worker)
+            for i in range(max(1, min(self.concurrency, len(ips))))]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        if errors:
+            raise errors[0]
+        return details
     
     def _parse_nodes(self, data):
         nodes = []
+        details = self._get_all_details(
+            [n['server']['server_ip'] for n in data])
         for n in data:
             nodedata = n['server']
-            response = self.connection.request('server/%s' % nodedata['server_ip'])
-            nodedata['extra_ips'] = ", ".join(response['server']['ip'])
-            # dict.get() will return None even if we write get('subnet', [])
-            subnets = response['server'].get('subnet') or []
-            nodedata['subnet'] = ", ".join(s['ip'] for s in subnets)
+            response = details.get(nodedata['server_ip'])
+            if response is None:
+                # Keep the server, just without its extra info
+                nodedata['extra_ips'] = ""
+                nodedata['subnet'] = ""
+            else:
+                nodedata['extra_ips'] = ", ".join(response['server']['ip'])
+                # dict.get() will return None even if we write get('subnet', [])
+                subnets = response['server'].get('subnet') or []
+                nodedata['subnet'] = ", ".join(s['ip'] for s in subnets)
             nodes.append(nodedata)
         return nodes
     
@@ -0,0 +1,181 @@
+# Simulated cloud plugin
+# A synthetic cloud that behaves like a remote one: API calls take time,
+# listings are paginated, calls fail or get throttled, and nodes take a
+# while to boot. Configured through the provider's extra parameter
+# "options", a query string like
+# "nodes=5000&latency=0.2&create_node_latency=30&page_size=500&rate=10"
+#
+# nodes, images, sizes, locations: size of the cloud, see synthetic
+# latency:      mean seconds an API call takes
+# <call>_latency: mean seconds for one call (list_nodes, list_images,
+#               list_sizes, list_locations, create_node, reboot_node,
+#               destroy_node), overrides latency
+# distribution: of the latencies: constant, uniform (0 to twice the mean)
+#               or exponential
+# page_size:    items returned per listing request, 0 lists all at once
+# rate:         requests per second allowed before calls are throttled,
+#               with bursts of up to burst requests. 0 disables throttling
+# failure_rate: probability that a request fails
+# boot_time:    seconds nodes stay Pending after creation or Rebooting
+# seed:         makes latencies and failures reproducible when not 0
+from libcloud.types import NodeState, LibcloudError
+from provisioning.ratelimit import ThrottledError
+import synthetic
+import random, time
+
+display_name = "Simulated Cloud"
+access_key   = 'Cloud name'
+secret_key   = None
+form_fields  = ['image', 'size', 'location']
+supported_actions = [
+    'create', 'destroy', 'reboot', 'list', 'images', 'sizes', 'locations']
+# Only for tests and benchmarks, registered when
+# settings.ENABLE_SIMULATED_PROVIDERS is on
+offline = True
+
+DEFAULTS = dict(synthetic.DEFAULTS,
+    latency=0.0, distribution='exponential', page_size=100, rate=0.0,
+    burst=10, failure_rate=0.0, boot_time=10.0, seed=0)
+CALLS = ['list_nodes', 'list_images', 'list_sizes', 'list_locations',
+    'create_node', 'reboot_node', 'destroy_node']
+for call in CALLS:
+    DEFAULTS[call + '_latency'] = -1.0# Use latency
+
+
+class Cloud(synthetic.Cloud):
+    '''Nodes of a simulated cloud, the state changes in progress and the
+    request budget of its account'''
+    def reset(self, driver):
+        synthetic.Cloud.reset(self, driver)
+        self.transitions = {}# node id => (time, state when it finishes)
+        self.tokens = None
+        self.refilled = time.time()
+        # Requests being served now and the most served at once
+        self.in_flight = 0
+        self.peak_in_flight = 0
+    
+    def advance(self):
+        '''Finish the state changes that are due'''
+        now = time.time()
+        for node_id, (due, state) in self.transitions.items():
+            if due <= now:
+                del self.transitions[node_id]
+                if node_id in self.nodes:
+                    self.nodes[node_id].state = state
+
+
+class Driver(synthetic.Driver):
+    name = display_name
+    defaults = DEFAULTS
+    cloud_class = Cloud
+    
+    def __init__(self, key, options=None):
+        synthetic.Driver.__init__(self, key, options)
+        self.random = random.Random(self.options['seed'] or None)
+        self.calls = dict([(call, 0) for call in CALLS])
+    
+    def _latency(self, call):
+        mean = self.options[call + '_latency']
+        if mean < 0:
+            mean = self.options['latency']
+        distribution = self.options['distribution']
+        if mean <= 0 or distribution == 'constant':
+            return max(0, mean)
+        elif distribution == 'uniform':
+            return self.random.uniform(0, 2 * mean)
+        return self.random.expovariate(1.0 / mean)
+    
+    def _throttle(self):
+        rate = self.options['rate']
+        if rate <= 0:
+            return
+        burst = max(1, self.options['burst'])
+        self.cloud.lock.acquire()
+        try:
+            now = time.time()
+            if self.cloud.tokens is None:
+                self.cloud.tokens = burst
+            self.cloud.tokens = min(burst,
+                self.cloud.tokens + (now - self.cloud.refilled) * rate)
+            self.cloud.refilled = now
+            if self.cloud.tokens < 1:
+                raise ThrottledError(
+                    'Request limit exceeded', driver=self)
+            self.cloud.tokens -= 1
+        finally:
+            self.cloud.lock.release()
+    
+    def _request(self, call):
+        '''Simulate one API request'''
+        self.calls[call] += 1
+        self._throttle()
+        self.cloud.lock.acquire()
+        self.cloud.in_flight += 1
+        self.cloud.peak_in_flight = max(
+            self.cloud.peak_in_flight, self.cloud.in_flight)
+        self.cloud.lock.release()
+        try:
+            time.sleep(self._latency(call))
+        finally:
+            self.cloud.lock.acquire()
+            self.cloud.in_flight -= 1
+            self.cloud.lock.release()
+        if self.random.random() < self.options['failure_rate']:
+            raise LibcloudError('Simulated failure of %s' % call, driver=self)
+    
+    def _list(self, call, items):
+        '''Fetch items one page at a time'''
+        page_size = self.options['page_size'] or len(items) or 1
+        for start in range(0, max(1, len(items)), page_size):
+            self._request(call)
+        return items
+    
+    def _transition(self, node, state, final_state):
+        node.state = state
+        self.cloud.transitions[node.id] = (
+            time.time() + self.options['boot_time'], final_state)
+    
+    def list_nodes(self):
+        self.cloud.lock.acquire()
+        try:
+            self.cloud.advance()
+        finally:
+            self.cloud.lock.release()
+        return self._list('list_nodes', synthetic.Driver.list_nodes(self))
+    
+    def list_images(self, location=None):
+        return self._list('list_images', synthetic.Driver.list_images(self))
+    
+    def list_sizes(self, location=None):
+        return self._list('list_sizes', synthetic.Driver.list_sizes(self))
+    
+    def list_locations(self):
+        return self._list(
+            'list_locations', synthetic.Driver.list_locations(self))
+    
+    def create_node(self, name, image, size, location, **kwargs):
+        self._request('create_node')
+        node = synthetic.Driver.create_node(
+            self, name, image, size, location, **kwargs)
+        self.cloud.lock.acquire()
+        try:
+            self._transition(node, NodeState.PENDING, NodeState.RUNNING)
+        finally:
+            self.cloud.lock.release()
+        return node
+    
+    def reboot_node(self, node):
+        self._request('reboot_node')
+        self.cloud.lock.acquire()
+        try:
+            node = self.cloud.nodes.get(node.id)
+            if node is None:
+                return False
+            self._transition(node, NodeState.REBOOTING, NodeState.RUNNING)
+            return True
+        finally:
+            self.cloud.lock.release()
+    
+    def destroy_node(self, node):
+        self._request('destroy_node')
+        return synthetic.Driver.destroy_node(self, node)
@@ -0,0 +1,180 @@
+# Synthetic cloud plugin
+# An offline provider with a configurable number of nodes, images, sizes
+# and locations, used to benchmark Overmind at scale. It is configured
+# through the provider's extra parameter "options", a query string like
+# "nodes=1000&images=5000&sizes=10&locations=1"
+from libcloud.base import NodeDriver, Node, NodeImage, NodeSize, NodeLocation
+from libcloud.types import NodeState
+from urlparse import parse_qs
+import random, threading
+
+display_name = "Synthetic Cloud"
+access_key   = 'Cloud name'
+secret_key   = None
+form_fields  = ['image', 'size', 'location']
+supported_actions = [
+    'create', 'destroy', 'reboot', 'list', 'images', 'sizes', 'locations']
+# Only for tests and benchmarks, registered when
+# settings.ENABLE_SIMULATED_PROVIDERS is on
+offline = True
+
+DEFAULTS = {'nodes': 100, 'images': 100, 'sizes': 4, 'locations': 1}
+
+# Every cloud keeps its nodes here, so that drivers created again for the
+# same cloud see the nodes created and destroyed by previous ones
+_clouds = {}
+_clouds_lock = threading.Lock()
+
+
+def parse_options(options, defaults=DEFAULTS):
+    '''Returns a dict with the values of the options query string, using
+    defaults for the missing ones. Values are converted to the type of
+    their default'''
+    parsed = dict(defaults)
+    for name, values in parse_qs(options or '').items():
+        parsed[name] = type(defaults.get(name, ''))(values[-1])
+    return parsed
+
+
+class Cloud(object):
+    '''Nodes of one synthetic cloud'''
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = counts
+        self.lock = threading.Lock()
+        self.nodes = None# id => libcloud Node
+        self.last_id = 0
+    
+    def reset(self, driver):
+        '''Go back to the initial nodes'''
+        self.nodes = {}
+        self.last_id = 0
+        self.random = random.Random(self.name)
+        for i in range(self.counts['nodes']):
+            node = self.new_node(driver)
+            self.nodes[node.id] = node
+    
+    def image_id(self, i):
+        return 'img-%06d' % (i % self.counts['images'])
+    
+    def size_id(self, i):
+        return 'size-%d' % (i % self.counts['sizes'])
+    
+    def location_id(self, i):
+        return 'loc-%d' % (i % self.counts['locations'])
+    
+    def new_node(self, driver, name=None, image=None, size=None, location=None):
+        self.last_id += 1
+        i = self.last_id
+        return Node(
+            id         = '%s-%06d' % (self.name, i),
+            name       = name or 'node-%06d' % i,
+            state      = NodeState.RUNNING,
+            public_ip  = ['10.%s.%s.%s' % (i / 65536 % 256, i / 256 % 256, i % 256)],
+            private_ip = [],
+            driver     = driver,
+            extra      = {
+                'imageId':      image or self.image_id(i),
+                'instancetype': size or self.size_id(i),
+                'availability': location or self.location_id(i),
+            },
+        )
+
+
+def get_cloud(name, counts, cls=Cloud):
+    key = (cls, name, tuple(sorted(counts.items())))
+    _clouds_lock.acquire()
+    try:
+        if key not in _clouds:
+            _clouds[key] = cls(name, counts)
+        return _clouds[key]
+    finally:
+        _clouds_lock.release()
+
+
+class Driver(NodeDriver):
+    name = display_name
+    type = 0
+    defaults = DEFAULTS
+    cloud_class = Cloud
+    
+    def __init__(self, key, options=None):
+        self.key = key
+        self.options = parse_options(options, self.defaults)
+        self.counts = dict([(name, self.options[name]) for name in DEFAULTS])
+        self.cloud = get_cloud(key, self.counts, self.cloud_class)
+        self.cloud.lock.acquire()
+        try:
+            if self.cloud.nodes is None:
+                self.cloud.reset(self)
+        finally:
+            self.cloud.lock.release()
+    
+    def list_nodes(self):
+        self.cloud.lock.acquire()
+        try:
+            return [self.cloud.nodes[i] for i in sorted(self.cloud.nodes)]
+        finally:
+            self.cloud.lock.release()
+    
+    def list_images(self, location=None):
+        return [NodeImage('img-%06d' % i, 'image %06d' % i, self)
+            for i in range(self.counts['images'])]
+    
+    def list_sizes(self, location=None):
+        return [NodeSize('size-%d' % i, 'size %d' % i, 512 * (i + 1),
+            10 * (i + 1), None, 0.01 * (i + 1), self)
+            for i in range(self.counts['sizes'])]
+    
+    def list_locations(self):
+        return [NodeLocation('loc-%d' % i, 'location %d' % i, 'US', self)
+            for i in range(self.counts['locations'])]
+    
+    def create_node(self, name, image, size, location, **kwargs):
+        self.cloud.lock.acquire()
+        try:
+            node = self.cloud.new_node(
+                self, name, image.id, size.id, location.id)
+            self.cloud.nodes[node.id] = node
+            return node
+        finally:
+            self.cloud.lock.release()
+    
+    def reboot_node(self, node):
+        return node.id in self.cloud.nodes
+    
+    def destroy_node(self, node):
+        self.cloud.lock.acquire()
+        try:
+            return self.cloud.nodes.pop(node.id, None) is not None
+        finally:
+            self.cloud.lock.release()
+    
+    def ex_reset(self):
+        '''Forget the nodes created, destroyed or changed since the cloud
+        was first used'''
+        self.cloud.lock.acquire()
+        try:
+            self.cloud.reset(self)
+        finally:
+            self.cloud.lock.release()
+    
+    def ex_churn(self, fraction):
+        '''Destroy, create and terminate fraction of the nodes each, like
+        other tools working on the same account would. Returns the number
+        of nodes affected by each change
+        '''
+        self.cloud.lock.acquire()
+        try:
+            count = int(len(self.cloud.nodes) * fraction)
+            ids = sorted(self.cloud.nodes)
+            for i in self.cloud.random.sample(ids, count):
+                del self.cloud.nodes[i]
+            for i in range(count):
+                node = self.cloud.new_node(self)
+                self.cloud.nodes[node.id] = node
+            for i in self.cloud.random.sample(sorted(self.cloud.nodes), count):
+                self.cloud.nodes[i].state = NodeState.TERMINATED
+            return count
+        finally:
+            self.cloud.lock.release()
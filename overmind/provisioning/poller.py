@@ -0,0 +1,137 @@
+# Refreshes nodes in transitional states until they settle.
+# Run by "manage.py pollnodes"
+from django.conf import settings
+from django.db import transaction, reset_queries
+from provisioning.models import Node, get_state, table_changed
+from provisioning.bulk import bulk_update
+from provisioning.workers import run_bounded
+import logging, time
+
+# States a node only stays in for a while
+TRANSITIONAL_STATES = ('Pending', 'Rebooting', 'Stopping', 'Configuring')
+
+
+def list_nodes(provider):
+    '''Returns the provider's nodes as a dict uuid => libcloud Node'''
+    provider.create_connection()
+    return dict([(n.uuid, n) for n in provider.conn.get_nodes()])
+
+@transaction.commit_on_success()
+def save_states(nodes):
+    bulk_update(Node, nodes, ['state', 'public_ip'])
+    table_changed('node')
+
+
+class Poller(object):
+    '''Polls nodes in TRANSITIONAL_STATES with exponential backoff
+    A node is first polled min_interval seconds after it is found and the
+    delay doubles after every poll where it didn't settle, up to
+    max_interval. Due nodes are refreshed with one listing per provider,
+    providers are listed in parallel by up to workers threads. Listings
+    exceeding timeout are retried later, states are only saved by the
+    polling thread.
+    Nodes are forgotten as soon as they reach a stable state
+    '''
+    def __init__(self, min_interval=None, max_interval=None, workers=None,
+            timeout=None):
+        if min_interval is None:
+            min_interval = getattr(settings, 'NODE_POLL_MIN_INTERVAL', 2)
+        if max_interval is None:
+            max_interval = getattr(settings, 'NODE_POLL_MAX_INTERVAL', 60)
+        if workers is None:
+            workers = getattr(settings, 'SYNC_WORKERS', 4)
+        if timeout is None:
+            timeout = getattr(settings, 'SYNC_TIMEOUT', None)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.workers = workers
+        self.timeout = timeout
+        self.schedule = {}# node id => [next poll time, delay]
+    
+    def track(self, nodes, now):
+        '''Schedule newly found transitional nodes and forget the ones that
+        are not transitional anymore'''
+        ids = set()
+        for node in nodes:
+            ids.add(node.id)
+            if node.id not in self.schedule:
+                self.schedule[node.id] = [
+                    now + self.min_interval, self.min_interval]
+        for node_id in self.schedule.keys():
+            if node_id not in ids:
+                del self.schedule[node_id]
+    
+    def poll(self, now=None):
+        '''Refresh the nodes that are due
+        Returns a dict with the number of polled, changed and settled nodes
+        '''
+        if now is None:
+            now = time.time()
+        nodes = Node.objects.filter(state__in=TRANSITIONAL_STATES).exclude(
+            environment='Decommissioned').select_related('provider')
+        self.track(nodes, now)
+        stats = {'polled': 0, 'changed': 0, 'settled': 0}
+        
+        due = {}# provider id => nodes
+        providers = {}
+        for node in nodes:
+            if self.schedule[node.id][0] <= now:
+                due.setdefault(node.provider_id, []).append(node)
+                providers[node.provider_id] = node.provider
+        if not due:
+            return stats
+        
+        changed = []
+        for r in run_bounded(list_nodes, providers.values(), self.workers,
+                self.timeout):
+            for node in due[r.item.id]:
+                stats['polled'] += 1
+                remote = r.value and r.value.get(node.uuid)
+                if remote is not None:
+                    old = (node.state, node.public_ip)
+                    node.state = get_state(remote.state)
+                    if remote.public_ip:
+                        node.public_ip = remote.public_ip[0]
+                    if old != (node.state, node.public_ip):
+                        changed.append(node)
+                    if node.state not in TRANSITIONAL_STATES:
+                        stats['settled'] += 1
+                        del self.schedule[node.id]
+                        continue
+                # A failed listing or a node missing at the provider is
+                # retried later. Syncs decommission vanished nodes
+                entry = self.schedule[node.id]
+                entry[1] = min(entry[1] * 2, self.max_interval)
+                entry[0] = now + entry[1]
+        
+        if changed:
+            save_states(changed)
+        stats['changed'] = len(changed)
+        logging.debug('Polled %(polled)s nodes: %(changed)s changed, '
+            '%(settled)s settled' % stats)
+        return stats
+    
+    def next_poll(self):
+        '''Returns the time the next node is due, or None'''
+        if not self.schedule:
+            return None
+        return min([entry[0] for entry in self.schedule.values()])
+    
+    def run(self, interval=None, until_settled=False):
+        '''Poll forever, looking for new transitional nodes every interval
+        seconds. With until_settled, return once no node is transitional
+        '''
+        if interval is None:
+            interval = getattr(settings, 'NODE_POLL_INTERVAL', 1)
+        logging.info('Node poller started')
+        while True:
+            # Don't let the query log grow forever with DEBUG
+            reset_queries()
+            self.poll()
+            if until_settled and not self.schedule:
+                return
+            wait = interval
+            next_poll = self.next_poll()
+            if next_poll is not None:
+                wait = max(0, min(interval, next_poll - time.time()))
+            time.sleep(wait)
@@ -1,6 +1,11 @@
 # List of supported providers and related info
 from django.conf import settings
-from overmind.provisioning import plugins
+from provisioning import plugins
+
+# rate_limit: requests per second and burst allowed per account.
+# Providers without it are not rate limited. settings.RATE_LIMITS overrides
+# them by provider type
+EC2_RATE_LIMIT = [5, 50]
 
 LIBCLOUD_PROVIDERS = {
     'DUMMY': {
@@ -14,18 +19,21 @@ LIBCLOUD_PROVIDERS = {
         'secret_key': 'AWS Secret Key',
         # ex_keyname is needed for EC2 to have our ssh key deployed to nodes
         'extra_param': ['ex_keyname', settings.PUBLIC_KEY_FILE.split(".")[0]],
+        'rate_limit': EC2_RATE_LIMIT,
     },
     'EC2_US_EAST': {
         'display_name': 'EC2 US East',
         'access_key': 'AWS Access Key ID',
         'secret_key': 'AWS Secret Key',
         'extra_param': ['ex_keyname', settings.PUBLIC_KEY_FILE.split(".")[0]],
+        'rate_limit': EC2_RATE_LIMIT,
     },
     'EC2_EU_WEST': {
         'display_name': 'EC2 EU West',
         'access_key': 'AWS Access Key ID',
         'secret_key': 'AWS Secret Key',
         'extra_param': ['ex_keyname', settings.PUBLIC_KEY_FILE.split(".")[0]],
+        'rate_limit': EC2_RATE_LIMIT,
     },
     'RACKSPACE': {
         'display_name': 'Rackspace',
@@ -45,10 +53,24 @@ def add_libcloud_providers():
         ]
         PROVIDERS[provider]['form_fields'] = ['image', 'size', 'location']
 
-def add_plugins():
+def add_plugins(offline=False):
+    '''Register the plugins. Offline plugins (simulated clouds for tests
+    and benchmarks) only when offline is True'''
     plugin_dict = plugins.load_plugins()
     for provider in plugin_dict.keys():
-        PROVIDERS[provider] = plugin_dict[provider]
+        if offline or not plugin_dict[provider].get('offline'):
+            PROVIDERS[provider] = plugin_dict[provider]
+
+def add_rate_limits():
+    for provider, limit in getattr(settings, 'RATE_LIMITS', {}).items():
+        if provider in PROVIDERS:
+            PROVIDERS[provider]['rate_limit'] = limit
+
+def enable_simulated_providers():
+    '''Register the offline plugins, for tests and benchmarks'''
+    add_plugins(offline=True)
+    add_rate_limits()
 
 add_libcloud_providers()
-add_plugins()
+add_plugins(getattr(settings, 'ENABLE_SIMULATED_PROVIDERS', False))
+add_rate_limits()
@@ -0,0 +1,164 @@
+# Client side rate limiting of provider API calls
+# Every provider account gets a token bucket sized by the "rate_limit" of
+# its provider type in provider_meta, and calls the provider throttles are
+# retried with jittered exponential backoff
+from django.conf import settings
+from libcloud.types import LibcloudError
+from provisioning import metrics
+import logging, random, threading, time
+
+# Error messages of providers refusing requests because too many were sent
+THROTTLING_CODES = ('RequestLimitExceeded', 'Throttling', 'RATE_LIMIT_EXCEEDED')
+
+rate_limit_wait = metrics.registry.register(metrics.Histogram(
+    'overmind_rate_limit_wait_seconds',
+    'Time provider calls waited for a token (bucket) or after being '
+    'throttled (backoff)', ('provider_type', 'reason')))
+throttled_calls = metrics.registry.register(metrics.Counter(
+    'overmind_provider_throttled_total',
+    'Provider calls refused because of request limits', ('provider_type',)))
+
+
+def _setting(name, default):
+    try:
+        return getattr(settings, name, default)
+    except ImportError:
+        # Django is not configured, like in the plugin benchmarks
+        return default
+
+
+class ThrottledError(LibcloudError):
+    '''The provider refused a request because too many were sent'''
+
+
+def is_throttled(error):
+    if isinstance(error, ThrottledError):
+        return True
+    # libcloud drivers raise plain exceptions with the provider's error code
+    message = getattr(error, 'value', None) or (error.args and error.args[0])
+    if not isinstance(message, basestring):
+        return False
+    return [code for code in THROTTLING_CODES if code in message] != []
+
+
+class TokenBucket(object):
+    '''Allows rate calls per second on average and bursts of up to burst
+    calls. Thread safe'''
+    def __init__(self, rate, burst):
+        self.rate    = float(rate)
+        self.burst   = max(1, burst)
+        self.tokens  = float(self.burst)
+        self.updated = time.time()
+        self.lock    = threading.Lock()
+    
+    def acquire(self):
+        '''Take a token, sleeping until there is one.
+        Returns the seconds waited'''
+        waited = 0.0
+        while True:
+            self.lock.acquire()
+            try:
+                now = time.time()
+                self.tokens = min(self.burst,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            finally:
+                self.lock.release()
+            time.sleep(wait)
+            waited += wait
+
+
+class Throttle(object):
+    '''Sends the calls of one provider account through its token bucket
+    (if the provider type has a rate limit) and retries throttled calls
+    up to settings.RATE_LIMIT_RETRIES times. The n-th retry waits a random
+    time up to settings.RATE_LIMIT_BACKOFF * 2 ** n seconds, capped at
+    settings.RATE_LIMIT_MAX_BACKOFF
+    '''
+    def __init__(self, provider_type, bucket=None):
+        self.provider_type = provider_type
+        self.bucket = bucket
+    
+    def wait(self):
+        '''Wait for a token of the bucket'''
+        if self.bucket is not None:
+            rate_limit_wait.observe(self.bucket.acquire(),
+                provider_type=self.provider_type, reason='bucket')
+    
+    def call(self, func, *args, **kwargs):
+        retries = _setting('RATE_LIMIT_RETRIES', 5)
+        base = _setting('RATE_LIMIT_BACKOFF', 1)
+        cap = _setting('RATE_LIMIT_MAX_BACKOFF', 60)
+        attempt = 0
+        while True:
+            self.wait()
+            try:
+                return func(*args, **kwargs)
+            except Exception, e:
+                if not is_throttled(e):
+                    raise
+                throttled_calls.inc(provider_type=self.provider_type)
+                if attempt >= retries:
+                    raise
+            delay = random.uniform(0, min(cap, base * 2 ** attempt))
+            attempt += 1
+            logging.warning('%s: %s throttled, retry %s in %.2fs' % (
+                self.provider_type, getattr(func, '__name__', func),
+                attempt, delay))
+            rate_limit_wait.observe(delay,
+                provider_type=self.provider_type, reason='backoff')
+            time.sleep(delay)
+    
+    def call_once(self, func, *args, **kwargs):
+        '''Wait for a token but don't retry, for calls that may have done
+        something before being throttled (like deploy_node)'''
+        self.wait()
+        try:
+            return func(*args, **kwargs)
+        except Exception, e:
+            if is_throttled(e):
+                throttled_calls.inc(provider_type=self.provider_type)
+            raise
+
+
+class RateLimiter(object):
+    '''Process wide token buckets, one per provider type and credentials'''
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.buckets = {}# (provider type, credentials) => TokenBucket
+    
+    def get(self, provider_type, credentials):
+        '''Returns the Throttle of a provider account'''
+        # Not imported at module level, plugins using this module are
+        # imported by provider_meta
+        try:
+            from provisioning.provider_meta import PROVIDERS
+        except ImportError:
+            # Django is not configured, plugins are used on their own
+            PROVIDERS = {}
+        limit = PROVIDERS.get(provider_type, {}).get('rate_limit')
+        if not limit:
+            return Throttle(provider_type)
+        key = (provider_type, credentials)
+        self.lock.acquire()
+        try:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*limit)
+        finally:
+            self.lock.release()
+        return Throttle(provider_type, bucket)
+    
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.buckets.clear()
+        finally:
+            self.lock.release()
+
+
+limiter = RateLimiter()
@@ -0,0 +1,42 @@
+# Concurrent synchronization of providers
+from django.conf import settings
+from provisioning.models import Provider
+from provisioning.workers import run_bounded
+import logging
+
+
+def refresh_provider(provider):
+    return provider.refresh()
+
+def sync_providers(providers=None, workers=None, timeout=None):
+    '''Update all providers that support listing nodes, in parallel
+    At most settings.SYNC_WORKERS providers are synched at the same time.
+    A provider failing or exceeding settings.SYNC_TIMEOUT seconds doesn't
+    affect the others. A timed out sync that gets its node listing later
+    doesn't write it (see workers.check_abandoned).
+    Returns a list with a summary dict for every provider: name, duration,
+    nodes (number of nodes listed) and error (None if it succeeded)
+    '''
+    if providers is None:
+        providers = Provider.objects.all()
+    if workers is None:
+        workers = getattr(settings, 'SYNC_WORKERS', 4)
+    if timeout is None:
+        timeout = getattr(settings, 'SYNC_TIMEOUT', None)
+    providers = [p for p in providers if p.supports('list')]
+
+    summary = []
+    for r in run_bounded(refresh_provider, providers, workers, timeout):
+        nodes = None
+        if r.value is not None:
+            nodes = r.value['created'] + r.value['updated'] + r.value['unchanged']
+        result = {
+            'provider': r.item.name,
+            'duration': round(r.duration, 3),
+            'nodes':    nodes,
+            'error':    r.error is not None and unicode(r.error) or None,
+        }
+        logging.info('Synched provider "%(provider)s" in %(duration)ss: '
+            '%(nodes)s nodes, error: %(error)s' % result)
+        summary.append(result)
+    return summary
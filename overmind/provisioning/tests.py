@@ -0,0 +1,1132 @@
+from django.test import TestCase
+from django.test.client import Client
+from django.contrib.auth.models import User, Group
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.core.cache import cache
+from provisioning.models import Provider, Node, Image, Location, Size, Job
+from provisioning.models import Action, ChangeVersion, capabilities, get_versions
+from provisioning.models import decom_names
+from provisioning.forms import NodeForm
+from provisioning import jobs, plugins
+from provisioning.plugins import simulated
+from provisioning import metrics, middleware, batch, ratelimit
+from provisioning import provider_meta
+from provisioning.provider_meta import PROVIDERS, enable_simulated_providers
+from provisioning.poller import Poller
+from provisioning.controllers import ControllerPool, controller_pool
+from provisioning.sync import sync_providers
+from provisioning.workers import run_bounded, check_abandoned, Abandoned
+from provisioning.httpcache import ResponseCache
+from benchmarks.fake_robot import FakeRobot
+from benchmarks import fleet
+from datetime import datetime, timedelta
+import simplejson as json
+from libcloud.types import NodeState, LibcloudError
+import cPickle, httplib2, os, shutil, tempfile, threading, time
+
+# The simulated and synthetic clouds are used below
+enable_simulated_providers()
+
+
+class BaseProvisioningTestCase(TestCase):
+    def setUp(self):
+        # Don't share dummy drivers, capabilities or cached forms between tests
+        controller_pool.clear()
+        capabilities.clear()
+        cache.clear()
+        self.p1 = Provider(name="prov1", provider_type="DUMMY", access_key="keyzz")
+        self.p1.save()
+    
+    def capture_queries(self, func, *args, **kwargs):
+        '''Returns the result of func and the SQL of the queries it ran'''
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            result = func(*args, **kwargs)
+            return result, [q['sql'] for q in connection.queries]
+        finally:
+            settings.DEBUG = debug
+    
+    def count_queries(self, func, *args, **kwargs):
+        return len(self.capture_queries(func, *args, **kwargs)[1])
+
+
+class ImportCatalogTest(BaseProvisioningTestCase):
+    def test_import_images(self):
+        '''Should create all images on the first import'''
+        stats = self.p1.import_images()
+        self.assertEquals(stats, {'created': 3, 'updated': 0, 'unchanged': 0})
+        self.assertEquals(Image.objects.filter(provider=self.p1).count(), 3)
+
+    def test_import_images_twice(self):
+        '''Should not write anything when images didn't change'''
+        self.p1.import_images()
+        stats = self.p1.import_images()
+        self.assertEquals(stats, {'created': 0, 'updated': 0, 'unchanged': 3})
+        self.assertEquals(Image.objects.filter(provider=self.p1).count(), 3)
+
+    def test_import_images_changed(self):
+        '''Should only update changed images and keep favorites'''
+        self.p1.import_images()
+        img = Image.objects.filter(provider=self.p1)[0]
+        name = img.name
+        img.name = "Renamed image"
+        img.favorite = True
+        img.save()
+        stats = self.p1.import_images()
+        self.assertEquals(stats, {'created': 0, 'updated': 1, 'unchanged': 2})
+        img = Image.objects.get(id=img.id)
+        self.assertEquals(img.name, name)
+        self.assertTrue(img.favorite)
+
+    def test_import_locations_and_sizes(self):
+        '''Should import locations and sizes'''
+        # The dummy driver lists three locations with the same id
+        self.assertEquals(self.p1.import_locations()['created'], 1)
+        self.assertEquals(self.p1.import_sizes()['created'], 4)
+        self.assertEquals(self.p1.import_sizes()['unchanged'], 4)
+        self.assertEquals(Location.objects.filter(provider=self.p1).count(), 1)
+        self.assertEquals(Size.objects.filter(provider=self.p1).count(), 4)
+
+
+class ImportNodesTest(BaseProvisioningTestCase):
+    def test_import_nodes(self):
+        '''Should create all listed nodes on the first sync'''
+        stats = self.p1.import_nodes()
+        self.assertEquals(stats['created'], 2)
+        self.assertEquals(Node.objects.filter(provider=self.p1).count(), 2)
+
+    def test_import_nodes_unchanged(self):
+        '''Should not save nodes that didn't change'''
+        self.p1.import_nodes()
+        stats = self.p1.import_nodes()
+        self.assertEquals(stats, {
+            'created': 0, 'updated': 0, 'unchanged': 2, 'decommissioned': 0})
+
+    def test_import_nodes_decommission(self):
+        '''Should decommission nodes no longer listed by the provider'''
+        self.p1.import_nodes()
+        removed = self.p1.conn.conn.nl.pop()
+        stats = self.p1.import_nodes()
+        self.assertEquals(stats['decommissioned'], 1)
+        self.assertEquals(stats['unchanged'], 1)
+        node = Node.objects.get(provider=self.p1, uuid=removed.uuid)
+        self.assertEquals(node.environment, 'Decommissioned')
+        self.assertEquals(node.name, 'DECOM1-' + removed.name)
+
+    def test_import_nodes_version(self):
+        '''Should bump the node version once per sync'''
+        self.p1.import_nodes()
+        self.p1.conn.conn.nl.pop()
+        self.assertEquals(get_versions(['node'])['node'], 1)
+        self.p1.import_nodes()
+        self.assertEquals(get_versions(['node'])['node'], 2)
+
+    def test_node_save_version(self):
+        '''Should bump the node version once per save although the models
+        are imported under two names'''
+        import overmind.provisioning.models
+        self.p1.import_nodes()
+        node = Node.objects.all()[0]
+        node.save()
+        self.assertEquals(get_versions(['node'])['node'], 2)
+
+
+class SyncProvidersTest(BaseProvisioningTestCase):
+    def test_sync_providers(self):
+        '''Should return a summary for every provider'''
+        p2 = Provider(name="prov2", provider_type="DUMMY", access_key="keyzz2")
+        p2.save()
+        summary = sync_providers(workers=1)
+        self.assertEquals([s['provider'] for s in summary], ['prov1', 'prov2'])
+        for s in summary:
+            self.assertEquals(s['nodes'], 2)
+            self.assertEquals(s['error'], None)
+        self.assertEquals(Node.objects.count(), 4)
+
+    def test_refresh(self):
+        '''Should sync nodes without writing the provider'''
+        self.p1.import_nodes()
+        stats, sql = self.capture_queries(self.p1.refresh)
+        self.assertEquals(stats['unchanged'], 2)
+        self.assertEquals([q for q in sql if 'provisioning_provider' in q and
+            not q.startswith('SELECT')], [])
+
+    def test_run_bounded(self):
+        '''Should isolate errors and timeouts of every item'''
+        def work(item):
+            if item == 'fail':
+                raise Exception("failed")
+            elif item == 'slow':
+                time.sleep(2)
+            return item
+        results = run_bounded(work, ['a', 'fail', 'slow', 'b'], 2, timeout=0.3)
+        self.assertEquals([r.value for r in results], ['a', None, None, 'b'])
+        self.assertEquals(str(results[1].error), 'failed')
+        self.assertTrue(results[2].timed_out)
+        self.assertFalse(results[3].timed_out)
+
+    def test_run_bounded_abandoned(self):
+        '''Should tell timed out calls that their results are not wanted'''
+        finished = threading.Event()
+        outcome = []
+        def work(item):
+            time.sleep(item)
+            try:
+                check_abandoned()
+                outcome.append((item, 'write'))
+            except Abandoned:
+                outcome.append((item, 'abandoned'))
+            if item:
+                finished.set()
+        run_bounded(work, [0, 0.5], 2, timeout=0.2)
+        finished.wait(2)
+        self.assertEquals(outcome, [(0, 'write'), (0.5, 'abandoned')])
+
+
+class JobQueueTest(BaseProvisioningTestCase):
+    def test_run_job(self):
+        '''Should run queued imports'''
+        job = jobs.enqueue('import_provider', self.p1)
+        self.assertEquals(jobs.run_pending(), 1)
+        job = Job.objects.get(id=job.id)
+        self.assertEquals(job.status, 'Done')
+        self.assertEquals(job.attempts, 1)
+        self.assertEquals(Node.objects.filter(provider=self.p1).count(), 2)
+        self.assertEquals(jobs.run_pending(), 0)
+
+    def test_retry_job(self):
+        '''Should retry failed jobs until they run out of attempts'''
+        job = jobs.enqueue('import_provider', max_attempts=2)
+        jobs.run_pending()
+        job = Job.objects.get(id=job.id)
+        self.assertEquals(job.status, 'Queued')
+        self.assertTrue(job.run_at > datetime.now())
+        
+        job.run_at = datetime.now()
+        job.save()
+        jobs.run_pending()
+        job = Job.objects.get(id=job.id)
+        self.assertEquals(job.status, 'Failed')
+        self.assertEquals(job.attempts, 2)
+
+    def test_requeue_expired(self):
+        '''Should claim again jobs whose worker stopped renewing the lease'''
+        job = jobs.enqueue('import_provider', self.p1, max_attempts=2)
+        self.assertEquals(jobs.claim_next().id, job.id)
+        self.assertEquals(jobs.claim_next(), None)
+        Job.objects.filter(id=job.id).update(
+            lease_until=datetime.now() - timedelta(seconds=1))
+        job = jobs.claim_next()
+        self.assertEquals(job.attempts, 2)
+        self.assertTrue(job.lease_until > datetime.now())
+        # Out of attempts
+        Job.objects.filter(id=job.id).update(
+            lease_until=datetime.now() - timedelta(seconds=1))
+        self.assertEquals(jobs.claim_next(), None)
+        job = Job.objects.get(id=job.id)
+        self.assertEquals(job.status, 'Failed')
+        self.assertEquals(job.error, 'Worker lost')
+
+    def test_heartbeat_survives_errors(self):
+        '''Should keep beating after failing to renew the lease'''
+        job = jobs.enqueue('import_provider', self.p1)
+        heartbeat = jobs.Heartbeat(job, lease=0.03)
+        errors = []
+        def locked(query, **kwargs):
+            errors.append(kwargs)
+            raise Exception('database is locked')
+        update = QuerySet.update
+        QuerySet.update = locked
+        try:
+            heartbeat.start()
+            time.sleep(0.1)
+            self.assertTrue(heartbeat.isAlive())
+        finally:
+            heartbeat.stop()
+            QuerySet.update = update
+        self.assertTrue(len(errors) > 1)
+
+
+class ControllerPoolTest(BaseProvisioningTestCase):
+    def test_shared_controller(self):
+        '''Should reuse the controller of providers with the same credentials'''
+        self.p1.create_connection()
+        stats = controller_pool.stats()
+        p = Provider.objects.get(id=self.p1.id)
+        p.create_connection()
+        self.assertTrue(p.conn is self.p1.conn)
+        self.assertEquals(controller_pool.stats()['misses'], stats['misses'])
+        self.assertEquals(controller_pool.stats()['hits'], stats['hits'] + 1)
+    
+    def test_credentials_changed(self):
+        '''Should replace the controller when credentials change'''
+        self.p1.create_connection()
+        old_conn = self.p1.conn
+        self.p1.access_key = "newkey"
+        self.p1.save()
+        self.assertFalse(self.p1.conn is old_conn)
+        self.assertEquals(controller_pool.stats()['size'], 1)
+    
+    def test_lru_eviction(self):
+        '''Should evict the least recently used controller'''
+        pool = ControllerPool(max_size=1)
+        pool.get(self.p1)
+        p2 = Provider(name="prov2", provider_type="DUMMY", access_key="keyzz2")
+        pool.get(p2)
+        self.assertEquals(pool.stats()['evictions'], 1)
+        self.assertEquals([key for key, thread in pool.entries.keys()],
+            [pool.key(p2)])
+    
+    def test_controller_per_thread(self):
+        '''Should never share a controller between threads'''
+        self.p1.create_connection()
+        other = []
+        t = threading.Thread(target=lambda: other.append(
+            controller_pool.get(self.p1)))
+        t.start()
+        t.join()
+        self.assertFalse(other[0] is self.p1.conn)
+        self.assertTrue(controller_pool.get(self.p1) is self.p1.conn)
+        controller_pool.invalidate(controller_pool.key(self.p1))
+        self.assertEquals(controller_pool.stats()['size'], 0)
+
+
+class NodeIndexTest(BaseProvisioningTestCase):
+    def test_destroy_nodes_lists_once(self):
+        '''Should list nodes only once when destroying several nodes'''
+        self.p1.import_nodes()
+        driver = self.p1.conn.conn
+        calls = []
+        list_nodes = driver.list_nodes
+        def counting_list_nodes():
+            calls.append(1)
+            return list_nodes()
+        driver.list_nodes = counting_list_nodes
+        for node in Node.objects.filter(provider=self.p1):
+            self.assertTrue(node.destroy())
+        self.assertEquals(len(calls), 0)
+        
+        # A stale index is refreshed
+        self.p1.conn.node_index_time = 0
+        node = Node.objects.filter(provider=self.p1)[0]
+        self.assertFalse(self.p1.reboot_node(node))
+        self.assertEquals(len(calls), 1)
+
+
+class CapabilityCacheTest(BaseProvisioningTestCase):
+    def test_supports_cached(self):
+        '''Should only query a provider's actions once'''
+        self.assertEquals(self.count_queries(self.p1.supports, 'list'), 1)
+        self.assertEquals(self.count_queries(self.p1.supports, 'list'), 0)
+        self.assertTrue(self.p1.supports('list'))
+        self.assertFalse(self.p1.supports('fly'))
+        node = Node(name="node1", uuid="uuid1", provider=self.p1)
+        self.assertEquals(self.count_queries(node.provider.supports, 'list'), 0)
+    
+    def test_invalidate(self):
+        '''Should reload the actions of a provider after they change'''
+        self.assertTrue(self.p1.supports('reboot'))
+        self.p1.actions.remove(Action.objects.get(name='reboot'))
+        self.assertFalse(self.p1.supports('reboot'))
+        self.p1.save()
+        self.assertTrue(self.p1.supports('reboot'))
+        self.assertTrue('reboot' in capabilities.shown(self.p1.id))
+        action = Action.objects.get(name='reboot')
+        action.show = False
+        action.save()
+        self.assertFalse('reboot' in capabilities.shown(self.p1.id))
+
+
+class OverviewTest(BaseProvisioningTestCase):
+    def setUp(self):
+        super(OverviewTest, self).setUp()
+        self.user = User.objects.create_user(
+            username='testuser', email='t@t.com', password='test1')
+        self.user.groups.add(Group.objects.get(name='Operator'))
+        self.client = Client()
+        self.client.login(username='testuser', password='test1')
+    
+    def get(self, path):
+        response = self.client.get(path)
+        self.assertEquals(response.status_code, 200)
+        return response
+    
+    def test_overview_queries(self):
+        '''Should render the overview with a constant number of queries'''
+        self.p1.import_nodes()
+        queries = self.count_queries(self.get, '/overview/')
+        for i in range(10):
+            Node(name="node%s" % i, uuid="uuid%s" % i, provider=self.p1,
+                public_ip="10.0.0.%s" % i, state='Running').save()
+        # Compare with the capabilities loaded again
+        capabilities.clear()
+        self.assertEquals(self.count_queries(self.get, '/overview/'), queries)
+        self.assertEquals(self.count_queries(self.get, '/overview/'), queries - 1)
+    
+    def test_overview_filter(self):
+        '''Should only show nodes matching the filters'''
+        self.p1.import_nodes()
+        Node(name="pending", uuid="uuid1", provider=self.p1,
+            public_ip="10.0.0.1", state='Pending').save()
+        response = self.client.get('/overview/?state=Pending')
+        self.assertEquals(
+            [row['node'].name for row in response.context['nodes']], ['pending'])
+    
+    def test_overview_invalid_filter(self):
+        '''Should ignore invalid filter values'''
+        self.p1.import_nodes()
+        response = self.client.get(
+            '/overview/?provider=abc&state=Unplugged&environment=')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['filters'], {})
+        self.assertEquals(len(response.context['nodes']), 2)
+    
+    def update_providers(self, **extra):
+        # Synched inline, the test DB is not shared with other threads
+        workers = settings.SYNC_WORKERS
+        settings.SYNC_WORKERS = 1
+        try:
+            return self.client.get('/provider/update/', **extra)
+        finally:
+            settings.SYNC_WORKERS = workers
+    
+    def test_update_providers_summary(self):
+        '''Should show the sync summary on the next overview only'''
+        response = self.update_providers(follow=True)
+        self.assertEquals(response.context['sync_summary'], [{
+            'provider': 'prov1', 'nodes': 2, 'error': None,
+            'duration': response.context['sync_summary'][0]['duration']}])
+        self.assertContains(response, 'prov1: 2 nodes')
+        self.assertEquals(self.get('/overview/').context['sync_summary'], None)
+    
+    def test_update_providers_ajax(self):
+        '''Should return the sync summary as JSON to AJAX requests'''
+        response = self.update_providers(
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEquals(response['Content-Type'], 'application/json')
+        summary = json.loads(response.content)
+        self.assertEquals([(s['provider'], s['nodes'], s['error'])
+            for s in summary], [('prov1', 2, None)])
+
+
+class ImageSearchTest(BaseProvisioningTestCase):
+    def setUp(self):
+        super(ImageSearchTest, self).setUp()
+        for i, name in enumerate(['ubuntu 10.04', 'centos 5', 'my ubuntu',
+                'debian', 'ubuntu 10.10']):
+            Image(image_id='ami-%s' % i, name=name, provider=self.p1).save()
+        self.user = User.objects.create_user(
+            username='testuser', email='t@t.com', password='test1')
+        self.user.groups.add(Group.objects.get(name='Operator'))
+        self.client = Client()
+        self.client.login(username='testuser', password='test1')
+
+    def test_search_images(self):
+        '''Should list prefix matches first, then substring matches'''
+        names = [img.name for img in self.p1.search_images('UBUNTU')]
+        self.assertEquals(names, ['ubuntu 10.04', 'ubuntu 10.10', 'my ubuntu'])
+        names = [img.name for img in self.p1.search_images('ubuntu', 1, 2)]
+        self.assertEquals(names, ['ubuntu 10.10', 'my ubuntu'])
+        names = [img.name for img in self.p1.search_images('ubuntu', 2, 2)]
+        self.assertEquals(names, ['my ubuntu'])
+        names = [img.name for img in self.p1.search_images('ami-3')]
+        self.assertEquals(names, ['debian'])
+
+    def test_search_imported_images(self):
+        '''Should store the lowercase name of imported images'''
+        self.p1.import_images()
+        for name, search_name in Image.objects.filter(
+                provider=self.p1).values_list('name', 'search_name'):
+            self.assertEquals(search_name, name.lower())
+        image = Image.objects.filter(provider=self.p1)[0]
+        self.assertTrue(image in self.p1.search_images(image.name.upper()))
+
+    def test_search_view(self):
+        '''Should return a page of matching images as JSON'''
+        response = self.client.get(
+            '/node/image/search/', {'provider': self.p1.id, 'q': 'ubuntu'})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals(data['has_next'], False)
+        self.assertEquals([img['image_id'] for img in data['results']],
+            ['ami-0', 'ami-4', 'ami-2'])
+
+    def test_add_searched_image(self):
+        '''Should mark the image picked from the search as favorite'''
+        img = Image.objects.get(provider=self.p1, image_id='ami-1')
+        response = self.client.post('/node/image/add/',
+            {'provider': self.p1.id, 'favimage1': '', 'favimage2': img.id})
+        self.assertEquals(json.loads(response.content)['image_id'], 'ami-1')
+        self.assertTrue(Image.objects.get(id=img.id).favorite)
+
+    def test_add_image_of_other_provider(self):
+        '''Should reject an image belonging to another provider'''
+        p2 = Provider(name="prov2", provider_type="DUMMY", access_key="keyzz2")
+        p2.save()
+        img = Image(image_id='ami-9', name='other', provider=p2)
+        img.save()
+        response = self.client.post('/node/image/add/',
+            {'provider': self.p1.id, 'favimage1': '', 'favimage2': img.id})
+        self.assertTrue('Invalid image id' in response.content)
+        self.assertFalse(Image.objects.get(id=img.id).favorite)
+
+
+class NodeFormCacheTest(BaseProvisioningTestCase):
+    def setUp(self):
+        super(NodeFormCacheTest, self).setUp()
+        self.p1.import_images()
+        self.p1.import_locations()
+        self.p1.import_sizes()
+        self.image = Image.objects.filter(provider=self.p1)[0]
+        self.image.favorite = True
+        self.image.save()
+
+    def test_cached_form_queries(self):
+        '''Should render a cached form without catalog queries'''
+        NodeForm(self.p1.id)
+        def render():
+            form = NodeForm(self.p1.id)
+            form.as_p()
+            return form
+        form, sql = self.capture_queries(render)
+        # Only the catalog version
+        self.assertEquals(len(sql), 1)
+        self.assertTrue('provisioning_changeversion' in sql[0])
+        self.assertEquals(form.fields['image'].choices,
+            [(self.image.id, self.image.name)])
+        self.assertEquals(len(form.fields['size'].choices), 4)
+
+    def test_clean_with_cached_objects(self):
+        '''Should resolve the submitted ids to catalog objects'''
+        size = Size.objects.filter(provider=self.p1)[0]
+        location = Location.objects.get(provider=self.p1)
+        form = NodeForm(self.p1.id, {'provider': self.p1.id, 'name': 'node1',
+            'image': self.image.id, 'size': size.id, 'location': location.id})
+        self.assertTrue(form.is_valid())
+        self.assertEquals(form.cleaned_data['image'], self.image)
+        self.assertEquals(form.cleaned_data['size'], size)
+        self.assertEquals(form.cleaned_data['location'], location)
+
+    def test_invalidate_on_catalog_change(self):
+        '''Should rebuild the choices when the catalog changes'''
+        NodeForm(self.p1.id)
+        other = Image.objects.filter(provider=self.p1).exclude(id=self.image.id)[0]
+        other.favorite = True
+        other.save()
+        self.assertEquals(len(NodeForm(self.p1.id).fields['image'].choices), 2)
+
+        Size.objects.filter(provider=self.p1).update(name='renamed')
+        self.p1.import_sizes()
+        choices = NodeForm(self.p1.id).fields['size'].choices
+        self.assertFalse('renamed' in [name for size_id, name in choices])
+
+    def test_invalidate_from_other_process(self):
+        '''Should rebuild the choices when another process changed the
+        catalog, without touching this process' cache'''
+        NodeForm(self.p1.id)
+        Image.objects.filter(provider=self.p1).update(favorite=True)
+        self.assertEquals(len(NodeForm(self.p1.id).fields['image'].choices), 1)
+        ChangeVersion.objects.filter(name='catalog.%s' % self.p1.id).update(
+            version=F('version') + 1)
+        self.assertEquals(len(NodeForm(self.p1.id).fields['image'].choices),
+            Image.objects.filter(provider=self.p1).count())
+
+
+class ExtraDataTest(TestCase):
+    def test_extra_data_columns(self):
+        '''Should copy selected extra data keys to their columns'''
+        node = Node()
+        self.assertTrue(node.save_extra_data(
+            {'product': 'EQ 4', 'location': 'DC 12', 'traffic': '5 TB'}))
+        self.assertEquals(node.instance_type, 'EQ 4')
+        self.assertEquals(node.availability_zone, 'DC 12')
+        
+        node.save_extra_data({'instancetype': 'm1.small'})
+        self.assertEquals(node.instance_type, 'm1.small')
+        self.assertEquals(node.availability_zone, '')
+    
+    def test_extra_data_unchanged(self):
+        '''Should report unchanged extra data'''
+        node = Node()
+        node.save_extra_data({'a': 1, 'b': 2})
+        self.assertFalse(node.save_extra_data({'b': 2, 'a': 1}))
+        self.assertTrue(node.save_extra_data({'a': 1}))
+    
+    def test_extra_data_cached(self):
+        '''Should decode extra data only once'''
+        node = Node()
+        node.save_extra_data({'a': 1})
+        self.assertTrue(node.extra_data() is node.extra_data())
+        node.save_extra_data({'a': 2})
+        self.assertEquals(node.extra_data(), {'a': 2})
+
+
+class HetznerPluginTest(TestCase):
+    def setUp(self):
+        # Start with a full request budget
+        ratelimit.limiter.clear()
+        self.robot = FakeRobot(servers=5, failures={
+            '10.0.0.2': 1, '10.0.0.3': 5}).start()
+        self.driver = plugins.get_driver('hetzner')(
+            'user', 'password', host=self.robot.host, concurrency=3)
+    
+    def tearDown(self):
+        self.driver.connection.close()
+        self.robot.shutdown()
+        self.robot.server_close()
+    
+    def test_list_nodes(self):
+        '''Should retry failed server details without failing the listing'''
+        nodes = self.driver.list_nodes()
+        self.assertEquals([n.public_ip[0] for n in nodes], self.robot.ips)
+        self.assertEquals(nodes[1].extra['extra_ips'], '10.0.0.2')
+        self.assertEquals(self.robot.requests['/server/10.0.0.2'], 2)
+        # Gave up after 2 retries
+        self.assertEquals(nodes[2].extra['extra_ips'], '')
+        self.assertEquals(self.robot.requests['/server/10.0.0.3'], 3)
+    
+    def test_list_nodes_cached(self):
+        '''Should serve server details from the cache'''
+        self.driver.list_nodes()
+        nodes = self.driver.list_nodes()
+        self.assertEquals(nodes[0].extra['extra_ips'], '10.0.0.1')
+        self.assertEquals(self.robot.requests['/server'], 2)
+        self.assertEquals(self.robot.requests['/server/10.0.0.1'], 1)
+    
+    def test_cached_not_throttled(self):
+        '''Should only take tokens for requests sent to the API'''
+        bucket = self.driver.connection.throttle.bucket
+        self.driver.list_nodes()
+        tokens = bucket.tokens
+        self.driver.list_nodes()
+        # The server list and 3 attempts for the details of 10.0.0.3,
+        # which failed the first time so were not cached
+        self.assertEquals(round(tokens - bucket.tokens), 4)
+        self.assertEquals(self.robot.requests['/server/10.0.0.1'], 1)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.robot = FakeRobot(servers=3).start()
+        self.http = httplib2.Http()
+    
+    def tearDown(self):
+        self.robot.shutdown()
+        self.robot.server_close()
+    
+    def test_ttl(self):
+        '''Should only cache urls with a ttl'''
+        cache = ResponseCache(ttls=[(r'/server/', 60)])
+        for i in range(2):
+            cache.request(self.http, self.robot.host + 'server')
+            cache.request(self.http, self.robot.host + 'server/10.0.0.1')
+        self.assertEquals(self.robot.requests['/server'], 2)
+        self.assertEquals(self.robot.requests['/server/10.0.0.1'], 1)
+        self.assertEquals(cache.stats()['hits'], 1)
+    
+    def test_lru(self):
+        '''Should evict the least recently used response'''
+        cache = ResponseCache(max_entries=2, default_ttl=60)
+        for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.3']:
+            cache.request(self.http, self.robot.host + 'server/' + ip)
+        self.assertEquals(cache.stats()['evictions'], 1)
+        self.assertEquals(sorted([k[1][-8:] for k in cache.entries.keys()]),
+            ['10.0.0.1', '10.0.0.3'])
+    
+    def test_revalidate(self):
+        '''Should revalidate stale responses with their ETag'''
+        cache = ResponseCache()
+        for i in range(2):
+            response, content = cache.request(
+                self.http, self.robot.host + 'server/10.0.0.1')
+        self.assertEquals(response['status'], '200')
+        self.assertEquals(json.loads(content)['server']['ip'], ['10.0.0.1'])
+        self.assertEquals(cache.stats()['revalidated'], 1)
+    
+    def test_persist(self):
+        '''Should store entries as JSON and never unpickle cache files'''
+        location = tempfile.mkdtemp()
+        try:
+            url = self.robot.host + 'server/10.0.0.1'
+            cache = ResponseCache(location, default_ttl=60)
+            response, content = cache.request(self.http, url, user='u1')
+            filename = cache._filename(('u1', url))
+            json.load(open(filename))
+            open(os.path.join(location, 'old'), 'wb').write(
+                cPickle.dumps({'key': ('u1', 'http://old/')}))
+            cache = ResponseCache(location, default_ttl=60)
+            self.assertEquals(cache.request(self.http, url, user='u1'),
+                (response, content))
+            self.assertEquals(self.robot.requests['/server/10.0.0.1'], 1)
+            self.assertEquals(cache.entries.keys(), [('u1', url)])
+            self.assertEquals(os.listdir(location), [os.path.basename(filename)])
+            cache.invalidate()
+            # Files removed meanwhile are not an error
+            cache.set(('u1', url), response, content)
+            os.remove(filename)
+            cache.invalidate()
+        finally:
+            shutil.rmtree(location)
+    
+    def test_post_not_cached(self):
+        '''Should always send POST requests'''
+        cache = ResponseCache(default_ttl=60)
+        cache.request(self.http, self.robot.host + 'server', 'POST')
+        self.assertEquals(cache.stats()['entries'], 0)
+
+
+class PluginManifestTest(TestCase):
+    def test_manifest_up_to_date(self):
+        '''The plugin manifest should match the plugins' metadata'''
+        self.assertEquals(plugins.load_plugins(), plugins.load_plugins(eager=True))
+    
+    def test_offline_plugins(self):
+        '''Should only register the simulated clouds when enabled'''
+        offline = [name for name, meta in plugins.load_plugins().items()
+            if meta['offline']]
+        self.assertEquals(sorted(offline), ['simulated', 'synthetic'])
+        providers = PROVIDERS.copy()
+        try:
+            PROVIDERS.clear()
+            provider_meta.add_plugins()
+            self.assertEquals(sorted(PROVIDERS), ['dedicated', 'hetzner'])
+        finally:
+            PROVIDERS.clear()
+            PROVIDERS.update(providers)
+
+
+class DecommissionTest(BaseProvisioningTestCase):
+    def create_node(self, name):
+        node = Node(name=name, uuid=name, provider=self.p1, public_ip="10.0.0.1")
+        node.save()
+        return node
+    
+    def test_decommission(self):
+        '''Should use the first free DECOM name'''
+        self.create_node("DECOM1-web")
+        node = self.create_node("web")
+        node.decommission()
+        node = Node.objects.get(id=node.id)
+        self.assertEquals(node.name, "DECOM2-web")
+        self.assertEquals(node.environment, 'Decommissioned')
+        self.assertEquals(node.state, 'Terminated')
+    
+    def test_decommission_nodes(self):
+        '''Should decommission many nodes at once'''
+        self.create_node("DECOM1-web1")
+        self.create_node("DECOM2-web1")
+        nodes = [self.create_node("web%s" % i) for i in range(1, 4)]
+        self.assertEquals(self.p1.decommission_nodes(nodes), 3)
+        self.assertEquals(
+            [n.name for n in Node.objects.filter(id__in=[n.id for n in nodes])],
+            ["DECOM3-web1", "DECOM1-web2", "DECOM1-web3"])
+        self.assertEquals(Node.objects.filter(
+            environment='Decommissioned', state='Terminated').count(), 3)
+    
+    def test_decom_names(self):
+        '''Should only fetch the DECOM names of the given names'''
+        for name in ("DECOM1-web-1", "DECOM1-db", "DECOM1-db-2"):
+            self.create_node(name)
+        newnames, sql = self.capture_queries(
+            decom_names, self.p1, ["web-1", "1", "2"])
+        self.assertEquals(newnames, ["DECOM2-web-1", "DECOM1-1", "DECOM1-2"])
+        self.assertEquals(len(sql), 1)
+        self.assertTrue("%-web-1" in sql[0])
+
+
+class SyntheticPluginTest(TestCase):
+    def setUp(self):
+        controller_pool.clear()
+        self.p = Provider(name="synth", provider_type="synthetic",
+            access_key="synth", extra_param_name="options",
+            extra_param_value="nodes=20&images=5&sizes=2&locations=1")
+        self.p.save()
+        self.p.conn.conn.ex_reset()
+    
+    def test_import(self):
+        '''Should import the configured numbers of nodes and catalog items'''
+        self.assertEquals(self.p.import_images()['created'], 5)
+        self.assertEquals(self.p.import_sizes()['created'], 2)
+        self.assertEquals(self.p.import_locations()['created'], 1)
+        self.assertEquals(self.p.import_nodes()['created'], 20)
+        node = Node.objects.filter(provider=self.p)[0]
+        self.assertEquals(node.size.size_id, node.instance_type)
+        self.assertEquals(node.location.location_id, 'loc-0')
+    
+    def test_churn(self):
+        '''Should destroy, create and terminate nodes'''
+        self.p.import_nodes()
+        self.assertEquals(self.p.conn.conn.ex_churn(0.1), 2)
+        stats = self.p.import_nodes()
+        self.assertEquals(stats['created'], 2)
+        self.assertEquals(stats['decommissioned'], 2)
+        self.assertEquals(Node.objects.filter(
+            provider=self.p, state='Terminated').count(), 4)
+
+
+class BenchmarkTest(TestCase):
+    def test_run(self):
+        '''Should measure every stage of a small fleet'''
+        controller_pool.clear()
+        results = fleet.run(providers=2, images=10, sizes=4, locations=2,
+            nodes=40, churn=0.1, decommission=5)
+        self.assertEquals([s['name'] for s in results['stages']], [
+            'seed', 'import_images', 'import_sizes_locations',
+            'import_nodes_first', 'import_nodes_resync', 'update_cycle',
+            'refresh_cycle', 'import_nodes_churn', 'decommission', 'overview',
+            'api_nodes'])
+        stages = dict([(s['name'], s) for s in results['stages']])
+        self.assertEquals(stages['import_nodes_first']['detail']['created'], 40)
+        self.assertEquals(stages['import_nodes_resync']['detail']['unchanged'], 40)
+        self.assertEquals(stages['refresh_cycle']['detail']['unchanged'], 40)
+        self.assertTrue(stages['refresh_cycle']['queries'] <
+            stages['update_cycle']['queries'])
+        self.assertEquals(stages['import_nodes_churn']['detail']['created'], 4)
+        self.assertTrue(stages['overview']['queries'] > 0)
+        # Resident memory after each stage, not the peak of the process
+        if fleet.resident_memory() is not None:
+            for s in results['stages']:
+                self.assertTrue(s['rss_kb'] > 0)
+                self.assertEquals(type(s['rss_delta_kb']), int)
+        self.assertEquals(len(fleet.compare(results, results)), 11)
+
+
+class SimulatedPluginTest(TestCase):
+    def create_provider(self, options):
+        controller_pool.clear()
+        cache.clear()
+        p = Provider(name="sim", provider_type="simulated", access_key="sim",
+            extra_param_name="options", extra_param_value=options)
+        p.save()
+        p.conn.conn.ex_reset()
+        return p
+
+    def test_pagination(self):
+        '''Should send one request per page of nodes'''
+        p = self.create_provider("nodes=25&page_size=10")
+        self.assertEquals(p.import_nodes()['created'], 25)
+        self.assertEquals(p.conn.conn.calls['list_nodes'], 3)
+
+    def test_latency(self):
+        '''Should delay calls by their configured latency'''
+        p = self.create_provider(
+            "nodes=1&distribution=constant&list_nodes_latency=0.1")
+        start = time.time()
+        p.conn.get_nodes()
+        self.assertTrue(time.time() - start >= 0.1)
+
+    def test_throttling(self):
+        '''Should refuse requests above the allowed rate'''
+        p = self.create_provider("nodes=50&page_size=10&rate=1&burst=3")
+        self.assertRaises(simulated.ThrottledError, p.conn.conn.list_nodes)
+
+    def test_failures(self):
+        '''Should fail requests at the configured rate'''
+        p = self.create_provider("nodes=1&failure_rate=1")
+        self.assertRaises(LibcloudError, p.import_images)
+
+    def test_boot(self):
+        '''Should keep new and rebooted nodes in transitional states'''
+        p = self.create_provider("nodes=0&boot_time=0.1")
+        p.import_images()
+        p.import_sizes()
+        p.import_locations()
+        image = Image.objects.filter(provider=p)[0]
+        image.favorite = True
+        image.save()
+        form = NodeForm(p.id, {'provider': p.id, 'name': 'web1',
+            'image': image.id,
+            'size': Size.objects.filter(provider=p)[0].id,
+            'location': Location.objects.get(provider=p).id})
+        self.assertTrue(form.is_valid())
+        error, data = p.create_node(form)
+        self.assertEquals(error, None)
+        self.assertEquals(data['state'], NodeState.PENDING)
+        time.sleep(0.1)
+        node = p.conn.get_nodes()[0]
+        self.assertEquals(node.state, NodeState.RUNNING)
+        p.conn.conn.reboot_node(node)
+        self.assertEquals(p.conn.get_nodes()[0].state, NodeState.REBOOTING)
+
+
+class MetricsTest(BaseProvisioningTestCase):
+    def test_provider_calls(self):
+        '''Should count controller calls and failures per operation'''
+        labels = {'provider': 'prov1', 'provider_type': 'DUMMY',
+            'operation': 'get_nodes'}
+        calls = metrics.provider_calls.get(**labels)
+        errors = metrics.provider_errors.get(**labels)
+        self.p1.import_nodes()
+        def fail():
+            raise Exception("API down")
+        self.p1.conn.conn.list_nodes = fail
+        self.assertRaises(Exception, self.p1.import_nodes)
+        self.assertEquals(metrics.provider_calls.get(**labels), calls + 2)
+        self.assertEquals(metrics.provider_errors.get(**labels), errors + 1)
+        self.assertTrue(metrics.sync_errors.get(
+            provider='prov1', stage='import_nodes') > 0)
+
+    def test_sync_stage(self):
+        '''Should record the duration and row counts of sync stages'''
+        count = metrics.sync_duration.get(provider='prov1', stage='import_sizes')[1]
+        created = metrics.sync_rows.get(
+            provider='prov1', stage='import_sizes', outcome='created')
+        self.p1.import_sizes()
+        self.assertEquals(metrics.sync_duration.get(
+            provider='prov1', stage='import_sizes')[1], count + 1)
+        self.assertEquals(metrics.sync_rows.get(provider='prov1',
+            stage='import_sizes', outcome='created'), created + 4)
+
+    def test_render(self):
+        '''Should render cumulative histogram buckets'''
+        registry = metrics.Registry()
+        h = registry.register(metrics.Histogram('latency', 'Latency', ('op',),
+            buckets=(0.1, 1)))
+        h.observe(0.05, op='list')
+        h.observe(0.5, op='list')
+        self.assertEquals(registry.render(), '\n'.join([
+            '# HELP latency Latency',
+            '# TYPE latency histogram',
+            'latency_bucket{op="list",le="0.1"} 1.0',
+            'latency_bucket{op="list",le="1.0"} 2.0',
+            'latency_bucket{op="list",le="+Inf"} 2.0',
+            'latency_sum{op="list"} 0.55',
+            'latency_count{op="list"} 2.0',
+        ]) + '\n')
+
+    def test_serve(self):
+        '''Should serve the metrics of the process over HTTP'''
+        self.p1.import_sizes()
+        server = metrics.serve(0, '127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:%s/' % server.server_address[1]
+            response, content = httplib2.Http().request(url + 'metrics')
+            self.assertEquals(response.status, 200)
+            self.assertTrue('overmind_sync_rows_total{provider="prov1",'
+                'stage="import_sizes",outcome="created"}' in content)
+            response, content = httplib2.Http().request(url + 'other')
+            self.assertEquals(response.status, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class SQLProfileTest(BaseProvisioningTestCase):
+    def setUp(self):
+        super(SQLProfileTest, self).setUp()
+        self.middleware = settings.MIDDLEWARE_CLASSES
+        settings.MIDDLEWARE_CLASSES += (
+            'provisioning.middleware.SQLProfileMiddleware',)
+        self.sample_rate = settings.SQL_PROFILE_SAMPLE_RATE
+        settings.SQL_PROFILE_SAMPLE_RATE = 1
+        self.user = User.objects.create_user(
+            username='testuser', email='t@t.com', password='test1')
+        self.user.groups.add(Group.objects.get(name='Operator'))
+        self.client = Client()
+        self.client.login(username='testuser', password='test1')
+
+    def tearDown(self):
+        settings.MIDDLEWARE_CLASSES = self.middleware
+        settings.SQL_PROFILE_SAMPLE_RATE = self.sample_rate
+
+    def test_fingerprint(self):
+        '''Should ignore the parameters of statements'''
+        self.assertEquals(
+            middleware.fingerprint('SELECT * FROM t WHERE id IN (%s, %s) AND x = 5'),
+            middleware.fingerprint('SELECT  * FROM t WHERE id IN (%s) AND x = 7'))
+
+    def test_n_plus_one(self):
+        '''Should flag statements repeated more than the threshold'''
+        profile = middleware.Profile()
+        profile.record('SELECT * FROM node', 0.01)
+        for i in range(3):
+            profile.record('SELECT * FROM image WHERE id = %s', 0.001)
+        self.assertEquals(profile.queries, 4)
+        self.assertEquals([d[0] for d in profile.duplicates()], [3])
+        self.assertEquals(profile.n_plus_one(3), [])
+        self.assertEquals(len(profile.n_plus_one(2)), 1)
+
+    def test_profile_requests(self):
+        '''Should record the queries of every sampled request'''
+        self.p1.import_nodes()
+        endpoint = 'provisioning.views.overview'
+        count = middleware.sql_queries.get(endpoint=endpoint)[1]
+        response = self.client.get('/overview/')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            middleware.sql_queries.get(endpoint=endpoint)[1], count + 1)
+        self.assertTrue(middleware.sql_queries.get(endpoint=endpoint)[0] > 0)
+        # The profiler is removed once the request is finished
+        self.assertFalse('cursor' in connection.__dict__)
+
+
+class PollerTest(TestCase):
+    def setUp(self):
+        controller_pool.clear()
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', email='t@t.com', password='test1')
+    
+    def create_nodes(self, options, names):
+        p = Provider(name="sim", provider_type="simulated", access_key="poll",
+            extra_param_name="options", extra_param_value=options)
+        p.save()
+        p.conn.conn.ex_reset()
+        p.import_images()
+        p.import_sizes()
+        p.import_locations()
+        image = Image.objects.filter(provider=p)[0]
+        image.favorite = True
+        image.save()
+        error, errors, outcomes = batch.create_nodes({'provider': p.id,
+            'names': names, 'image': image.id,
+            'size': Size.objects.filter(provider=p)[0].id,
+            'location': Location.objects.get(provider=p).id}, self.user)
+        self.assertEquals([o['status'] for o in outcomes],
+            ['created'] * len(names.split(',')))
+        return p
+    
+    def test_backoff(self):
+        '''Should poll transitional nodes less and less often'''
+        p = self.create_nodes("nodes=0&boot_time=100", "web1,web2")
+        p.create_connection()
+        poller = Poller(min_interval=1, max_interval=4, workers=1)
+        now = time.time()
+        polled = []
+        for t in [0, 1, 2, 3, 6, 7, 11]:
+            polled.append(poller.poll(now + t)['polled'])
+        self.assertEquals(polled, [0, 2, 0, 2, 0, 2, 2])
+        # One listing per provider and poll
+        self.assertEquals(p.conn.conn.calls['list_nodes'], 4)
+        self.assertEquals(Node.objects.filter(state='Pending').count(), 2)
+    
+    def test_settle(self):
+        '''Should save the new state and forget nodes once they settle'''
+        p = self.create_nodes("nodes=0&boot_time=0.1", "web1,web2")
+        poller = Poller(min_interval=0.1)
+        self.assertEquals(poller.poll()['polled'], 0)
+        time.sleep(0.1)
+        version = get_versions(['node'])['node']
+        stats = poller.poll()
+        self.assertEquals(stats, {'polled': 2, 'changed': 2, 'settled': 2})
+        # One version bump for all the saved states
+        self.assertEquals(get_versions(['node'])['node'], version + 1)
+        self.assertEquals(poller.schedule, {})
+        self.assertEquals(Node.objects.filter(state='Running').count(), 2)
+        
+        # Rebooted nodes are polled until they run again
+        node = Node.objects.get(name='web1')
+        self.assertTrue(node.reboot())
+        self.assertEquals(Node.objects.get(id=node.id).state, 'Rebooting')
+        poller.run(interval=0.05, until_settled=True)
+        self.assertEquals(Node.objects.get(id=node.id).state, 'Running')
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        controller_pool.clear()
+        ratelimit.limiter.clear()
+        cache.clear()
+        self.backoff = settings.RATE_LIMIT_BACKOFF
+        settings.RATE_LIMIT_BACKOFF = 0.05
+        self.rate_limit = PROVIDERS['simulated'].get('rate_limit')
+    
+    def tearDown(self):
+        settings.RATE_LIMIT_BACKOFF = self.backoff
+        if self.rate_limit is None:
+            PROVIDERS['simulated'].pop('rate_limit', None)
+        else:
+            PROVIDERS['simulated']['rate_limit'] = self.rate_limit
+    
+    def create_provider(self, options):
+        p = Provider(name="sim", provider_type="simulated", access_key="limit",
+            extra_param_name="options", extra_param_value=options)
+        p.save()
+        p.conn.conn.ex_reset()
+        return p
+    
+    def test_token_bucket(self):
+        '''Should allow bursts and then wait for new tokens'''
+        bucket = ratelimit.TokenBucket(20, 2)
+        self.assertEquals(bucket.acquire(), 0)
+        self.assertEquals(bucket.acquire(), 0)
+        start = time.time()
+        self.assertTrue(bucket.acquire() > 0)
+        self.assertTrue(time.time() - start >= 0.04)
+    
+    def test_is_throttled(self):
+        '''Should recognize the throttling errors of providers'''
+        self.assertTrue(ratelimit.is_throttled(
+            ratelimit.ThrottledError('Slow down', driver=None)))
+        self.assertTrue(ratelimit.is_throttled(
+            Exception('RequestLimitExceeded: Request limit exceeded.')))
+        self.assertFalse(ratelimit.is_throttled(Exception('Server not found')))
+        self.assertFalse(ratelimit.is_throttled(Exception()))
+    
+    def test_retry_throttled(self):
+        '''Should retry throttled calls with backoff until they succeed'''
+        p = self.create_provider("nodes=5&page_size=0&rate=20&burst=1")
+        throttled = ratelimit.throttled_calls.get(provider_type='simulated')
+        backoffs = ratelimit.rate_limit_wait.get(
+            provider_type='simulated', reason='backoff')[1]
+        p.conn.get_nodes()
+        self.assertEquals(len(p.conn.get_nodes()), 5)
+        self.assertTrue(ratelimit.throttled_calls.get(
+            provider_type='simulated') > throttled)
+        self.assertTrue(ratelimit.rate_limit_wait.get(
+            provider_type='simulated', reason='backoff')[1] > backoffs)
+    
+    def test_give_up(self):
+        '''Should fail once the retries run out and not retry other errors'''
+        throttle = ratelimit.Throttle('simulated')
+        calls = []
+        def throttled():
+            calls.append(1)
+            raise ratelimit.ThrottledError('Slow down', driver=None)
+        retries = settings.RATE_LIMIT_RETRIES
+        settings.RATE_LIMIT_RETRIES = 2
+        try:
+            self.assertRaises(ratelimit.ThrottledError, throttle.call, throttled)
+        finally:
+            settings.RATE_LIMIT_RETRIES = retries
+        self.assertEquals(len(calls), 3)
+        def fail():
+            calls.append(1)
+            raise Exception('API down')
+        self.assertRaises(Exception, throttle.call, fail)
+        self.assertEquals(len(calls), 4)
+    
+    def test_rate_limit(self):
+        '''Should keep calls under the provider type's rate limit'''
+        PROVIDERS['simulated']['rate_limit'] = [20, 1]
+        p = self.create_provider("nodes=5&page_size=0&rate=20&burst=1")
+        throttled = ratelimit.throttled_calls.get(provider_type='simulated')
+        waits = ratelimit.rate_limit_wait.get(
+            provider_type='simulated', reason='bucket')
+        for i in range(3):
+            p.conn.get_nodes()
+        self.assertEquals(
+            ratelimit.throttled_calls.get(provider_type='simulated'), throttled)
+        total, count = ratelimit.rate_limit_wait.get(
+            provider_type='simulated', reason='bucket')
+        self.assertEquals(count, waits[1] + 3)
+        self.assertTrue(total - waits[0] >= 0.08)
+    
+    def test_hetzner_throttled(self):
+        '''Should back off when the Hetzner API refuses requests'''
+        robot = FakeRobot(servers=2, throttled=2).start()
+        try:
+            driver = plugins.get_driver('hetzner')(
+                'throttled', 'password', host=robot.host)
+            nodes = driver.list_nodes()
+            driver.connection.close()
+        finally:
+            robot.shutdown()
+            robot.server_close()
+        self.assertEquals(len(nodes), 2)
+        self.assertEquals(robot.requests['/server'], 3)
@@ -3,70 +3,117 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.decorators import login_required, permission_required
 from django.template import RequestContext
+from django.core.paginator import Paginator, EmptyPage
+from django.utils.http import urlencode
 from libcloud.types import InvalidCredsException
 
 from provisioning.models import Action, Provider, Node, get_state, Image
+from provisioning.models import capabilities
 from provisioning.forms import ProviderForm, NodeForm, AddImageForm, ProfileEditForm
 from provisioning.forms import UserCreationFormExtended, UserEditForm
 from provisioning.provider_meta import PROVIDERS
+from provisioning.sync import sync_providers
+from provisioning.batch import build_node
+from provisioning import jobs
 import logging
 import simplejson as json
 
+# Number of nodes shown per overview page
+NODES_PER_PAGE = 100
+# Number of results returned per image search page
+IMAGES_PER_PAGE = 20
+
+def node_actions(node, shown_actions):
+    '''Returns the actions a user can apply to a node. shown_actions are the
+    names of the node's provider actions with show=True
+    '''
+    actions_list = []
+    if 'reboot' in shown_actions:
+        actions_list.append({
+            'action': 'reboot',
+            'label': 'reboot',
+            'confirmation': 'Are you sure you want to reboot the node "%s"'\
+            % node.name,
+        })
+    
+    if 'destroy' in shown_actions:
+        actions_list.append({
+            'action': 'destroy',
+            'label': 'destroy',
+            'confirmation': 'This action will completely destroy the node %s'\
+            % node.name,
+        })
+    else:
+        actions_list.append({
+            'action': 'destroy',
+            'label': 'delete',
+            'confirmation': 'This action will remove the node %s with IP %s' % (node.name, node.public_ip),
+        })
+    return actions_list
+
+def node_datatable(node):
+    '''Renders the tooltip table with a node's details'''
+    fields = [
+        ['Created by', node.creator],
+        ['Created at', node.timestamp.strftime('%Y-%m-%d %H:%M:%S')],
+        ['OS image', node.image],
+        ['Location', node.location],
+        ['Size', node.size],
+        ['-----', '--'],
+    ]
+    fields.extend(node.extra_data().items())
+    rows = ["<tr><td>%s:</td><td>%s</td></tr>" % (key, val) for key, val in fields]
+    return u"<table>%s</table>" % u"".join(rows)
+
 @login_required
 def overview(request):
+    '''Paginated list of nodes, which can be filtered by provider, state
+    and environment. The number of queries doesn't depend on the number
+    of nodes
+    '''
     provider_list = Provider.objects.all()
+    
+    # Invalid filter values are ignored
+    filters = {}
+    provider_id = request.GET.get('provider', '')
+    if provider_id.isdigit():
+        filters['provider'] = provider_id
+    for field, choices in [('state', Node.STATE_CHOICES),
+            ('environment', Node.ENVIRONMENT_CHOICES)]:
+        value = request.GET.get(field)
+        if value in [key for key, label in choices]:
+            filters[field] = value
+    query = Node.objects.filter(**filters).select_related(
+        'provider', 'image', 'location', 'size').order_by('id')
+    if filters.get('environment') != 'Decommissioned':
+        query = query.exclude(environment='Decommissioned')
+    
+    paginator = Paginator(query, NODES_PER_PAGE)
+    try:
+        page = paginator.page(int(request.GET.get('page', 1)))
+    except (ValueError, EmptyPage):
+        page = paginator.page(paginator.num_pages)
+    
+    can_change = request.user.has_perm('provisioning.change_node')
+    if can_change:
+        capabilities.load(set([n.provider_id for n in page.object_list]))
+    
     nodes = []
-    #TODO: Optimize for hundreds of nodes
-    for n in Node.objects.exclude(environment='Decommissioned'):
-        datatable = "<table>"
-        fields = [
-            ['Created by', n.creator],
-            ['Created at', n.timestamp.strftime('%Y-%m-%d %H:%M:%S')],
-            ['OS image', n.image],
-            ['Location', n.location],
-            ['Size', n.size],
-            ['-----', '--'],
-        ]
-        for key, val in n.extra_data().items():
-            fields.append([key, val])
-        
-        for field in fields:
-            datatable += "<tr><td>" + field[0] + ":</td><td>" + str(field[1])
-            datatable += "</td></tr></td>"
-        datatable += "</table>"
-        
+    for n in page.object_list:
         actions_list = []
-        if n.state != 'Terminated' and \
-            request.user.has_perm('provisioning.change_node'):
-            actions = n.provider.actions.filter(show=True)
-            
-            if actions.filter(name='reboot'):
-                actions_list.append({
-                    'action': 'reboot',
-                    'label': 'reboot',
-                    'confirmation': 'Are you sure you want to reboot the node "%s"'\
-                    % n.name,
-                })
-            
-            if actions.filter(name='destroy'):
-                actions_list.append({
-                    'action': 'destroy',
-                    'label': 'destroy',
-                    'confirmation': 'This action will completely destroy the node %s'\
-                    % n.name,
-                })
-            else:
-                actions_list.append({
-                    'action': 'destroy',
-                    'label': 'delete',
-                    'confirmation': 'This action will remove the node %s with IP %s' % (n.name, n.public_ip),
-                })
-        
-        nodes.append({ 'node': n, 'data': datatable, 'actions': actions_list })
+        if n.state != 'Terminated' and can_change:
+            actions_list = node_actions(n, capabilities.shown(n.provider_id))
+        nodes.append({ 'node': n, 'data': node_datatable(n), 'actions': actions_list })
     
     variables = RequestContext(request, {
         'nodes': nodes,
+        'sync_summary': request.session.pop('sync_summary', None),
+        'page': page,
+        'filters': filters,
+        'filter_query': urlencode(filters),
         'provider_list': provider_list,
+        'state_choices': Node.STATE_CHOICES,
+        'environment_choices': Node.ENVIRONMENT_CHOICES,
     })
     return render_to_response('overview.html', variables)
 
@@ -111,11 +158,8 @@ def save_provider(form):
         provider = None
         try:
             provider = form.save()
-            #TODO: defer importing to a work queue
-            provider.import_images()
-            provider.import_locations()
-            provider.import_sizes()
-            provider.import_nodes()
+            # Importing can take minutes. Leave it to the worker
+            jobs.enqueue('import_provider', provider)
         except InvalidCredsException:
             # Delete provider if InvalidCreds is raised (by EC2)
             # after it has been saved
@@ -135,10 +179,13 @@ def save_provider(form):
 
 @login_required
 def updateproviders(request):
-    providers = Provider.objects.all()
-    for provider in providers:
-        if provider.supports('list'):
-            provider.update()
+    '''Syncs all providers. AJAX requests get the summary of every provider
+    as JSON, the others are redirected to the overview, which shows it once
+    '''
+    summary = sync_providers()
+    if request.is_ajax():
+        return HttpResponse(json.dumps(summary), mimetype='application/json')
+    request.session['sync_summary'] = summary
     return HttpResponseRedirect('/overview/')
 
 @permission_required('provisioning.delete_provider')
@@ -170,6 +217,30 @@ def addimage(request):
         form = AddImageForm(request.GET.get("provider"))
     return render_to_response('image_form.html', { 'form': form, 'error': error })
 
+@permission_required('provisioning.add_node')
+def searchimages(request):
+    '''Returns a page of the provider images matching q as JSON
+    Images whose name or image_id start with q are listed first
+    '''
+    provider = get_object_or_404(Provider, id=request.GET.get('provider') or 0)
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    results = []
+    if query:
+        # Ask for one more image to know whether there is a next page
+        results = provider.search_images(
+            query, (page - 1) * IMAGES_PER_PAGE, IMAGES_PER_PAGE + 1)
+    data = {
+        'page': page,
+        'has_next': len(results) > IMAGES_PER_PAGE,
+        'results': [{'id': img.id, 'image_id': img.image_id, 'name': img.name}
+            for img in results[:IMAGES_PER_PAGE]],
+    }
+    return HttpResponse(json.dumps(data), mimetype='application/json')
+
 @permission_required('provisioning.add_node')
 def newnode(request):
     error = None
@@ -180,10 +251,7 @@ def newnode(request):
             return HttpResponse('<p>success</p>')
     else:
         form = NodeForm(request.GET.get("provider"))
-        favcount = Image.objects.filter(
-            provider=request.GET.get("provider"),
-            favorite=True
-        ).count()
+        favcount = len(form.metadata['image']['choices'])
     if error == 'form':
         error = None
     return render_to_response('node_form.html',
@@ -212,12 +280,7 @@ def save_new_node(data, user):
             except Node.DoesNotExist:
                 error, data_from_provider = provider.create_node(form)
                 if error is None:
-                    node = form.save(commit = False)
-                    node.uuid      = data_from_provider['uuid']
-                    node.public_ip = data_from_provider['public_ip']
-                    node.state     = get_state(data_from_provider['state'])
-                    node.save_extra_data(data_from_provider.get('extra', ''))
-                    node.creator   = user.username
+                    node = build_node(form, data_from_provider, user)
                     try:
                         node.save()
                         logging.info('New node created %s' % node)
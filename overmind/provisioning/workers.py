@@ -0,0 +1,104 @@
+# Bounded thread pool to run slow provider calls concurrently
+from django.db import connection
+import Queue, threading, time, logging
+
+
+class Abandoned(Exception):
+    '''Raised by check_abandoned() in a call run_bounded gave up on'''
+
+
+# Event of the item the current worker thread runs, set on timeout
+_current = threading.local()
+
+def check_abandoned():
+    '''Raise Abandoned if run_bounded stopped waiting for the call running
+    in this thread. The call itself keeps running (threads can't be
+    killed), so functions run by run_bounded call this before writing to
+    the DB, which a timed out call must not do anymore
+    '''
+    event = getattr(_current, 'abandoned', None)
+    if event is not None and event.isSet():
+        raise Abandoned, 'Gave up waiting for the result'
+
+
+class Result(object):
+    '''Outcome of calling a function for one item'''
+    def __init__(self, item):
+        self.item      = item
+        self.value     = None
+        self.error     = None
+        self.duration  = None
+        self.timed_out = False
+
+
+def _run(func, result):
+    start = time.time()
+    try:
+        result.value = func(result.item)
+    except Exception, e:
+        logging.error('%s(%s) failed. %s: %s' % (
+            getattr(func, '__name__', func), result.item, type(e), e))
+        result.error = e
+    result.duration = time.time() - start
+
+def run_bounded(func, items, workers, timeout=None):
+    '''Call func(item) for every item using at most workers threads
+    Exceptions are caught and stored in each item's Result. An item that
+    takes longer than timeout seconds is reported as timed out and its
+    thread is abandoned, so one hung call doesn't hold up the rest.
+    The timeout only stops the waiting: an abandoned call runs on until it
+    returns, and must call check_abandoned() before writing its results.
+    With workers <= 1 everything runs inline in the calling thread and
+    timeout is not enforced.
+    Returns a list of Result objects in the same order as items
+    '''
+    items = list(items)
+    results = [Result(item) for item in items]
+    if workers <= 1:
+        for r in results:
+            _run(func, r)
+        return results
+
+    done = Queue.Queue()
+    abandoned = [threading.Event() for item in items]
+    def worker(index):
+        _current.abandoned = abandoned[index]
+        r = Result(items[index])
+        try:
+            _run(func, r)
+        finally:
+            # Every thread gets its own DB connection
+            connection.close()
+            done.put((index, r))
+
+    pending = range(len(items))
+    running = {}# index => start time
+    while pending or running:
+        while pending and len(running) < workers:
+            index = pending.pop(0)
+            t = threading.Thread(target=worker, args=(index,))
+            t.setDaemon(True)
+            running[index] = time.time()
+            t.start()
+
+        wait = None
+        if timeout is not None:
+            wait = max(0, min(running.values()) + timeout - time.time())
+        try:
+            index, r = done.get(True, wait)
+            # Ignore late results of abandoned threads
+            if index in running:
+                del running[index]
+                results[index] = r
+        except Queue.Empty:
+            now = time.time()
+            for index, started in running.items():
+                if now - started >= timeout:
+                    del running[index]
+                    abandoned[index].set()
+                    r = results[index]
+                    r.timed_out = True
+                    r.duration  = now - started
+                    r.error     = 'Timed out after %s seconds' % timeout
+                    logging.error('%s: %s' % (r.item, r.error))
+    return results
@@ -90,6 +90,74 @@ INSTALLED_APPS = (
 if DEBUG:
     INSTALLED_APPS += ('debug_toolbar',)
 
+# Provider synchronization: number of providers updated in parallel and
+# seconds after which a provider sync is given up
+SYNC_WORKERS = 4
+SYNC_TIMEOUT = 300
+
+# Batch node creation: nodes created at the provider in parallel, seconds
+# after which a creation is given up and maximum number of nodes per batch
+NODE_BATCH_WORKERS = 10
+NODE_BATCH_TIMEOUT = 900
+NODE_BATCH_MAX = 100
+
+# Node poller (manage.py pollnodes): seconds between checks for nodes in
+# transitional states and first and maximum delay between polls of a node
+NODE_POLL_INTERVAL = 1
+NODE_POLL_MIN_INTERVAL = 2
+NODE_POLL_MAX_INTERVAL = 60
+
+# Register the offline Simulated and Synthetic Cloud plugins, which are only
+# useful for tests and benchmarks (they turn them on themselves)
+ENABLE_SIMULATED_PROVIDERS = False
+
+# Ports at which runworker and pollnodes serve their metrics (/metrics in the
+# Prometheus text format), they are not seen by the web server's
+# /api/metrics. None to not serve them
+WORKER_METRICS_PORT = None
+POLLER_METRICS_PORT = None
+
+# Provider API rate limits: requests per second and burst per account by
+# provider type, overriding provider_meta (e.g. {'hetzner': [0.5, 10]}),
+# and retries of throttled calls, waiting a random time up to
+# RATE_LIMIT_BACKOFF * 2 ** retry seconds (at most RATE_LIMIT_MAX_BACKOFF)
+RATE_LIMITS = {}
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BACKOFF = 1
+RATE_LIMIT_MAX_BACKOFF = 60
+
+# Cached provider drivers: maximum number kept and seconds they are reused
+CONTROLLER_POOL_SIZE = 50
+CONTROLLER_POOL_TTL = 600
+# Seconds a provider's node listing is reused to find nodes to reboot/destroy
+NODE_INDEX_TTL = 30
+
+# Cache of plugin HTTP responses: directory where it is stored (None keeps
+# it in memory) and maximum number of responses kept
+PLUGIN_HTTP_CACHE_DIR = None
+PLUGIN_HTTP_CACHE_SIZE = 1000
+
+# SQL profiling (add 'provisioning.middleware.SQLProfileMiddleware' to
+# MIDDLEWARE_CLASSES): fraction of requests profiled and number of times a
+# statement can repeat in a request before it is logged as a possible N+1
+SQL_PROFILE_SAMPLE_RATE = 0.01
+SQL_PROFILE_REPEAT_THRESHOLD = 10
+
+# Seconds the location, size and image choices of the new node form are
+# cached. They are also outdated whenever a provider's catalog changes, in
+# every process: the cache key has a catalog version stored in the DB
+NODE_FORM_CACHE_TIMEOUT = 3600
+
+# Background jobs (manage.py runworker): seconds between queue polls and
+# base delay before retrying a failed job, doubled after every attempt
+JOB_POLL_INTERVAL = 5
+JOB_RETRY_DELAY = 30
+# Seconds a worker holds a running job without renewing it. Jobs of workers
+# that died are queued again once their lease expires
+JOB_LEASE = 300
+# Jobs returned per page by /api/jobs/ when no limit is given
+JOB_PAGE_SIZE = 100
+
 PUBLIC_KEY_FILE = "id_rsa.pub"
 PUBLIC_KEY = open(os.path.expanduser("~/.ssh/%s" % PUBLIC_KEY_FILE)).read()
 
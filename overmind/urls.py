@@ -22,6 +22,7 @@ urlpatterns += patterns('',
     (r'^provider/new/$', 'provisioning.views.newprovider'),
     (r'^node/new/$', 'provisioning.views.newnode'),
     (r'^node/image/add/$', 'provisioning.views.addimage'),
+    (r'^node/image/search/$', 'provisioning.views.searchimages'),
     # Update
     (r'^provider/update/$',\
         'provisioning.views.updateproviders'),